@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -43,8 +44,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'recipes.metrics.MetricsMiddleware',  # First, so request timings include the other middleware
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'recipes.media.ContentAddressedMediaMiddleware',  # Pictures, served like the static files above
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -77,13 +80,133 @@ WSGI_APPLICATION = 'recipe_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# DATABASE_URL selects the primary database (SQLite in db.sqlite3 by default). Connections are
+# kept for CONN_MAX_AGE seconds and checked before reuse; set CONN_MAX_AGE=0 under ASGI, where
+# every request gets its own connection anyway.
+# REPLICA_DATABASE_URL adds a read replica used by searches and the pantry (recipes/database.py).
+# Users who just wrote something keep reading from the primary for REPLICA_PIN_SECONDS.
+import dj_database_url
+
+CONN_MAX_AGE = int(os.environ.get('CONN_MAX_AGE', 500))
+
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+    'default': dj_database_url.config(
+        default=f'sqlite:///{BASE_DIR / "db.sqlite3"}', conn_max_age=CONN_MAX_AGE, conn_health_checks=True,
+    ),
+}
+
+READ_REPLICA = None
+if os.environ.get('REPLICA_DATABASE_URL'):
+    READ_REPLICA = 'replica'
+    DATABASES[READ_REPLICA] = dj_database_url.config(
+        'REPLICA_DATABASE_URL', conn_max_age=CONN_MAX_AGE, conn_health_checks=True, test_options={'MIRROR': 'default'},
+    )
+
+DATABASE_ROUTERS = ['recipes.database.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 10))
+
+# Applied to every new SQLite connection. WAL lets reads run during writes, and with WAL
+# synchronous=NORMAL is still safe against corruption (a power cut can lose the last commits).
+# Reads go through a 256 MB memory map and a 64 MB page cache (negative cache_size is in KiB).
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+# Caches
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Rendered charts go in their own bounded cache. With REDIS_URL set every gunicorn worker
+# shares one Redis cache (needs the redis package; configure maxmemory-policy allkeys-lru for
+# LRU eviction). Otherwise workers on the same machine share a file-based cache that is culled
+# once it holds CHART_CACHE_MAX_ENTRIES charts. FileBasedCache culls a random third of the
+# files, not the least recently used ones, so only the Redis setup evicts in LRU order.
+
+CHART_CACHE_MAX_ENTRIES = int(os.environ.get('CHART_CACHE_MAX_ENTRIES', 500))
+
+if os.environ.get('REDIS_URL'):
+    CHART_CACHE = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+        'KEY_PREFIX': 'charts',
+    }
+else:
+    CHART_CACHE = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'recipe_app_chart_cache'),
+        'OPTIONS': {'MAX_ENTRIES': CHART_CACHE_MAX_ENTRIES},
+    }
+
+# The default cache holds small shared state that every worker has to agree on: sessions,
+# cached users, the page cache's version pointers and the ingredient vocabulary version. With
+# REDIS_URL set it lives in Redis; otherwise workers on the same machine share a file-based cache
+# (culled like the chart cache once it holds CACHE_MAX_ENTRIES entries; everything in it can be
+# recomputed from the database).
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 5000))
+
+if os.environ.get('REDIS_URL'):
+    DEFAULT_CACHE = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+else:
+    DEFAULT_CACHE = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'recipe_app_cache'),
+        'OPTIONS': {'MAX_ENTRIES': CACHE_MAX_ENTRIES},
     }
+
+# Rendered page fragments (recipes/page_cache.py). They are keyed by version and never change,
+# so a per-process cache can't serve stale pages; Redis, when there is one, lets the workers
+# share them.
+if os.environ.get('REDIS_URL'):
+    PAGE_CACHE = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+        'KEY_PREFIX': 'pages',
+    }
+else:
+    PAGE_CACHE = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'recipe-pages',
+        'OPTIONS': {'MAX_ENTRIES': CACHE_MAX_ENTRIES},
+    }
+
+CACHES = {
+    'default': DEFAULT_CACHE,
+    'pages': PAGE_CACHE,
+    'charts': CHART_CACHE,
 }
 
+# Runs the tests against their own cache directories (recipe_project/test_runner.py)
+TEST_RUNNER = 'recipe_project.test_runner.TestRunner'
+
+
+# Chart rendering
+# CHART_ENGINE = 'svg' draws the bar, pie and line charts as lightweight SVG (recipes/svg_charts.py);
+# 'matplotlib' renders PNGs with matplotlib.
+CHART_ENGINE = os.environ.get('CHART_ENGINE', 'svg')
+
+# Charts are drawn by a pool of CHART_RENDER_WORKERS renderer processes (0 = draw in the web
+# process). At most CHART_RENDER_QUEUE_SIZE jobs may be queued or running before new charts
+# are refused, and each job is aborted after CHART_RENDER_TIMEOUT seconds. Renderer processes
+# are replaced once one of them reports an RSS above CHART_RENDER_MAX_RSS_MB (0 = no limit).
+
+CHART_RENDER_WORKERS = int(os.environ.get('CHART_RENDER_WORKERS', 2))
+CHART_RENDER_QUEUE_SIZE = int(os.environ.get('CHART_RENDER_QUEUE_SIZE', 8))
+CHART_RENDER_TIMEOUT = float(os.environ.get('CHART_RENDER_TIMEOUT', 10))
+CHART_RENDER_MAX_RSS_MB = int(os.environ.get('CHART_RENDER_MAX_RSS_MB', 200))
+
+
+# Performance metrics (recipes/metrics.py), served in the Prometheus text format on /metrics.
+# Scrapers authenticate with "Authorization: Bearer <METRICS_TOKEN>"; without a token only staff
+# users can read them. METRICS_SERVER_TIMING = True adds a Server-Timing header to every response.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', 'False') == 'True'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -136,12 +259,21 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # AUTH
 LOGIN_URL = '/login/'
 
+# With Redis, sessions are read from the default cache and only fall back to the database on a
+# miss, and the logged-in user is cached for AUTH_USER_CACHE_TIMEOUT seconds (recipes/auth.py), so
+# authenticated requests run no session or user queries. A logout, password change or
+# deactivation has to reach every worker on every machine, and the file-based fallback cache is
+# only shared on one machine (each Heroku dyno has its own /tmp), so without REDIS_URL sessions
+# and users are read from the database on every request.
+SHARED_CACHE = bool(os.environ.get('REDIS_URL'))
+if SHARED_CACHE:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+else:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+AUTHENTICATION_BACKENDS = ['recipes.auth.CachedModelBackend']
+AUTH_USER_CACHE_TIMEOUT = int(os.environ.get('AUTH_USER_CACHE_TIMEOUT', 60))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
-
-# Heroku: Update database configuration from $DATABASE_URL.
-import dj_database_url
-db_from_env = dj_database_url.config(conn_max_age=500)
-DATABASES['default'].update(db_from_env)
\ No newline at end of file
@@ -0,0 +1,27 @@
+# Test runner that points the file-based caches at a fresh temporary directory, so a test run
+# never reads entries left behind by the development server or an earlier run
+import os
+import shutil
+import tempfile
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+FILE_BASED_CACHE = 'django.core.cache.backends.filebased.FileBasedCache'
+
+
+class TestRunner(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_dir = tempfile.mkdtemp(prefix='recipe_app_test_cache_')
+        self.cache_settings = override_settings(CACHES={
+            alias: {**config, 'LOCATION': os.path.join(self.cache_dir, alias)} if config['BACKEND'] == FILE_BASED_CACHE else config
+            for alias, config in settings.CACHES.items()
+        })
+        self.cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_settings.disable()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
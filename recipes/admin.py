@@ -1,7 +1,8 @@
 from django.contrib import admin
 
 # Import the class/model
-from .models import Recipe
+from .models import Recipe, Ingredient
 
 # Register your models here.
-admin.site.register(Recipe)
\ No newline at end of file
+admin.site.register(Recipe)
+admin.site.register(Ingredient)
\ No newline at end of file
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class RecipesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipes'
+
+    # Connect the signal receivers in signals.py, and tune SQLite connections as they open
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from . import signals  # noqa: F401
+        from .database import configure_sqlite
+
+        connection_created.connect(configure_sqlite, dispatch_uid='recipes.configure_sqlite')
\ No newline at end of file
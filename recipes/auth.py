@@ -0,0 +1,31 @@
+# Authentication backend that keeps logged-in users in the default cache, so a request with a
+# valid session doesn't have to load auth_user. Cached users are dropped whenever the user is
+# saved (password changes, deactivation, last_login) or deleted, and on logout (see signals.py).
+# That only reaches every worker if they all share the cache, so users are only cached when
+# settings.SHARED_CACHE says the default cache is shared by every machine (Redis); otherwise they
+# are loaded from the database on every request.
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+
+def get_user_key(user_id):
+    return f'auth-user:{user_id}'
+
+def forget_user(user_id):
+    cache.delete(get_user_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+
+    def get_user(self, user_id):
+        if not settings.SHARED_CACHE:
+            return super().get_user(user_id)
+        key = get_user_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            # Inactive and deleted users (None) are not cached, so they are checked every time
+            if user is not None:
+                cache.set(key, user, timeout=settings.AUTH_USER_CACHE_TIMEOUT)
+        return user
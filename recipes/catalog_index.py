@@ -0,0 +1,70 @@
+# Lifecycle of the in-process indexes over the catalog (the trigram index in fuzzy.py, the
+# pantry bitsets in pantry.py and the ingredient vocabulary in vocabulary.py). Each is built once per process, on first use, and from then on
+# kept current incrementally, never rebuilt:
+#   - changes made in this process are applied by the Recipe signals as they happen
+#   - changes made by other workers are read from a change feed: the rows whose updated_at is
+#     newer than the last one seen. The feed is only read when the catalog version (see
+#     page_cache.py), which every change moves on in the shared default cache, differs from the
+#     one read last time, so while nothing changes a lookup costs one cache read.
+# updated_at is stamped before the writing transaction commits, so the feed is read again from
+# FEED_OVERLAP before the newest row seen; applying a change twice is harmless. One thread reads
+# the feed at a time, and the others carry on with the index as it is meanwhile.
+# A feed may only keep its rows for a while (deleted recipes, see models.DeletedRecipe), so an
+# index given a max_age is rebuilt, rather than patched, once it is further behind than that.
+import threading
+from datetime import timedelta
+from django.utils import timezone
+from .page_cache import get_catalog_version
+
+FEED_OVERLAP = timedelta(seconds=10)
+
+
+class CatalogIndex:
+
+    # build() returns a new index; apply_changes(index, since) applies the changes made since
+    # `since` and returns the newest updated_at it saw (None if there were none)
+    def __init__(self, build, apply_changes, max_age=None):
+        self.build = build
+        self.apply_changes = apply_changes
+        self.max_age = max_age
+        # None until first use
+        self.index = None
+        self.version = None
+        self.seen = None
+        self.build_lock = threading.Lock()
+        self.feed_lock = threading.Lock()
+
+    # This process's index, with the changes other workers have made since it was last used
+    def get(self):
+        if self.index is None:
+            with self.build_lock:
+                if self.index is None:
+                    # Read before building, so changes made during the build are read from the feed
+                    version, seen = get_catalog_version(), timezone.now()
+                    self.index = self.build()
+                    self.version, self.seen = version, seen
+                return self.index
+
+        version = get_catalog_version()
+        if version != self.version and self.feed_lock.acquire(blocking=False):
+            try:
+                # Noted first, so a change made while the feed is read is read next time
+                self.version = version
+                since = self.seen - FEED_OVERLAP
+                if self.max_age is not None and timezone.now() - since > self.max_age:
+                    # Too far behind for the feed: replace the index like the first build did
+                    seen = timezone.now()
+                    self.index = self.build()
+                    self.seen = seen
+                else:
+                    latest = self.apply_changes(self.index, since)
+                    if latest is not None and latest > self.seen:
+                        self.seen = latest
+            finally:
+                self.feed_lock.release()
+        return self.index
+
+    # Forget the index (used by tests)
+    def reset(self):
+        with self.build_lock:
+            self.index = None
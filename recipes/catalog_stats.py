@@ -0,0 +1,149 @@
+# Catalog statistics, kept up to date incrementally instead of recomputed from every recipe.
+#
+# CatalogStat rows hold running totals for the whole catalog:
+#   difficulty    <level>            recipes per difficulty level
+#   cooking_time  <lower bound>      recipes per cooking time bin (see COOKING_TIME_BINS)
+#   ingredient    <name>             recipes using each ingredient
+#   word          <word>             recipes with the word in their name or ingredients
+#   total         recipes            number of recipes
+#   total         cooking_seconds    sum of all cooking times, in whole seconds
+# Saves, deletes, bulk creates and bulk updates add their recipes' contributions and take away
+# the old ones as a batch of "count = count + n" upserts, which the database applies atomically,
+# so concurrent workers never lose an update. Reading the figures costs a few rows whatever the
+# size of the catalog.
+# Contributions only depend on name, cooking_time and ingredients (the difficulty level is worked
+# out from them), so update() calls that touch other columns can't make the totals drift; the
+# rebuild_catalog_stats command recomputes them from scratch if anything else ever does.
+# Every row that changes gets a new updated_at, so per-process indexes built from the stats can
+# read just the rows changed since they last looked (fuzzy.py).
+import bisect
+from collections import Counter
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import CatalogStat, Recipe, DIFFICULTY_CHOICES, get_difficulty, get_words, parse_ingredients
+
+# Lower bounds of the cooking time bins, in minutes (the last bin has no upper bound)
+COOKING_TIME_BINS = (0, 10, 20, 30, 45, 60, 90, 120, 180, 240)
+
+# Keys of the catalog totals
+RECIPES = 'recipes'
+COOKING_SECONDS = 'cooking_seconds'
+
+
+# Lower bound of the bin a cooking time falls into
+def get_cooking_time_bin(cooking_time):
+    return COOKING_TIME_BINS[max(bisect.bisect_right(COOKING_TIME_BINS, cooking_time) - 1, 0)]
+
+# '10-20 min', ..., '240+ min'
+def get_bin_label(lower):
+    index = COOKING_TIME_BINS.index(lower)
+    if index + 1 < len(COOKING_TIME_BINS):
+        return f'{lower}-{COOKING_TIME_BINS[index + 1]} min'
+    return f'{lower}+ min'
+
+# What one recipe adds to each stat: {(kind, key): amount}
+def get_contributions(name, cooking_time, ingredients):
+    names = parse_ingredients(ingredients)
+    contributions = Counter({
+        (CatalogStat.DIFFICULTY, get_difficulty(cooking_time, len(names))): 1,
+        (CatalogStat.COOKING_TIME, str(get_cooking_time_bin(cooking_time))): 1,
+        (CatalogStat.TOTAL, RECIPES): 1,
+        (CatalogStat.TOTAL, COOKING_SECONDS): round(cooking_time * 60),
+    })
+    contributions.update((CatalogStat.INGREDIENT, ingredient) for ingredient in names)
+    contributions.update((CatalogStat.WORD, word) for word in set(get_words(name) + get_words(ingredients)))
+    return contributions
+
+# Totals for (name, cooking_time, ingredients) rows
+def count_recipes(rows):
+    totals = Counter()
+    for name, cooking_time, ingredients in rows:
+        totals.update(get_contributions(name, cooking_time, ingredients))
+    return totals
+
+# Net change when the `removed` rows are replaced by the `added` ones, without the zeros (a save
+# that doesn't change name, cooking_time or ingredients changes nothing)
+def get_changes(added=(), removed=()):
+    changes = count_recipes(added)
+    changes.subtract(count_recipes(removed))
+    return {stat: amount for stat, amount in changes.items() if amount}
+
+# Apply a change: `added` and `removed` are (name, cooking_time, ingredients) rows of the recipes
+# as they are now and as they were before
+def update_stats(added=(), removed=()):
+    changes = get_changes(added, removed)
+    if not changes:
+        return
+
+    # Always in the same order, so two transactions can't deadlock on each other's rows
+    rows = [(kind, key, amount) for (kind, key), amount in sorted(changes.items())]
+    now = timezone.now()
+    if connection.vendor in ('sqlite', 'postgresql'):
+        quote = connection.ops.quote_name
+        table, kind, key, count, updated_at = (
+            quote(name) for name in (CatalogStat._meta.db_table, 'kind', 'key', 'count', 'updated_at')
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {table} ({kind}, {key}, {count}, {updated_at}) VALUES (%s, %s, %s, %s) '
+                f'ON CONFLICT ({kind}, {key}) DO UPDATE SET {count} = {table}.{count} + excluded.{count}, '
+                f'{updated_at} = excluded.{updated_at}',
+                [(*row, connection.ops.adapt_datetimefield_value(now)) for row in rows],
+            )
+    else:
+        # No portable upsert: increment, creating the rows that don't exist yet
+        with transaction.atomic():
+            for kind, key, amount in rows:
+                if not CatalogStat.objects.filter(kind=kind, key=key).update(count=F('count') + amount, updated_at=now):
+                    CatalogStat.objects.create(kind=kind, key=key, count=amount)
+
+# Recompute every stat from the recipes (run while nothing else is writing to the catalog).
+# Stats that no longer count anything are set to 0 rather than deleted, so indexes following the
+# changed rows see them go.
+def rebuild_stats():
+    totals = count_recipes(Recipe.objects.values_list('name', 'cooking_time', 'ingredients').iterator(chunk_size=2000))
+    with transaction.atomic():
+        CatalogStat.objects.update(count=0, updated_at=timezone.now())
+        CatalogStat.objects.bulk_create(
+            [CatalogStat(kind=kind, key=key, count=amount) for (kind, key), amount in totals.items() if amount],
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['kind', 'key'],
+            update_fields=['count', 'updated_at'],
+        )
+    return totals[(CatalogStat.TOTAL, RECIPES)]
+
+
+# {key: count} for one kind of stat
+def get_counts(kind):
+    return dict(CatalogStat.objects.filter(kind=kind, count__gt=0).values_list('key', 'count'))
+
+# Recipes per difficulty level, in the order of DIFFICULTY_CHOICES
+def get_difficulty_counts():
+    counts = get_counts(CatalogStat.DIFFICULTY)
+    return {level: counts[level] for level, label in DIFFICULTY_CHOICES if level in counts}
+
+# [(bin label, recipes), ...] for every cooking time bin, empty ones included
+def get_cooking_time_histogram():
+    counts = get_counts(CatalogStat.COOKING_TIME)
+    return [(get_bin_label(lower), counts.get(str(lower), 0)) for lower in COOKING_TIME_BINS]
+
+# [(ingredient, recipes), ...], most used first
+def get_top_ingredients(limit=10):
+    rows = (
+        CatalogStat.objects.filter(kind=CatalogStat.INGREDIENT, count__gt=0)
+        .order_by('-count', 'key')
+        .values_list('key', 'count')
+    )
+    return list(rows[:limit])
+
+# Headline figures: number of recipes, distinct ingredients in use and average cooking time
+def get_summary():
+    totals = get_counts(CatalogStat.TOTAL)
+    recipes = totals.get(RECIPES, 0)
+    return {
+        'recipes': recipes,
+        'ingredients': CatalogStat.objects.filter(kind=CatalogStat.INGREDIENT, count__gt=0).count(),
+        'average_cooking_time': totals.get(COOKING_SECONDS, 0) / 60 / recipes if recipes else None,
+    }
@@ -0,0 +1,93 @@
+# Cache layer in front of the chart renderer (utils.get_chart) so repeated searches don't re-render the same chart
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import caches
+from .chart_pool import render_chart
+from .svg_charts import get_svg_chart
+from .metrics import timer
+
+# Cache alias used for rendered charts (see CACHES in settings.py)
+CHART_CACHE_ALIAS = 'charts'
+
+# Key holding the current chart generation; bumping it invalidates every cached chart
+GENERATION_KEY = 'chart:generation'
+
+# Keep rendered charts for a day unless they are evicted or invalidated first
+CHART_TIMEOUT = 60 * 60 * 24
+
+
+# Content type for each image format; 'svg' comes from svg_charts, 'png' from matplotlib
+CHART_CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+
+def get_chart_cache():
+    return caches[CHART_CACHE_ALIAS]
+
+# Turn the plotted columns into plain lists so DataFrames and dicts hash the same way
+def get_chart_columns(data):
+    if hasattr(data, 'to_dict'):
+        return data.to_dict('list')
+    return {column: list(values) for column, values in data.items()}
+
+# Digest of everything that affects the picture: chart type, plotted data and extra options
+def get_chart_digest(chart_type, data, **kwargs):
+    payload = json.dumps(
+        {'chart_type': chart_type, 'data': get_chart_columns(data), 'options': kwargs},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# Current generation number, created on first use
+def get_generation():
+    cache = get_chart_cache()
+    return cache.get_or_set(GENERATION_KEY, 1, timeout=None)
+
+# Called when recipes change so no chart drawn from the old catalog is served again
+def invalidate_charts():
+    cache = get_chart_cache()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        # The key was evicted or never set; any new value works as long as it's not reused
+        cache.set(GENERATION_KEY, 2, timeout=None)
+
+# Image format produced by the engine selected with the CHART_ENGINE setting
+def get_chart_format():
+    return 'svg' if settings.CHART_ENGINE == 'svg' else 'png'
+
+# Draw the chart: SVG is built directly, PNG goes through matplotlib in the renderer pool
+def draw_chart(chart_type, data, image_format='png', **kwargs):
+    if image_format == 'svg':
+        return get_svg_chart(chart_type, data, **kwargs)
+    return render_chart(chart_type, data, **kwargs)
+
+# Return the chart from the cache, drawing it only on a miss
+def get_cached_chart(chart_type, data, image_format='png', **kwargs):
+    cache = get_chart_cache()
+    key = f'chart:{get_generation()}:{image_format}:{chart_type}:{get_chart_digest(chart_type, data, **kwargs)}'
+
+    chart = cache.get(key)
+    if chart is None:
+        with timer('chart_render'):
+            chart = draw_chart(chart_type, data, image_format, **kwargs)
+        cache.set(key, chart, timeout=CHART_TIMEOUT)
+    return chart
+
+# Remember what to draw under its digest so the chart can be rendered later by the chart view
+def store_chart_spec(chart_type, data, **kwargs):
+    digest = get_chart_digest(chart_type, data, **kwargs)
+    spec = {'chart_type': chart_type, 'data': get_chart_columns(data), 'options': kwargs}
+    get_chart_cache().set(f'chart-spec:{digest}', spec, timeout=CHART_TIMEOUT)
+    return digest
+
+# Render (or fetch from the cache) the chart stored under digest; None if it has expired
+def get_chart_image(digest, image_format='png'):
+    spec = get_chart_cache().get(f'chart-spec:{digest}')
+    if spec is None:
+        return None
+    return get_cached_chart(spec['chart_type'], spec['data'], image_format, **spec['options'])
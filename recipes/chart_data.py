@@ -0,0 +1,76 @@
+# Aggregation between a search's matching recipes and its chart, so the chart has a bounded
+# number of bars or points however many recipes match:
+#   bar chart (#1)   the MAX_BARS - 1 slowest recipes plus an "Other" bar with the average of the rest
+#   line chart (#3)  at most MAX_LINE_POINTS points, keeping the quickest and slowest recipe of
+#                    each stretch of the name-ordered series, so peaks and dips survive
+#   histogram (#4)   recipes per cooking time bin (the bins of catalog_stats.py)
+# Works on whole columns with NumPy (imported on first use, like pandas and matplotlib) rather
+# than on one dict per recipe.
+from .catalog_stats import COOKING_TIME_BINS, get_bin_label
+
+MAX_BARS = 25
+MAX_LINE_POINTS = 200
+
+
+# Name and cooking time columns from values_list('name', 'cooking_time') rows
+def get_columns(rows):
+    import numpy as np
+
+    names = np.array([name for name, cooking_time in rows], dtype=object)
+    cooking_times = np.fromiter((cooking_time for name, cooking_time in rows), dtype=np.float64, count=len(rows))
+    return names, cooking_times
+
+# The limit - 1 largest values, largest first, plus one `other` entry holding the mean of the rest
+def top_n(labels, values, limit, other='Other'):
+    import numpy as np
+
+    if len(values) <= limit:
+        return list(labels), [float(value) for value in values]
+
+    # argpartition finds the top entries without sorting everything; only those get sorted
+    top = np.argpartition(-values, limit - 1)[:limit - 1]
+    top = top[np.lexsort((top, -values[top]))]
+    rest = np.ones(len(values), dtype=bool)
+    rest[top] = False
+    return (
+        [str(label) for label in labels[top]] + [f'{other} ({rest.sum()} recipes, average)'],
+        [float(value) for value in values[top]] + [float(values[rest].mean())],
+    )
+
+# Number of values in each bin; bins start at `edges` and the last one has no upper bound
+def bin_values(values, edges=COOKING_TIME_BINS):
+    import numpy as np
+
+    counts, _ = np.histogram(np.maximum(values, edges[0]), bins=[*edges, np.inf])
+    return [get_bin_label(lower) for lower in edges], [int(count) for count in counts]
+
+# At most max_points entries of a series: it is cut into max_points / 2 stretches and the
+# smallest and largest value of each are kept, in their original order
+def downsample_min_max(labels, values, max_points):
+    import numpy as np
+
+    if len(values) <= max_points:
+        return list(labels), [float(value) for value in values]
+
+    buckets = max(max_points // 2, 1)
+    bounds = np.linspace(0, len(values), buckets + 1).astype(np.intp)
+    bucket_ids = np.repeat(np.arange(buckets), np.diff(bounds))
+    # Sorted by bucket, then by value: each bucket's first entry is its minimum, its last the maximum
+    order = np.lexsort((values, bucket_ids))
+    keep = np.unique(np.concatenate([order[bounds[:-1]], order[bounds[1:] - 1]]))
+    return [str(label) for label in labels[keep]], [float(value) for value in values[keep]]
+
+# Chart columns for a bar (#1), line (#3) or histogram (#4) chart of (name, cooking_time) rows
+# in name order
+def get_chart_data(chart_type, rows):
+    names, cooking_times = get_columns(rows)
+    if chart_type == '#1':
+        names, cooking_times = top_n(names, cooking_times, MAX_BARS)
+    elif chart_type == '#3':
+        names, cooking_times = downsample_min_max(names, cooking_times, MAX_LINE_POINTS)
+    elif chart_type == '#4':
+        bins, recipes = bin_values(cooking_times)
+        return {'bin': bins, 'recipes': recipes}
+    else:
+        raise ValueError(f'Unknown chart type: {chart_type}')
+    return {'name': names, 'cooking_time': cooking_times}
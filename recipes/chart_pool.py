@@ -0,0 +1,132 @@
+# Render charts in a small pool of warm worker processes instead of the web request thread.
+# pyplot keeps global state and isn't thread-safe, and a slow chart would otherwise tie up a
+# whole web worker; here matplotlib (and its memory) lives in the renderer processes only.
+import atexit
+import logging
+import multiprocessing
+import os
+import resource
+import signal
+import threading
+from django.conf import settings
+
+
+class ChartRenderError(Exception):
+    pass
+
+# Raised when CHART_RENDER_QUEUE_SIZE jobs are already waiting or running
+class ChartQueueFull(ChartRenderError):
+    pass
+
+# Raised when a job takes longer than CHART_RENDER_TIMEOUT seconds
+class ChartRenderTimeout(ChartRenderError):
+    pass
+
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_slots = None
+_lock = threading.Lock()
+
+
+# Resident set size of the current process in bytes
+def get_rss():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # No /proc (e.g. macOS): fall back to the peak RSS, reported in bytes there
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# Runs once in each renderer process so the first job doesn't pay for importing matplotlib
+def _warm_up():
+    import matplotlib.figure  # noqa: F401
+    import matplotlib.backends.backend_agg  # noqa: F401
+
+# Runs in a renderer process; the alarm aborts the job so a stuck chart can't hold the worker.
+# Returns the PNG bytes together with the worker's RSS so the parent can watch memory use.
+def _render(chart_type, data, options, timeout):
+    from .utils import get_chart
+
+    def on_timeout(signum, frame):
+        raise ChartRenderTimeout(f'Chart took longer than {timeout} seconds to render.')
+
+    signal.signal(signal.SIGALRM, on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        chart = get_chart(chart_type, data, **options)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    return chart, get_rss()
+
+# Start the pool on first use (not at import) so only processes that draw charts pay for it
+def get_pool():
+    global _pool, _slots
+    with _lock:
+        if _pool is None:
+            # 'spawn' gives clean processes that don't inherit the web worker's sockets or threads
+            context = multiprocessing.get_context('spawn')
+            _pool = context.Pool(processes=settings.CHART_RENDER_WORKERS, initializer=_warm_up)
+            _slots = threading.BoundedSemaphore(settings.CHART_RENDER_QUEUE_SIZE)
+        return _pool
+
+# Swap in fresh renderer processes; the old ones finish the jobs they already have, then exit
+def recycle_pool(pool):
+    global _pool
+    with _lock:
+        # Another request may have recycled this pool already
+        if _pool is not pool:
+            return
+        _pool = None
+    pool.close()
+    get_pool()
+
+# Stop the renderer processes (also called when the web process exits)
+def shutdown_pool():
+    global _pool, _slots
+    with _lock:
+        if _pool is not None:
+            _pool.terminate()
+            _pool.join()
+        _pool = None
+        _slots = None
+
+atexit.register(shutdown_pool)
+
+# Render a chart in the pool and wait for the PNG bytes
+def render_chart(chart_type, data, **kwargs):
+    timeout = settings.CHART_RENDER_TIMEOUT
+
+    # CHART_RENDER_WORKERS = 0 renders in-process, e.g. for local debugging
+    if settings.CHART_RENDER_WORKERS == 0:
+        from .utils import get_chart
+        return get_chart(chart_type, data, **kwargs)
+
+    pool = get_pool()
+    slots = _slots
+
+    # Backpressure: refuse new work instead of queueing without limit
+    if not slots.acquire(blocking=False):
+        raise ChartQueueFull('Too many charts are being rendered, try again shortly.')
+
+    # The slot is freed when the job finishes, even if this request stopped waiting for it
+    release = lambda result: slots.release()
+    job = pool.apply_async(_render, (chart_type, data, kwargs, timeout), callback=release, error_callback=release)
+
+    # Give the worker's own alarm a moment to fire before giving up on the job here
+    try:
+        chart, rss = job.get(timeout=timeout + 1)
+    except multiprocessing.TimeoutError:
+        raise ChartRenderTimeout(f'Chart took longer than {timeout} seconds to render.')
+
+    # Memory watermark: once a renderer grows past the limit, replace the pool's processes
+    max_rss = settings.CHART_RENDER_MAX_RSS_MB * 1024 * 1024
+    if max_rss and rss > max_rss:
+        logger.warning('Chart renderer RSS is %.1f MB (limit %s MB), recycling renderer processes',
+                       rss / 1024 / 1024, settings.CHART_RENDER_MAX_RSS_MB)
+        recycle_pool(pool)
+    else:
+        logger.debug('Chart renderer RSS is %.1f MB', rss / 1024 / 1024)
+    return chart
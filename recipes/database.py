@@ -0,0 +1,64 @@
+# Database tuning and read replica routing.
+#
+# SQLite connections get the pragmas in settings.SQLITE_PRAGMAS as soon as they open (WAL lets
+# readers carry on while a write commits).
+#
+# With REPLICA_DATABASE_URL set, read-only code wrapped in read_from_replica() (searches and the
+# pantry) reads from the replica; everything else, and every write, uses the primary. A user who
+# just wrote something gets a cookie that keeps their reads on the primary for
+# REPLICA_PIN_SECONDS, so they see their own changes while the replica catches up.
+import contextvars
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Cookie set on responses to requests that wrote to the primary
+PRIMARY_PIN_COOKIE = 'read_primary'
+
+_replica_reads = contextvars.ContextVar('recipe_replica_reads', default=False)
+
+
+# connection_created receiver (connected in apps.py)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+# Send the queries run inside the block to the replica, unless this user has just written
+@contextmanager
+def read_from_replica(request=None):
+    if request is not None and request.COOKIES.get(PRIMARY_PIN_COOKIE):
+        yield
+        return
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+# Keep this user's reads on the primary for a while after a write
+def pin_to_primary(response):
+    response.set_cookie(PRIMARY_PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+    return response
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if settings.READ_REPLICA and _replica_reads.get():
+            return settings.READ_REPLICA
+        return DEFAULT_DB_ALIAS
+
+    # Always the primary, including for objects that were read from the replica
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    # The replica holds the same rows as the primary
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    # The replica gets its schema from the primary through replication
+    def allow_migrate(self, db, app_label, **hints):
+        return db != settings.READ_REPLICA
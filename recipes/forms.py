@@ -1,11 +1,13 @@
 from django import forms
-from .models import Recipe   # Access Recipe model
+from .models import Recipe, DIFFICULTY_CHOICES   # Access Recipe model
+from .vocabulary import get_ingredient_choices   # Shared, incrementally updated ingredient list
 
 # Set chart choices
 CHART_CHOICES = (
     ("#1", "Bar Chart"),
     ("#2", "Pie Chart"),
     ("#3", "Line Chart"),
+    ("#4", "Cooking Time Histogram"),
 )
 
 # Define form to allow users to search by recipe name, ingredient and optional chart
@@ -19,23 +21,20 @@ class RecipeSearchForm(forms.Form):
         ),
     )
 
-    # Dynamically populate the Ingredients choices
-    def get_ingredients_choices():
-        all_ingredients = set()
-        recipes = Recipe.objects.all()
-        for recipe in recipes:
-            ingredients_list = recipe.ingredients.split(',')
-            all_ingredients.update([ingredient.strip() for ingredient in ingredients_list])
-
-        return [(ingredient, ingredient) for ingredient in sorted(all_ingredients)]
-
+    # Choices are filled in per form instance (see __init__), not at import time
     Ingredients = forms.MultipleChoiceField(
         required=False,
-        choices=get_ingredients_choices(),
         label="Ingredients",
         widget=forms.SelectMultiple(),
     )
 
+    Difficulty = forms.ChoiceField(
+        required=False,
+        choices=(("", "Any"),) + DIFFICULTY_CHOICES,
+        label="Difficulty",
+        widget=forms.Select(),
+    )
+
     chart_type = forms.ChoiceField(
         choices=CHART_CHOICES,
         widget=forms.Select(),
@@ -43,16 +42,45 @@ class RecipeSearchForm(forms.Form):
         label="Chart Type",
     )
 
-    # Validate that user has selected as least a name or ingredient
+    # Dynamically populate the Ingredients choices each time the form is built, so new
+    # ingredients show up straight away and importing the form never touches the database.
+    # The list comes from the in-process vocabulary, which only costs a version check per request
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['Ingredients'].choices = get_ingredient_choices()
+
+    # Validate that user has selected as least a name, ingredient or difficulty
     def clean(self):
         cleaned_data = super().clean()
         recipe_name = cleaned_data.get("Recipe_Name")
         ingredients = cleaned_data.get("Ingredients")
+        difficulty = cleaned_data.get("Difficulty")
 
-        if not recipe_name and not ingredients:
-            raise forms.ValidationError("Please enter a recipe name or select ingredients.")
+        if not recipe_name and not ingredients and not difficulty:
+            raise forms.ValidationError("Please enter a recipe name, select ingredients or choose a difficulty.")
         return cleaned_data
 
+# Define form for "cook with what I have": the ingredients on hand and how many may be missing
+class PantryForm(forms.Form):
+    Ingredients = forms.MultipleChoiceField(
+        label="Ingredients I Have",
+        widget=forms.SelectMultiple(),
+    )
+
+    Max_Missing = forms.IntegerField(
+        required=False,
+        min_value=0,
+        max_value=5,
+        initial=2,
+        label="Missing Ingredients Allowed",
+        widget=forms.NumberInput(),
+    )
+
+    # Same shared vocabulary as the search form
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['Ingredients'].choices = get_ingredient_choices()
+
 class AddRecipeForm(forms.ModelForm):
     class Meta:
         model = Recipe  # Specify the model to associate with the form
@@ -0,0 +1,127 @@
+# Typo-tolerant matching ("tomatoe" -> "tomato", "chiken" -> "chicken") with an in-process
+# trigram index over every word in recipe names and ingredients. The words, and how many recipes
+# use each, are the 'word' catalog stats (catalog_stats.py), which the index follows through
+# catalog_index.py.
+# Postings are compact array('I') lists of term ids per trigram; a lookup counts shared
+# trigrams for all candidate terms at once with numpy, so there is no per-term Python loop.
+import threading
+from array import array
+from .catalog_index import CatalogIndex
+from .models import CatalogStat, get_words
+
+# Minimum Dice similarity (shared trigrams relative to both words' trigrams) for a suggestion
+MIN_SIMILARITY = 0.45
+
+
+# Trigrams of a word padded like PostgreSQL's pg_trgm: "cat" -> "  c", " ca", "cat", "at "
+def get_trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+
+    def __init__(self, terms=()):
+        self.terms = []
+        self.term_ids = {}
+        self.postings = {}
+        # Number of trigrams of each term; 0 marks a removed term
+        self.trigram_counts = array('I')
+        self.lock = threading.Lock()
+        for term in terms:
+            self.add(term)
+
+    def __contains__(self, term):
+        term_id = self.term_ids.get(term)
+        return term_id is not None and self.trigram_counts[term_id] > 0
+
+    def __len__(self):
+        return len(self.term_ids)
+
+    def add(self, term):
+        with self.lock:
+            term_id = self.term_ids.get(term)
+            trigrams = get_trigrams(term)
+            if term_id is not None:
+                self.trigram_counts[term_id] = len(trigrams)
+                return
+            term_id = len(self.terms)
+            self.terms.append(term)
+            self.term_ids[term] = term_id
+            self.trigram_counts.append(len(trigrams))
+            for trigram in trigrams:
+                self.postings.setdefault(trigram, array('I')).append(term_id)
+
+    # Removed terms keep their postings but can no longer be suggested
+    def remove(self, term):
+        with self.lock:
+            term_id = self.term_ids.get(term)
+            if term_id is not None:
+                self.trigram_counts[term_id] = 0
+
+    # Up to `limit` (term, similarity) pairs most similar to word, best first
+    def suggest(self, word, limit=5, min_similarity=MIN_SIMILARITY):
+        import numpy as np
+
+        word = word.lower()
+        trigrams = get_trigrams(word)
+        with self.lock:
+            lists = [self.postings[trigram] for trigram in trigrams if trigram in self.postings]
+            if not lists:
+                return []
+            # Zero-copy views of the arrays, then one vectorized count of shared trigrams for
+            # every term that shares at least one (never a pass over the whole vocabulary)
+            term_ids = np.concatenate([np.frombuffer(postings, dtype=np.uint32) for postings in lists])
+            candidates, shared = np.unique(term_ids, return_counts=True)
+            counts = np.frombuffer(self.trigram_counts, dtype=np.uint32)[candidates]
+
+        # Removed terms have a count of 0 and are skipped
+        similarity = np.where(counts > 0, 2.0 * shared / (len(trigrams) + counts), 0.0)
+        matches = np.flatnonzero(similarity >= min_similarity)
+        best = matches[np.argsort(-similarity[matches], kind='stable')[:limit]]
+        return [(self.terms[candidates[i]], float(similarity[i])) for i in best]
+
+    # Replace each unknown word with its closest known term; known words are left alone
+    def correct(self, text):
+        corrected = []
+        for word in get_words(text):
+            if word not in self:
+                suggestions = self.suggest(word, limit=1)
+                if suggestions:
+                    word = suggestions[0][0]
+            corrected.append(word)
+        return ' '.join(corrected)
+
+
+# Index every word that some recipe uses, from the word stats
+def build_index():
+    words = CatalogStat.objects.filter(kind=CatalogStat.WORD, count__gt=0).values_list('key', flat=True)
+    return TrigramIndex(sorted(words.iterator(chunk_size=2000)))
+
+# Apply the word counts changed since `since`: new words become suggestions, and words that no
+# recipe uses any more are removed
+def apply_changes(index, since):
+    latest = None
+    rows = CatalogStat.objects.filter(kind=CatalogStat.WORD, updated_at__gte=since).values_list('key', 'count', 'updated_at')
+    for word, count, updated_at in rows.iterator(chunk_size=2000):
+        if count > 0:
+            index.add(word)
+        else:
+            index.remove(word)
+        latest = updated_at if latest is None else max(latest, updated_at)
+    return latest
+
+trigram_index = CatalogIndex(build_index, apply_changes)
+
+
+# This process's index (see catalog_index.py)
+def get_trigram_index():
+    return trigram_index.get()
+
+# Add the words of a saved recipe straight away, if this process has built an index. Words are
+# removed through the feed, once the stats show that no recipe uses them.
+def add_recipe_terms(recipe):
+    index = trigram_index.index
+    if index is not None:
+        for word in get_words(recipe.name) + get_words(recipe.ingredients):
+            index.add(word)
@@ -0,0 +1,70 @@
+# Resized WebP copies ("derivatives") of recipe pictures, so cards can load a small image
+# instead of the full-size upload. Each picture gets one file per width in DERIVATIVE_WIDTHS.
+import logging
+import os
+from io import BytesIO
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+logger = logging.getLogger(__name__)
+
+# Derivatives are always written with their plain names through default_storage; `storage`
+# arguments below only say where the source picture lives.
+
+# Card images are 150px wide; 300 and 600 cover high-density screens and the detail page
+DERIVATIVE_WIDTHS = (150, 300, 600)
+DERIVATIVE_DIR = 'recipes/derivatives'
+WEBP_QUALITY = 80
+
+
+# Storage name of the derivative of picture `name` at `width` pixels
+def get_derivative_name(name, width):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return f'{DERIVATIVE_DIR}/{stem}-{width}w.webp'
+
+# Value for an <img srcset="..."> attribute listing every derivative of picture `name`
+def get_srcset(name):
+    return ', '.join(f'{default_storage.url(get_derivative_name(name, width))} {width}w' for width in DERIVATIVE_WIDTHS)
+
+# Write the WebP derivatives of picture `name`; returns False if the picture can't be read.
+# Existing derivatives are kept unless force=True.
+def generate_derivatives(name, storage=default_storage, force=False):
+    from PIL import Image, UnidentifiedImageError
+
+    if not name or not storage.exists(name):
+        return False
+
+    try:
+        with storage.open(name, 'rb') as source:
+            image = Image.open(source)
+            image.load()
+    except (OSError, UnidentifiedImageError):
+        logger.warning('Could not read recipe picture %s', name)
+        return False
+
+    # WebP handles transparency, but palette and CMYK images need converting first
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'P') else 'RGB')
+
+    for width in DERIVATIVE_WIDTHS:
+        derivative_name = get_derivative_name(name, width)
+        if default_storage.exists(derivative_name):
+            if not force:
+                continue
+            default_storage.delete(derivative_name)
+
+        # Scale to the target width keeping the aspect ratio, but never upscale
+        resized = image
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.LANCZOS)
+
+        buffer = BytesIO()
+        resized.save(buffer, format='WEBP', quality=WEBP_QUALITY, method=4)
+        default_storage.save(derivative_name, ContentFile(buffer.getvalue()))
+    return True
+
+# Remove every derivative of picture `name`
+def delete_derivatives(name):
+    for width in DERIVATIVE_WIDTHS:
+        default_storage.delete(get_derivative_name(name, width))
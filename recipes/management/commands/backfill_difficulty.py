@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.models import Recipe
+
+
+# Recompute the stored difficulty and ingredient_count columns for every recipe, in batches
+class Command(BaseCommand):
+    help = 'Backfill Recipe.difficulty and Recipe.ingredient_count in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of recipes updated per query.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        updated = 0
+
+        # Walk the table by primary key so each batch is an indexed range read, not an OFFSET scan
+        while True:
+            batch = list(
+                Recipe.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .only('id', 'cooking_time', 'ingredients')[:batch_size]
+            )
+            if not batch:
+                break
+
+            for recipe in batch:
+                recipe.set_derived_fields()
+            with transaction.atomic():
+                Recipe.objects.bulk_update(batch, Recipe.DERIVED_FIELDS)
+
+            last_id = batch[-1].id
+            updated += len(batch)
+            self.stdout.write(f'Updated {updated} recipes...')
+
+        self.stdout.write(self.style.SUCCESS(f'Backfilled difficulty for {updated} recipes.'))
@@ -0,0 +1,171 @@
+import json
+import platform
+import re
+import statistics
+import time
+from contextlib import ExitStack
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.urls import reverse
+from recipes.chart_cache import invalidate_charts
+from recipes.metrics import QueryStats
+from recipes.models import Recipe
+from recipes.vocabulary import get_vocabulary
+
+BENCHMARK_USER = 'benchmark'
+
+# Chart image URL in a search results page
+CHART_URL = re.compile(r'src="(/charts/[0-9a-f]{64}\.\w+)"')
+
+
+# Time the main pages and hot paths against the current catalog and write the results as
+# JSON. With --baseline, a benchmark slower than the baseline by more than --tolerance fails
+# the command. Typical use, one database per catalog size:
+#   DATABASE_URL=sqlite:///bench-100k.sqlite3 python manage.py migrate
+#   DATABASE_URL=sqlite:///bench-100k.sqlite3 python manage.py generate_catalog --size 100000
+#   DATABASE_URL=sqlite:///bench-100k.sqlite3 python manage.py benchmark --output bench-100k.json
+class Command(BaseCommand):
+    help = 'Benchmark the recipe views, charts and hot paths against the current catalog.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per benchmark (after one warm-up run).')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--baseline', help='Compare with results saved earlier by --output.')
+        parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown against the baseline (0.25 = 25%%).')
+
+    def handle(self, *args, **options):
+        catalog_size = Recipe.objects.count()
+        if not catalog_size:
+            raise CommandError('The catalog is empty; run generate_catalog first.')
+
+        self.repeat = max(1, options['repeat'])
+        self.client = Client()
+        user, created = User.objects.get_or_create(username=BENCHMARK_USER)
+        self.client.force_login(user)
+
+        results = {}
+        for name, run in self.get_benchmarks():
+            results[name] = self.measure(run)
+            self.stdout.write(f'{name:<32} {results[name]["median_ms"]:>10.2f} ms {results[name]["queries"]:>5} queries')
+
+        report = {
+            'catalog_size': catalog_size,
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'repeat': self.repeat,
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(f'Wrote {options["output"]}')
+
+        if options['baseline']:
+            self.compare(report, options['baseline'], options['tolerance'])
+
+    # (name, function) pairs; each function runs one request or operation
+    def get_benchmarks(self):
+        # Search terms picked from the catalog itself, so they match at any catalog size
+        vocabulary = sorted(get_vocabulary().items(), key=lambda item: (-item[1], item[0]))
+        common = [name for name, count in vocabulary[:3]]
+        name_term = Recipe.objects.order_by('id').values_list('name', flat=True).first().split()[0]
+        search = reverse('recipes:recipe_search')
+        sample = list(Recipe.objects.order_by('id')[:1000])
+        detail = sample[0].get_absolute_url()
+
+        def post(data):
+            return lambda: self.ok(self.client.post(search, data))
+
+        # Charts are drawn when their image is requested, from a cold chart cache
+        def chart(chart_type):
+            def run():
+                invalidate_charts()
+                response = self.ok(self.client.post(search, {'Ingredients': common[:1], 'chart_type': chart_type}))
+                match = CHART_URL.search(response.content.decode())
+                if match is None:
+                    raise CommandError(f'No chart for chart type {chart_type}')
+                self.ok(self.client.get(match[1]))
+            return run
+
+        def add_recipe():
+            response = self.client.post(reverse('recipes:add_recipe'), {
+                'name': 'Benchmark Recipe', 'cooking_time': 15, 'ingredients': ', '.join(common),
+            })
+            if response.status_code != 302:
+                raise CommandError(f'add_recipe_view returned {response.status_code}')
+            # Keep the catalog the same size between runs
+            Recipe.objects.filter(name='Benchmark Recipe').delete()
+
+        return [
+            ('list_view', lambda: self.ok(self.client.get(reverse('recipes:list')))),
+            ('detail_view', lambda: self.ok(self.client.get(detail))),
+            ('catalog_stats_view', lambda: self.ok(self.client.get(reverse('recipes:catalog_stats')))),
+            ('search_name', post({'Recipe_Name': name_term})),
+            ('search_one_ingredient', post({'Ingredients': common[:1]})),
+            ('search_many_ingredients', post({'Ingredients': common})),
+            ('chart_bar', chart('#1')),
+            ('chart_pie', chart('#2')),
+            ('chart_line', chart('#3')),
+            ('chart_histogram', chart('#4')),
+            ('calculate_difficulty_1000', lambda: [recipe.calculate_difficulty() for recipe in sample]),
+            ('add_recipe_view', add_recipe),
+        ]
+
+    # Fail the run on any error page, so broken views never look fast
+    def ok(self, response):
+        if response.status_code != 200:
+            raise CommandError(f'{response.request["PATH_INFO"]} returned {response.status_code}')
+        return response
+
+    # One warm-up run, then `repeat` timed runs counting the queries of the last one
+    def measure(self, run):
+        run()
+        durations = []
+        for _ in range(self.repeat):
+            queries = QueryStats()
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(queries))
+                start = time.perf_counter()
+                run()
+                durations.append((time.perf_counter() - start) * 1000)
+        return {
+            'median_ms': round(statistics.median(durations), 3),
+            'min_ms': round(min(durations), 3),
+            'max_ms': round(max(durations), 3),
+            'queries': queries.count,
+        }
+
+    def compare(self, report, path, tolerance):
+        try:
+            with open(path, encoding='utf-8') as source:
+                baseline = json.load(source)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Cannot read baseline {path}: {error}')
+
+        if baseline.get('catalog_size') != report['catalog_size']:
+            self.stderr.write(self.style.WARNING(
+                f'Baseline catalog has {baseline.get("catalog_size")} recipes, this one {report["catalog_size"]}.'
+            ))
+
+        regressions = []
+        for name, result in report['results'].items():
+            before = baseline.get('results', {}).get(name)
+            if before is None:
+                continue
+            change = result['median_ms'] / before['median_ms'] - 1 if before['median_ms'] else 0
+            line = f'{name:<32} {before["median_ms"]:>10.2f} -> {result["median_ms"]:>10.2f} ms ({change:+.0%})'
+            if change > tolerance:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line + '  REGRESSION'))
+            else:
+                self.stdout.write(line)
+
+        if regressions:
+            raise CommandError(f'{len(regressions)} benchmark(s) slower than the baseline by more than {tolerance:.0%}: {", ".join(regressions)}')
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
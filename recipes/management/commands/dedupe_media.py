@@ -0,0 +1,87 @@
+import hashlib
+import os
+import shutil
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from recipes.images import DERIVATIVE_DIR, delete_derivatives, generate_derivatives
+from recipes.models import ImageBlob, Recipe
+from recipes.page_cache import invalidate_recipes
+from recipes.storage import recipe_storage
+
+
+# Stream a file through SHA-256 without reading it into memory at once
+def hash_file(path, chunk_size=64 * 1024):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+# Move media/recipes to content-addressed storage, keeping one copy of each distinct picture
+class Command(BaseCommand):
+    help = 'Deduplicate MEDIA_ROOT/recipes into content-addressed files (dry run unless --apply).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apply', action='store_true', help='Move files and update recipes instead of only reporting.')
+
+    def handle(self, *args, **options):
+        apply = options['apply']
+        root = os.path.join(settings.MEDIA_ROOT, 'recipes')
+        derivative_root = os.path.abspath(os.path.join(settings.MEDIA_ROOT, DERIVATIVE_DIR))
+
+        # Group every picture (apart from derivatives) by the SHA-256 of its content
+        groups = defaultdict(list)
+        for directory, subdirectories, files in os.walk(root):
+            if os.path.abspath(directory).startswith(derivative_root):
+                continue
+            for filename in sorted(files):
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+                groups[hash_file(path)].append(name)
+
+        files_removed = 0
+        bytes_freed = 0
+        for digest, names in sorted(groups.items()):
+            target = recipe_storage.get_content_name(names[0], digest)
+            old_names = [name for name in names if name != target]
+            if not old_names:
+                continue
+
+            size = os.path.getsize(os.path.join(settings.MEDIA_ROOT, names[0]))
+            keep_copy = target not in names
+            files_removed += len(old_names) - (1 if keep_copy else 0)
+            bytes_freed += size * (len(old_names) - (1 if keep_copy else 0))
+            recipes = Recipe.objects.filter(pic__in=old_names)
+            self.stdout.write(f'{", ".join(names)} -> {target} ({recipes.count()} recipes)')
+            if not apply:
+                continue
+
+            # Put one copy at the content-addressed name, then point recipes at it
+            target_path = os.path.join(settings.MEDIA_ROOT, target)
+            if not os.path.exists(target_path):
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                shutil.copy2(os.path.join(settings.MEDIA_ROOT, old_names[0]), target_path)
+
+            with transaction.atomic():
+                pks = list(recipes.values_list('pk', flat=True))
+                recipes.update(pic=target, updated_at=timezone.now())
+                ImageBlob.objects.update_or_create(
+                    digest=digest,
+                    defaults={'name': target, 'ref_count': Recipe.objects.filter(pic=target).count()},
+                )
+                Recipe.objects.filter(pic=target).update(has_pic_derivatives=generate_derivatives(target, recipe_storage))
+                invalidate_recipes(pks)
+
+            for name in old_names:
+                os.remove(os.path.join(settings.MEDIA_ROOT, name))
+                delete_derivatives(name)
+
+        summary = f'{files_removed} duplicate files, {bytes_freed} bytes'
+        if apply:
+            self.stdout.write(self.style.SUCCESS(f'Removed {summary}.'))
+        else:
+            self.stdout.write(f'Dry run: would remove {summary}. Re-run with --apply to deduplicate.')
@@ -0,0 +1,56 @@
+import csv
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from recipes.models import Recipe
+
+# Columns written for each recipe; import_recipes reads name, cooking_time and ingredients back
+EXPORT_FIELDS = ('id', 'name', 'cooking_time', 'ingredients', 'difficulty', 'pic')
+
+
+# Write every recipe as JSON Lines or CSV, streamed from the database in chunks
+class Command(BaseCommand):
+    help = 'Export all recipes to a JSON Lines or CSV file ("-" for stdout).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='File to write, or "-" for stdout (the default).')
+        parser.add_argument('--format', choices=('jsonl', 'csv'), help='File format (default: from the file extension).')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Number of rows fetched from the database at a time.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+
+        if path == '-':
+            # Write records as they are, and keep progress out of the data
+            output = self.stdout
+            output.ending = ''
+            log = self.stderr
+        else:
+            try:
+                output = open(path, 'w', newline='', encoding='utf-8')
+            except OSError as error:
+                raise CommandError(f'Cannot write {path}: {error}')
+            log = self.stdout
+
+        started = time.monotonic()
+        exported = 0
+        rows = Recipe.objects.order_by('id').values_list(*EXPORT_FIELDS).iterator(chunk_size=options['chunk_size'])
+        try:
+            if file_format == 'csv':
+                writer = csv.writer(output)
+                writer.writerow(EXPORT_FIELDS)
+            for row in rows:
+                if file_format == 'csv':
+                    writer.writerow(row)
+                else:
+                    output.write(json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n')
+                exported += 1
+                if exported % 100000 == 0:
+                    log.write(f'Exported {exported} recipes...')
+        finally:
+            if output is not self.stdout:
+                output.close()
+
+        elapsed = time.monotonic() - started
+        log.write(self.style.SUCCESS(f'Exported {exported} recipes in {elapsed:.1f}s ({exported / max(elapsed, 1e-9):.0f}/s).'))
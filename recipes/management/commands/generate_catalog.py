@@ -0,0 +1,101 @@
+import math
+import random
+import time
+from itertools import accumulate
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.models import Recipe
+
+# Everyday ingredients, roughly from most to least common, so a Zipf-like draw gives the long
+# tail real catalogs have (salt and onion everywhere, saffron in a handful of recipes)
+BASE_INGREDIENTS = (
+    'salt', 'olive oil', 'onion', 'garlic', 'butter', 'pepper', 'egg', 'flour', 'sugar', 'milk',
+    'water', 'tomato', 'lemon', 'carrot', 'chicken', 'potato', 'parsley', 'cheese', 'rice', 'cream',
+    'celery', 'basil', 'thyme', 'ginger', 'soy sauce', 'honey', 'vinegar', 'beef', 'bell pepper',
+    'mushroom', 'cumin', 'paprika', 'cinnamon', 'oregano', 'lime', 'cilantro', 'pasta', 'bacon',
+    'spinach', 'yogurt', 'chili', 'coconut milk', 'bread', 'zucchini', 'pork', 'beans', 'broccoli',
+    'cucumber', 'lettuce', 'corn', 'shrimp', 'salmon', 'vanilla', 'baking powder', 'mustard',
+    'rosemary', 'peas', 'chickpeas', 'lentils', 'avocado', 'apple', 'banana', 'orange', 'almonds',
+    'walnuts', 'oats', 'maple syrup', 'sesame oil', 'scallion', 'shallot', 'leek', 'cabbage',
+    'cauliflower', 'eggplant', 'sweet potato', 'pumpkin', 'feta', 'mozzarella', 'parmesan', 'tofu',
+    'turkey', 'lamb', 'tuna', 'cod', 'anchovy', 'capers', 'olives', 'raisins', 'dates', 'cocoa',
+    'chocolate', 'coffee', 'turmeric', 'coriander', 'nutmeg', 'cardamom', 'cloves', 'bay leaf',
+    'dill', 'mint', 'tarragon', 'sage', 'fennel', 'radish', 'beetroot', 'asparagus', 'artichoke',
+    'quinoa', 'couscous', 'noodles', 'tortilla', 'pita', 'polenta', 'ricotta', 'mascarpone',
+    'gruyere', 'pecans', 'pistachios', 'hazelnuts', 'pine nuts', 'tahini', 'miso', 'fish sauce',
+    'saffron', 'star anise', 'lemongrass', 'kaffir lime', 'sumac', 'harissa',
+)
+
+# Prefixes that turn the base list into a vocabulary of about 1,500 distinct ingredients
+VARIANTS = ('', 'fresh', 'dried', 'ground', 'smoked', 'roasted', 'chopped', 'frozen', 'organic', 'red', 'green', 'wild')
+
+DISH_ADJECTIVES = ('Easy', 'Spicy', 'Creamy', 'Smoky', 'Classic', 'Quick', 'Rustic', 'Crispy', 'Hearty', 'Zesty')
+DISHES = ('Soup', 'Stew', 'Salad', 'Curry', 'Pie', 'Bake', 'Stir Fry', 'Pasta', 'Tacos', 'Risotto', 'Roast', 'Skillet', 'Bowl', 'Cake')
+
+# Most recipes have 4-8 ingredients; AddRecipeForm allows at most 10
+INGREDIENT_COUNTS = range(2, 11)
+INGREDIENT_COUNT_WEIGHTS = (2, 5, 9, 12, 12, 10, 7, 4, 2)
+
+
+def get_vocabulary():
+    return [f'{variant} {name}'.strip() for variant in VARIANTS for name in BASE_INGREDIENTS]
+
+# Unnormalized Zipf weights (s = 1.1) for a vocabulary ordered from most to least common
+def get_zipf_weights(size, exponent=1.1):
+    return [1 / math.pow(rank, exponent) for rank in range(1, size + 1)]
+
+# Yield `count` unsaved recipes; the same seed always gives the same catalog
+def generate_recipes(count, seed=0):
+    rng = random.Random(seed)
+    vocabulary = get_vocabulary()
+    # Plain ingredients come first, so they get the most weight; variants make up the tail
+    cumulative_weights = list(accumulate(get_zipf_weights(len(vocabulary))))
+
+    for number in range(1, count + 1):
+        size = rng.choices(INGREDIENT_COUNTS, INGREDIENT_COUNT_WEIGHTS)[0]
+        ingredients = []
+        while len(ingredients) < size:
+            ingredient = rng.choices(vocabulary, cum_weights=cumulative_weights)[0]
+            if ingredient not in ingredients:
+                ingredients.append(ingredient)
+
+        main = ingredients[rng.randrange(len(ingredients))].title()
+        yield Recipe(
+            name=f'{rng.choice(DISH_ADJECTIVES)} {main} {rng.choice(DISHES)} {number}',
+            # Log-normal: mostly 10-60 minutes, a few slow braises
+            cooking_time=max(1, min(600, round(rng.lognormvariate(3.3, 0.7)))),
+            ingredients=', '.join(ingredients),
+        )
+
+
+# Fill the database with a synthetic catalog for benchmarking (use a separate database, e.g.
+# DATABASE_URL=sqlite:///bench-100k.sqlite3)
+class Command(BaseCommand):
+    help = 'Add a reproducible synthetic catalog of recipes (for the benchmark command).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=1000, help='Number of recipes to generate (e.g. 1000, 100000, 1000000).')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed gives the same catalog.')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Number of recipes written per transaction.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        started = time.monotonic()
+        created = 0
+        batch = []
+        for recipe in generate_recipes(options['size'], options['seed']):
+            batch.append(recipe)
+            if len(batch) >= batch_size:
+                created += self.write_batch(batch)
+                batch = []
+                self.stdout.write(f'Created {created} recipes ({created / (time.monotonic() - started):.0f}/s)...')
+        created += self.write_batch(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Created {created} recipes in {time.monotonic() - started:.1f}s.'))
+
+    def write_batch(self, batch):
+        if not batch:
+            return 0
+        with transaction.atomic():
+            Recipe.objects.bulk_create(batch)
+        return len(batch)
@@ -0,0 +1,100 @@
+import csv
+import json
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.forms import AddRecipeForm
+from recipes.models import Recipe
+
+# Columns read from each record; anything else (e.g. id or difficulty from export_recipes) is ignored
+IMPORT_FIELDS = ('name', 'cooking_time', 'ingredients')
+
+
+# (line number, record) pairs from a JSON Lines or CSV file, read one line at a time
+def read_records(source, file_format):
+    if file_format == 'csv':
+        reader = csv.DictReader(source)
+        for record in reader:
+            yield reader.line_num, record
+        return
+
+    for line_number, line in enumerate(source, start=1):
+        if line.strip():
+            try:
+                yield line_number, json.loads(line)
+            except json.JSONDecodeError as error:
+                yield line_number, error
+
+
+# Load recipes from JSONL or CSV, validated like AddRecipeForm and written in batches
+class Command(BaseCommand):
+    help = 'Import recipes from a JSON Lines or CSV file ("-" for stdin), in batched transactions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to read, or "-" for stdin.')
+        parser.add_argument('--format', choices=('jsonl', 'csv'), help='File format (default: from the file extension).')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of recipes written per transaction.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        batch_size = options['batch_size']
+
+        try:
+            source = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        except OSError as error:
+            raise CommandError(f'Cannot read {path}: {error}')
+
+        started = time.monotonic()
+        imported = 0
+        skipped = 0
+        batch = []
+        try:
+            for line_number, record in read_records(source, file_format):
+                recipe = self.validate(line_number, record)
+                if recipe is None:
+                    skipped += 1
+                    continue
+
+                batch.append(recipe)
+                if len(batch) >= batch_size:
+                    imported += self.write_batch(batch)
+                    batch = []
+                    self.report(imported, started)
+            imported += self.write_batch(batch)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} recipes in {elapsed:.1f}s ({imported / max(elapsed, 1e-9):.0f}/s), skipped {skipped} invalid.'
+        ))
+
+    # An unsaved Recipe for a valid record; invalid records are reported and skipped
+    def validate(self, line_number, record):
+        if not isinstance(record, dict):
+            self.stderr.write(f'Line {line_number}: {record if isinstance(record, Exception) else "expected an object"}')
+            return None
+
+        # The same rules as the "Add Recipe" page
+        form = AddRecipeForm(data={field: record.get(field) for field in IMPORT_FIELDS})
+        if not form.is_valid():
+            errors = '; '.join(f'{field}: {" ".join(messages)}' for field, messages in form.errors.items())
+            self.stderr.write(f'Line {line_number}: {errors}')
+            return None
+        return form.save(commit=False)
+
+    # bulk_create fills in the derived columns and ingredient links; one transaction per batch
+    # keeps transactions (and memory) bounded however large the file is
+    def write_batch(self, batch):
+        if not batch:
+            return 0
+        with transaction.atomic():
+            Recipe.objects.bulk_create(batch)
+        return len(batch)
+
+    def report(self, imported, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'Imported {imported} recipes ({imported / max(elapsed, 1e-9):.0f}/s)...')
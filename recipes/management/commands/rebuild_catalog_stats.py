@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from recipes.catalog_stats import rebuild_stats
+from recipes.page_cache import bump_catalog_version
+
+
+# Recompute the catalog statistics from scratch, e.g. after editing recipes with raw SQL
+class Command(BaseCommand):
+    help = 'Rebuild the incrementally maintained catalog statistics from the recipes.'
+
+    def handle(self, *args, **options):
+        recipes = rebuild_stats()
+        # Every stat row was rewritten, so have the indexes read from the stats (the ingredient
+        # vocabulary, the trigram index) follow their change feed
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt catalog statistics for {recipes} recipes.'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from recipes.models import Recipe
+from recipes.similarity import update_buckets
+
+
+# Recompute every recipe's similarity buckets, e.g. after changing the MinHash parameters
+class Command(BaseCommand):
+    help = 'Rebuild the MinHash/LSH buckets used for "similar recipes", in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of recipes updated per transaction.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        updated = 0
+
+        # Walk the table by primary key so each batch is an indexed range read
+        while True:
+            batch = list(Recipe.objects.filter(id__gt=last_id).order_by('id').only('id', 'ingredients')[:batch_size])
+            if not batch:
+                break
+
+            update_buckets(batch)
+            last_id = batch[-1].id
+            updated += len(batch)
+            self.stdout.write(f'Updated {updated} recipes...')
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt similarity buckets for {updated} recipes.'))
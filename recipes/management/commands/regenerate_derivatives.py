@@ -0,0 +1,52 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from recipes.images import DERIVATIVE_DIR, generate_derivatives
+from recipes.models import Recipe
+from recipes.page_cache import invalidate_recipes
+from recipes.storage import recipe_storage
+
+
+# Runs in a worker process: (name, True/False) depending on whether the picture could be read
+def regenerate(name, force):
+    return name, generate_derivatives(name, recipe_storage, force=force)
+
+
+# Rebuild the WebP card images for every picture in media/recipes, spread across CPU cores
+class Command(BaseCommand):
+    help = 'Generate resized WebP derivatives for every recipe picture in MEDIA_ROOT/recipes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of worker processes.')
+        parser.add_argument('--force', action='store_true', help='Regenerate derivatives that already exist.')
+
+    def handle(self, *args, **options):
+        # Every uploaded picture under media/recipes, apart from the derivatives themselves
+        root = os.path.join(settings.MEDIA_ROOT, 'recipes')
+        derivative_root = os.path.join(settings.MEDIA_ROOT, DERIVATIVE_DIR)
+        names = []
+        for directory, subdirectories, files in os.walk(root):
+            if os.path.abspath(directory).startswith(os.path.abspath(derivative_root)):
+                continue
+            for filename in files:
+                path = os.path.join(directory, filename)
+                names.append(os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/'))
+
+        generated = []
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            for name, ok in executor.map(regenerate, names, [options['force']] * len(names)):
+                if ok:
+                    generated.append(name)
+                else:
+                    self.stderr.write(f'Skipped {name}: not a readable image')
+
+        # Let the templates know these recipes can use srcset now
+        recipes = Recipe.objects.filter(pic__in=generated)
+        pks = list(recipes.values_list('pk', flat=True))
+        updated = recipes.update(has_pic_derivatives=True, updated_at=timezone.now())
+        invalidate_recipes(pks)
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated derivatives for {len(generated)} of {len(names)} pictures ({updated} recipes updated).'
+        ))
@@ -0,0 +1,39 @@
+# Serve content-addressed recipe pictures and their WebP derivatives (see storage.py and
+# images.py) the way WhiteNoise serves static files: straight from the middleware, with a
+# far-future immutable Cache-Control, before URL routing, sessions or views run. A CDN in front of
+# the app keeps them after the first request.
+# Pictures are uploaded while the server is running, so unlike static files they can't all be
+# indexed at startup; each request looks its file up on disk (one stat) instead. Any other media
+# URL, or a picture that isn't there, falls through to Django.
+import os
+import re
+from urllib.parse import urlparse
+from django.conf import settings
+from whitenoise.base import WhiteNoise
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+# Names that are digests of their content: pictures and the derivatives named after them
+CONTENT_ADDRESSED_PATH = re.compile(r'recipes/(?:[0-9a-f]{2}/[0-9a-f]{64}\.\w+|derivatives/[0-9a-f]{64}-\d+w\.webp)')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def add_immutable_headers(headers, path, url):
+    headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+
+
+class ContentAddressedMediaMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = urlparse(settings.MEDIA_URL).path
+        self.files = WhiteNoise(None, autorefresh=True, add_headers_function=add_immutable_headers)
+        self.files.add_files(os.fspath(settings.MEDIA_ROOT), prefix=self.prefix)
+
+    def __call__(self, request):
+        path = request.path_info
+        if path.startswith(self.prefix) and CONTENT_ADDRESSED_PATH.fullmatch(path[len(self.prefix):]):
+            static_file = self.files.find_file(path)
+            if static_file is not None:
+                return WhiteNoiseMiddleware.serve(static_file, request)
+        return self.get_response(request)
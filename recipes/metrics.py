@@ -0,0 +1,245 @@
+# Per-request performance metrics: latency per view, database queries per request and time
+# spent in instrumented code paths (search, DataFrames, charts, templates), exposed in the
+# Prometheus text format on /metrics and optionally as Server-Timing response headers.
+#
+# Each worker process keeps its own histograms in memory (a dict update under a lock per
+# observation) and publishes a snapshot to the default cache, which every worker shares, every
+# PUBLISH_INTERVAL seconds, so /metrics can add up every worker, whichever one answers the scrape.
+# Snapshots go in numbered slots (metrics:worker:0 ... MAX_WORKERS - 1): a worker claims the first
+# free one with cache.add(), keeps it for as long as it refreshes it, and /metrics reads them all
+# with one get_many(). No shared list of workers is read and written back, so workers publishing
+# at the same time can't drop each other.
+import bisect
+import contextvars
+import os
+import socket
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+# Histogram bucket upper bounds
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# How often each worker publishes its snapshot, and how long one outlives its worker
+PUBLISH_INTERVAL = 10
+SNAPSHOT_TIMEOUT = 300
+
+# Most workers whose snapshots are collected
+MAX_WORKERS = 64
+
+
+class Histogram:
+
+    def __init__(self, name, documentation, labels, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # {label values: [count per bucket..., sum, count]}
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            row = self.values.get(label_values)
+            if row is None:
+                row = self.values[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                row[index] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {label_values: list(row) for label_values, row in self.values.items()}
+
+
+REQUEST_DURATION = Histogram('recipe_request_duration_seconds', 'Time spent handling a request.', ('view', 'method', 'status'))
+REQUEST_QUERIES = Histogram('recipe_request_queries', 'Database queries run by a request.', ('view',), QUERY_COUNT_BUCKETS)
+QUERY_DURATION = Histogram('recipe_request_query_duration_seconds', 'Time a request spent in database queries.', ('view',))
+TIMER_DURATION = Histogram('recipe_timer_duration_seconds', 'Time spent in an instrumented code path.', ('name',))
+HISTOGRAMS = (REQUEST_DURATION, REQUEST_QUERIES, QUERY_DURATION, TIMER_DURATION)
+
+# [(name, seconds), ...] for the request being handled, used for the Server-Timing header
+_timings = contextvars.ContextVar('recipe_timings', default=None)
+_last_published = 0
+# Slot this worker publishes its snapshot in, once claimed
+_slot = None
+
+
+# Time a block of code: `with timer('dataframe'): ...`
+@contextmanager
+def timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        TIMER_DURATION.observe(duration, name)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((name, duration))
+
+
+# execute_wrapper() hook counting and timing every query of one request
+class QueryStats:
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+# Runs sync or async, whichever the rest of the stack is, so async views stay on the event loop
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timings, queries, start = [], QueryStats(), time.perf_counter()
+        token = _timings.set(timings)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(queries))
+                response = self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self.record(request, response, timings, queries, start)
+
+    async def __acall__(self, request):
+        timings, queries, start = [], QueryStats(), time.perf_counter()
+        token = _timings.set(timings)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(queries))
+                response = await self.get_response(request)
+        finally:
+            _timings.reset(token)
+        return self.record(request, response, timings, queries, start)
+
+    def record(self, request, response, timings, queries, start):
+        duration = time.perf_counter() - start
+
+        # Label by URL pattern name rather than path, so the number of series stays small
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        REQUEST_DURATION.observe(duration, view, request.method, str(response.status_code))
+        REQUEST_QUERIES.observe(queries.count, view)
+        QUERY_DURATION.observe(queries.duration, view)
+
+        if settings.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = get_server_timing(timings, queries, duration)
+        maybe_publish()
+        return response
+
+    # TemplateResponses are rendered after the view returns
+    def process_template_response(self, request, response):
+        render = response.render
+
+        def timed_render():
+            with timer('template'):
+                return render()
+        response.render = timed_render
+        return response
+
+
+# Server-Timing header value, e.g. db;dur=3.1;desc="4 queries", template;dur=2.0, total;dur=9.8
+def get_server_timing(timings, queries, duration):
+    totals = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0) + seconds
+    entries = [f'db;dur={queries.duration * 1000:.1f};desc="{queries.count} queries"']
+    entries += [f'{name};dur={seconds * 1000:.1f}' for name, seconds in totals.items()]
+    entries.append(f'total;dur={duration * 1000:.1f}')
+    return ', '.join(entries)
+
+
+# This process's histograms: {metric name: {label values: [...]}}
+def snapshot():
+    return {histogram.name: histogram.snapshot() for histogram in HISTOGRAMS}
+
+def get_slot_key(slot):
+    return f'metrics:worker:{slot}'
+
+# Identifies this process among the workers of every machine
+def get_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+# Share this process's snapshot with the other workers
+def publish():
+    global _last_published, _slot
+
+    _last_published = time.monotonic()
+    entry = (get_worker_id(), snapshot())
+    if _slot is not None and cache.get(get_slot_key(_slot), (None,))[0] == entry[0]:
+        cache.set(get_slot_key(_slot), entry, timeout=SNAPSHOT_TIMEOUT)
+        return
+    # First publish, or the slot expired while this worker was idle and may have been taken
+    _slot = next((slot for slot in range(MAX_WORKERS) if cache.add(get_slot_key(slot), entry, timeout=SNAPSHOT_TIMEOUT)), None)
+
+def maybe_publish():
+    if time.monotonic() - _last_published > PUBLISH_INTERVAL:
+        publish()
+
+# Add up the latest snapshots of every worker (including this one, published first)
+def collect():
+    publish()
+    # Slots of workers that stopped publishing have expired
+    entries = cache.get_many([get_slot_key(slot) for slot in range(MAX_WORKERS)])
+
+    merged = {histogram.name: {} for histogram in HISTOGRAMS}
+    for worker_id, worker in entries.values():
+        for name, values in worker.items():
+            for label_values, row in values.items():
+                total = merged.setdefault(name, {}).get(label_values)
+                merged[name][label_values] = row if total is None else [a + b for a, b in zip(total, row)]
+    return merged
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+# Prometheus text exposition format (version 0.0.4)
+def render_metrics(values=None):
+    values = collect() if values is None else values
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.append(f'# HELP {histogram.name} {histogram.documentation}')
+        lines.append(f'# TYPE {histogram.name} histogram')
+        for label_values, row in sorted(values.get(histogram.name, {}).items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, row):
+                cumulative += count
+                lines.append(f'{histogram.name}_bucket{format_labels(histogram.labels, label_values, le=bound)} {cumulative}')
+            lines.append(f'{histogram.name}_bucket{format_labels(histogram.labels, label_values, le="+Inf")} {row[-1]}')
+            lines.append(f'{histogram.name}_sum{format_labels(histogram.labels, label_values)} {row[-2]}')
+            lines.append(f'{histogram.name}_count{format_labels(histogram.labels, label_values)} {row[-1]}')
+    return '\n'.join(lines) + '\n'
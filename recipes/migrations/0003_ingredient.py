@@ -0,0 +1,37 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:10
+
+from django.db import migrations, models
+
+
+# Link every existing recipe to normalized Ingredient rows parsed from its ingredients string
+def backfill_ingredients(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+
+    for recipe in Recipe.objects.only('id', 'ingredients').iterator(chunk_size=500):
+        names = {name.strip().lower() for name in recipe.ingredients.split(',') if name.strip()}
+        Ingredient.objects.bulk_create([Ingredient(name=name) for name in names], ignore_conflicts=True)
+        recipe.ingredient_items.set(Ingredient.objects.filter(name__in=names))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_recipe_pic'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ingredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=400, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredient_items',
+            field=models.ManyToManyField(blank=True, editable=False, related_name='recipes', to='recipes.ingredient'),
+        ),
+        migrations.RunPython(backfill_ingredients, migrations.RunPython.noop),
+    ]
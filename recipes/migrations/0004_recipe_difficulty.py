@@ -0,0 +1,44 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:11
+
+from django.db import migrations, models
+
+
+# Fill in difficulty and ingredient_count for existing recipes (same rules as Recipe.set_derived_fields)
+def backfill_difficulty(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+
+    batch = []
+    for recipe in Recipe.objects.only('id', 'cooking_time', 'ingredients').iterator(chunk_size=1000):
+        names = {name.strip().lower() for name in recipe.ingredients.split(',') if name.strip()}
+        recipe.ingredient_count = len(names)
+        if recipe.cooking_time < 10:
+            recipe.difficulty = 'Easy' if recipe.ingredient_count < 4 else 'Medium'
+        else:
+            recipe.difficulty = 'Intermediate' if recipe.ingredient_count < 4 else 'Hard'
+        batch.append(recipe)
+
+        if len(batch) >= 1000:
+            Recipe.objects.bulk_update(batch, ['difficulty', 'ingredient_count'])
+            batch = []
+    Recipe.objects.bulk_update(batch, ['difficulty', 'ingredient_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_ingredient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='difficulty',
+            field=models.CharField(blank=True, choices=[('Easy', 'Easy'), ('Medium', 'Medium'), ('Intermediate', 'Intermediate'), ('Hard', 'Hard')], db_index=True, editable=False, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredient_count',
+            field=models.PositiveSmallIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_difficulty, migrations.RunPython.noop),
+    ]
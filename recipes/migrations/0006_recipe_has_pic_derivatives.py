@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_name_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='has_pic_derivatives',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
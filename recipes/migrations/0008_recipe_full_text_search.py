@@ -0,0 +1,65 @@
+# Full-text index over recipe name and ingredients (see recipes/search.py)
+# Note: when a later migration makes Django rebuild recipes_recipe on SQLite (e.g. adding a
+# NOT NULL column), the triggers below are dropped with the old table and must be re-created.
+
+from django.db import migrations
+
+
+SQLITE_FORWARD = [
+    # External-content FTS5 table: the text stays in recipes_recipe, FTS5 only keeps the index
+    """CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5(
+        name, ingredients, content='recipes_recipe', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    # Triggers keep the index current on every insert, update and delete
+    """CREATE TRIGGER recipes_recipe_fts_insert AFTER INSERT ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_fts(rowid, name, ingredients) VALUES (new.id, new.name, new.ingredients);
+    END""",
+    """CREATE TRIGGER recipes_recipe_fts_delete AFTER DELETE ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_fts(recipes_recipe_fts, rowid, name, ingredients) VALUES ('delete', old.id, old.name, old.ingredients);
+    END""",
+    """CREATE TRIGGER recipes_recipe_fts_update AFTER UPDATE OF name, ingredients ON recipes_recipe BEGIN
+        INSERT INTO recipes_recipe_fts(recipes_recipe_fts, rowid, name, ingredients) VALUES ('delete', old.id, old.name, old.ingredients);
+        INSERT INTO recipes_recipe_fts(rowid, name, ingredients) VALUES (new.id, new.name, new.ingredients);
+    END""",
+    # Index the recipes that already exist
+    "INSERT INTO recipes_recipe_fts(recipes_recipe_fts) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_update',
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_delete',
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_insert',
+    'DROP TABLE IF EXISTS recipes_recipe_fts',
+]
+
+# An expression index is always current, so PostgreSQL needs no triggers
+POSTGRES_FORWARD = [
+    """CREATE INDEX recipes_recipe_fts_idx ON recipes_recipe
+        USING GIN (to_tsvector('english', coalesce(name, '') || ' ' || coalesce(ingredients, '')))""",
+]
+
+POSTGRES_REVERSE = [
+    'DROP INDEX IF EXISTS recipes_recipe_fts_idx',
+]
+
+
+def run_statements(schema_editor, statements):
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+def create_search_index(apps, schema_editor):
+    run_statements(schema_editor, {'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD})
+
+def drop_search_index(apps, schema_editor):
+    run_statements(schema_editor, {'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRES_REVERSE})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_content_addressed_pictures'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:35
+
+import hashlib
+import random
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# The MinHash/LSH hashing as of this migration, copied from recipes/similarity.py so that later
+# changes to its parameters can't change what this migration writes (such a change needs its own
+# migration or `rebuild_similarity`)
+NUM_HASHES = 64
+BANDS = 16
+ROWS = NUM_HASHES // BANDS
+PRIME = (1 << 31) - 1
+_random = random.Random(20261018)
+HASH_COEFFICIENTS = [(_random.randrange(1, PRIME), _random.randrange(0, PRIME)) for _ in range(NUM_HASHES)]
+BAND_MULTIPLIERS = [_random.randrange(1, 1 << 64, 2) for _ in range(ROWS + 1)]
+
+
+def parse_ingredients(ingredients):
+    names = []
+    for ingredient in ingredients.split(','):
+        name = ingredient.strip().lower()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+def get_buckets(names):
+    import numpy as np
+
+    values = np.array([
+        int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), 'big') % PRIME for name in set(names)
+    ], dtype=np.uint64)
+    if not len(values):
+        return []
+    a, b = np.array(HASH_COEFFICIENTS, dtype=np.uint64).T
+    signature = ((values[:, None] * a + b) % np.uint64(PRIME)).min(axis=0)
+    multipliers = np.array(BAND_MULTIPLIERS, dtype=np.uint64)
+    bands = np.column_stack([signature.reshape(BANDS, ROWS), np.arange(BANDS, dtype=np.uint64)])
+    with np.errstate(over='ignore'):
+        buckets = (bands * multipliers).sum(axis=1, dtype=np.uint64)
+    return buckets.view(np.int64).tolist()
+
+# Compute the buckets of existing recipes
+def backfill_buckets(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    SimilarityBucket = apps.get_model('recipes', 'SimilarityBucket')
+
+    batch = []
+    for recipe_id, ingredients in Recipe.objects.values_list('id', 'ingredients').iterator(chunk_size=1000):
+        batch.extend(SimilarityBucket(recipe_id=recipe_id, bucket=bucket) for bucket in set(get_buckets(parse_ingredients(ingredients))))
+        if len(batch) >= 1000:
+            SimilarityBucket.objects.bulk_create(batch)
+            batch = []
+    SimilarityBucket.objects.bulk_create(batch)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_full_text_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarityBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.BigIntegerField(db_index=True)),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similarity_buckets', to='recipes.recipe')),
+            ],
+        ),
+        migrations.RunPython(backfill_buckets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Adding a NOT NULL column makes Django rebuild recipes_recipe on SQLite, which drops the
+# full-text search triggers from migration 0008, so they are created again afterwards (and
+# again before the table is rebuilt back when migrating backwards).
+from importlib import import_module
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def create_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    full_text_search = import_module('recipes.migrations.0008_recipe_full_text_search')
+    # Everything after CREATE VIRTUAL TABLE: the three triggers and a rebuild of the index
+    for statement in full_text_search.SQLITE_FORWARD[1:]:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_similarity_bucket'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, create_search_triggers),
+        migrations.AddField(
+            model_name='recipe',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(create_search_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:13
+
+import bisect
+from collections import Counter
+from django.db import migrations, models
+
+
+# The counting as of this migration, copied from recipes/catalog_stats.py so that later changes
+# to the bins or difficulty levels can't change what this migration writes (such a change needs
+# its own migration or `rebuild_catalog_stats`)
+COOKING_TIME_BINS = (0, 10, 20, 30, 45, 60, 90, 120, 180, 240)
+
+
+def parse_ingredients(ingredients):
+    names = []
+    for ingredient in ingredients.split(','):
+        name = ingredient.strip().lower()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+def get_difficulty(cooking_time, num_ingredients):
+    if cooking_time < 10:
+        return 'Easy' if num_ingredients < 4 else 'Medium'
+    return 'Intermediate' if num_ingredients < 4 else 'Hard'
+
+def count_recipes(rows):
+    totals = Counter()
+    for cooking_time, ingredients in rows:
+        names = parse_ingredients(ingredients)
+        cooking_time_bin = COOKING_TIME_BINS[max(bisect.bisect_right(COOKING_TIME_BINS, cooking_time) - 1, 0)]
+        totals[('difficulty', get_difficulty(cooking_time, len(names)))] += 1
+        totals[('cooking_time', str(cooking_time_bin))] += 1
+        totals[('total', 'recipes')] += 1
+        totals[('total', 'cooking_seconds')] += round(cooking_time * 60)
+        totals.update(('ingredient', name) for name in names)
+    return totals
+
+# Count the existing recipes
+def backfill_stats(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    CatalogStat = apps.get_model('recipes', 'CatalogStat')
+
+    totals = count_recipes(Recipe.objects.values_list('cooking_time', 'ingredients').iterator(chunk_size=1000))
+    CatalogStat.objects.bulk_create(
+        [CatalogStat(kind=kind, key=key, count=amount) for (kind, key), amount in totals.items() if amount],
+        batch_size=1000,
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('difficulty', 'Recipes per difficulty level'), ('cooking_time', 'Recipes per cooking time bin'), ('ingredient', 'Recipes per ingredient'), ('total', 'Catalog totals')], max_length=20)),
+                ('key', models.CharField(max_length=400)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', '-count'], name='catalog_stat_kind_count_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='catalogstat',
+            constraint=models.UniqueConstraint(fields=('kind', 'key'), name='catalog_stat_kind_key_unique'),
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.16 on 2026-10-18 15:40
+
+import re
+from collections import Counter
+import django.utils.timezone
+from django.db import migrations, models
+
+
+# The word counting as of this migration, copied from recipes/catalog_stats.py so that later
+# changes to it can't change what this migration writes (such a change needs its own migration
+# or `rebuild_catalog_stats`)
+def get_words(text):
+    return re.findall(r'\w+', text.lower())
+
+def count_words(rows):
+    totals = Counter()
+    for name, ingredients in rows:
+        totals.update(('word', word) for word in set(get_words(name) + get_words(ingredients)))
+    return totals
+
+# Count the words of the existing recipes
+def backfill_words(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    CatalogStat = apps.get_model('recipes', 'CatalogStat')
+
+    totals = count_words(Recipe.objects.values_list('name', 'ingredients').iterator(chunk_size=1000))
+    CatalogStat.objects.bulk_create(
+        [CatalogStat(kind=kind, key=key, count=amount) for (kind, key), amount in totals.items()],
+        batch_size=1000,
+    )
+
+def remove_words(apps, schema_editor):
+    apps.get_model('recipes', 'CatalogStat').objects.filter(kind='word').delete()
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_catalog_stat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogstat',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='catalogstat',
+            name='kind',
+            field=models.CharField(choices=[('difficulty', 'Recipes per difficulty level'), ('cooking_time', 'Recipes per cooking time bin'), ('ingredient', 'Recipes per ingredient'), ('word', 'Recipes per word of their name and ingredients'), ('total', 'Catalog totals')], max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='catalogstat',
+            index=models.Index(fields=['kind', 'updated_at'], name='catalog_stat_kind_updated_idx'),
+        ),
+        migrations.RunPython(backfill_words, remove_words),
+    ]
@@ -1,8 +1,175 @@
-from django.db import models
+import re
+from datetime import timedelta
+from django.db import connection, models, transaction
+from django.utils import timezone
+from django.dispatch import Signal
 from django.shortcuts import reverse
+from .storage import get_recipe_storage
 
 # Create your models here.
 
+# Split a comma-separated ingredients string into normalized (stripped, lowercase) unique names
+def parse_ingredients(ingredients):
+    names = []
+    for ingredient in ingredients.split(','):
+        name = ingredient.strip().lower()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+# Lowercase words in a piece of text
+def get_words(text):
+    return re.findall(r'\w+', text.lower())
+
+# Sent after RecipeQuerySet.bulk_create() (which skips post_save) with recipes=[...]
+recipes_bulk_created = Signal()
+
+# Sent after RecipeQuerySet.bulk_update() (which skips post_save too) with recipes=[...] and the
+# updated fields=[...]
+recipes_bulk_updated = Signal()
+
+# Work out a difficulty level from cooking time and number of ingredients
+def get_difficulty(cooking_time, num_ingredients):
+    if cooking_time < 10:
+        if num_ingredients < 4:
+            difficulty = 'Easy'
+        else:
+            difficulty = 'Medium'
+    else:
+        if num_ingredients < 4:
+            difficulty = 'Intermediate'
+        else:
+            difficulty = 'Hard'
+    return difficulty
+
+# Set difficulty choices
+DIFFICULTY_CHOICES = (
+    ('Easy', 'Easy'),
+    ('Medium', 'Medium'),
+    ('Intermediate', 'Intermediate'),
+    ('Hard', 'Hard'),
+)
+
+# Define a normalized ingredient so searches can use an indexed join instead of substring scans
+class Ingredient(models.Model):
+
+    # Unique implies a database index on the name column. As long as Recipe.ingredients, so a
+    # recipe with a single long ingredient still fits
+    name = models.CharField(max_length=400, unique=True)
+
+    def __str__(self):
+        return str(self.name)
+
+# One stored picture file and the number of recipes using it (see storage.py)
+class ImageBlob(models.Model):
+    digest = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255)
+    ref_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return str(self.name)
+
+# Custom queryset so ingredient filtering can be reused outside of the search view
+class RecipeQuerySet(models.QuerySet):
+
+    # Keep only recipes linked to every one of the given ingredient names (an indexed join
+    # on Ingredient.name, grouped per recipe, instead of one LIKE scan per ingredient)
+    def with_all_ingredients(self, ingredients):
+        names = {ingredient.strip().lower() for ingredient in ingredients}
+        if not names:
+            return self
+        return (
+            self.filter(ingredient_items__name__in=names)
+            .annotate(matched_ingredients=models.Count('ingredient_items'))
+            .filter(matched_ingredients=len(names))
+        )
+
+    # Count recipes per difficulty level with a single GROUP BY query
+    def difficulty_counts(self):
+        # Wrap in a subquery so grouping by difficulty works on annotated/filtered querysets too
+        rows = (
+            Recipe.objects.filter(pk__in=self.values('pk'))
+            .values_list('difficulty')
+            .annotate(count=models.Count('pk'))
+            .order_by('difficulty')
+        )
+        return dict(rows)
+
+    # bulk_create() skips save(), so fill in the derived columns and ingredient links here
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for recipe in objs:
+            recipe.set_derived_fields()
+        objs = super().bulk_create(objs, *args, **kwargs)
+
+        # Primary keys are only set on backends that return them (SQLite 3.35+, PostgreSQL)
+        created = [recipe for recipe in objs if recipe.pk is not None]
+        self.link_ingredients(created)
+        recipes_bulk_created.send(sender=Recipe, recipes=created)
+        return objs
+
+    # Ingredient links for newly created recipes, with a fixed number of queries per batch
+    # instead of a few per recipe
+    def link_ingredients(self, recipes):
+        names_by_recipe = {recipe.pk: parse_ingredients(recipe.ingredients) for recipe in recipes}
+        names = {name for recipe_names in names_by_recipe.values() for name in recipe_names}
+        if not names:
+            return
+        Ingredient.objects.bulk_create([Ingredient(name=name) for name in names], ignore_conflicts=True)
+        ingredient_ids = dict(Ingredient.objects.filter(name__in=names).values_list('name', 'id'))
+
+        # New recipes have no links yet, so plain INSERTs with one executemany() will do
+        table = connection.ops.quote_name(Recipe.ingredient_items.through._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.executemany(f'INSERT INTO {table} (recipe_id, ingredient_id) VALUES (%s, %s)', [
+                (recipe_id, ingredient_ids[name])
+                for recipe_id, recipe_names in names_by_recipe.items()
+                for name in recipe_names
+            ])
+
+    # Ingredient links for recipes whose ingredients changed: the old links are dropped in one
+    # DELETE, then the new ones inserted like link_ingredients() does for new recipes
+    def relink_ingredients(self, recipes):
+        with transaction.atomic():
+            Recipe.ingredient_items.through.objects.filter(recipe_id__in=[recipe.pk for recipe in recipes]).delete()
+            self.link_ingredients(recipes)
+
+    # bulk_update() skips save() too; recompute derived columns, ingredient links and catalog stats
+    # if their inputs changed, and let the receivers of recipes_bulk_updated update everything else
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        from .catalog_stats import update_stats
+        from .page_cache import invalidate_recipes
+
+        objs = list(objs)
+        fields = list(fields)
+        # Derived columns alone (backfill_difficulty) follow from columns that haven't changed, so
+        # the recipes keep their version: no cached page, stat or index depends on them changing
+        if set(fields) <= set(Recipe.DERIVED_FIELDS):
+            return super().bulk_update(objs, fields, *args, **kwargs)
+
+        previous_stat_rows = None
+        if {'cooking_time', 'ingredients'} & set(fields):
+            for recipe in objs:
+                recipe.set_derived_fields()
+            fields += [field for field in Recipe.DERIVED_FIELDS if field not in fields]
+        if {'name', 'cooking_time', 'ingredients'} & set(fields):
+            previous_stat_rows = list(Recipe.objects.filter(pk__in=[recipe.pk for recipe in objs]).values_list('name', 'cooking_time', 'ingredients'))
+
+        # auto_now only applies to save(), so stamp updated_at here and drop the cached pages
+        now = timezone.now()
+        for recipe in objs:
+            recipe.updated_at = now
+        if 'updated_at' not in fields:
+            fields.append('updated_at')
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        if 'ingredients' in fields:
+            self.relink_ingredients(objs)
+        if previous_stat_rows is not None:
+            update_stats(added=[(recipe.name, recipe.cooking_time, recipe.ingredients) for recipe in objs], removed=previous_stat_rows)
+        recipes_bulk_updated.send(sender=Recipe, recipes=objs, fields=fields)
+        invalidate_recipes([recipe.pk for recipe in objs])
+        return rows
+
 # Define class(table) and inherit from models.Model for basic functionality and attributes
 class Recipe(models.Model):
 
@@ -10,23 +177,76 @@ class Recipe(models.Model):
     name= models.CharField(max_length=120)
     cooking_time= models.FloatField(help_text='minutes')
     ingredients= models.CharField(max_length=400, help_text='Ingredients must be separated by commas.')
-    pic = models.ImageField(upload_to='recipes', default='no_picture.jpg')
+    pic = models.ImageField(upload_to='recipes', default='no_picture.jpg', storage=get_recipe_storage)
+
+    # Set once the resized WebP copies of pic exist (see images.py)
+    has_pic_derivatives = models.BooleanField(default=False, editable=False)
+
+    # Derived from cooking_time and ingredients on save, stored so they can be filtered and grouped in SQL
+    difficulty = models.CharField(max_length=20, choices=DIFFICULTY_CHOICES, db_index=True, editable=False, blank=True)
+    ingredient_count = models.PositiveSmallIntegerField(default=0, db_index=True, editable=False)
+
+    # Normalized ingredients, kept in sync with the ingredients string on every save
+    ingredient_items = models.ManyToManyField(Ingredient, related_name='recipes', blank=True, editable=False)
+
+    # Last change, for conditional GETs and as the version of cached pages (see page_cache.py)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = RecipeQuerySet.as_manager()
+
+    # Composite index for keyset pagination in name order (see pagination.py)
+    class Meta:
+        indexes = [
+            models.Index(fields=['name', 'id'], name='recipe_name_id_idx'),
+        ]
+
+    # Columns computed by set_derived_fields()
+    DERIVED_FIELDS = ('difficulty', 'ingredient_count')
 
     # Calculate recipe difficulty
     def calculate_difficulty(self):
-        ing_list = self.ingredients.split(', ')
-        num_ingredients = len(ing_list)
-        if self.cooking_time < 10:
-            if num_ingredients < 4:
-                difficulty = 'Easy'
-            else:
-                difficulty = 'Medium'
-        else:
-            if num_ingredients < 4:
-                difficulty = 'Intermediate'
-            else:
-                difficulty = 'Hard'
-        return difficulty
+        num_ingredients = len(parse_ingredients(self.ingredients))
+        return get_difficulty(self.cooking_time, num_ingredients)
+
+    # Store the ingredient count and difficulty so queries don't have to recompute them
+    def set_derived_fields(self):
+        self.ingredient_count = len(parse_ingredients(self.ingredients))
+        self.difficulty = get_difficulty(self.cooking_time, self.ingredient_count)
+
+    # Save the recipe, then rebuild its links to the normalized Ingredient rows
+    def save(self, *args, **kwargs):
+        self.set_derived_fields()
+
+        # Make sure partial saves still write the derived columns, and always updated_at (auto_now
+        # is only applied to the fields being saved), so cached pages and other workers' indexes
+        # see the change
+        update_fields = kwargs.get('update_fields')
+        # (an empty update_fields still saves nothing)
+        if update_fields:
+            update_fields = set(update_fields)
+            if {'cooking_time', 'ingredients'} & update_fields:
+                update_fields |= set(self.DERIVED_FIELDS)
+            kwargs['update_fields'] = update_fields | {'updated_at'}
+
+        super().save(*args, **kwargs)
+        if update_fields is None or 'ingredients' in update_fields:
+            self.sync_ingredients()
+
+    # Point ingredient_items at one Ingredient row per name in the ingredients string
+    def sync_ingredients(self):
+        names = parse_ingredients(self.ingredients)
+
+        # Create any ingredients we have not seen before, then fetch all of them in one query
+        Ingredient.objects.bulk_create([Ingredient(name=name) for name in names], ignore_conflicts=True)
+        self.ingredient_items.set(Ingredient.objects.filter(name__in=names))
+
+    # srcset for the card image, empty until the derivatives have been generated
+    @property
+    def pic_srcset(self):
+        if not self.has_pic_derivatives:
+            return ''
+        from .images import get_srcset
+        return get_srcset(self.pic.name)
 
     # Define string representation and the parameter you want to use to refer to the recipe
     def __str__(self):
@@ -34,4 +254,67 @@ class Recipe(models.Model):
 
     # Take primary key as an argument and generate a URL
     def get_absolute_url(self):
-        return reverse ('recipes:detail', kwargs={'pk': self.pk})
\ No newline at end of file
+        return reverse ('recipes:detail', kwargs={'pk': self.pk})
+# One locality-sensitive hashing bucket of a recipe's ingredient set (see similarity.py).
+# Recipes that share a bucket are likely to have similar ingredients
+class SimilarityBucket(models.Model):
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE, related_name='similarity_buckets')
+    bucket = models.BigIntegerField(db_index=True)
+
+    def __str__(self):
+        return f'{self.recipe_id}: {self.bucket}'
+
+# Recipe deleted at deleted_at, so in-process indexes of other workers can drop it as well (see
+# pantry.py); deletions can't be found among the recipes' updated_at like other changes.
+# Rows are kept for DELETED_RECIPE_RETENTION; an index that hasn't read the feed for that long
+# is rebuilt instead
+class DeletedRecipe(models.Model):
+    recipe_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f'{self.recipe_id} at {self.deleted_at}'
+
+DELETED_RECIPE_RETENTION = timedelta(days=7)
+
+# Drop the deletions older than the retention period
+def prune_deleted_recipes():
+    return DeletedRecipe.objects.filter(deleted_at__lt=timezone.now() - DELETED_RECIPE_RETENTION).delete()[0]
+
+# One running total over the whole catalog (see catalog_stats.py): recipes per difficulty level,
+# per cooking time bin, per ingredient and per word, plus catalog totals. Kept up to date on every
+# change, so catalog-wide charts read a few rows instead of every recipe
+class CatalogStat(models.Model):
+    DIFFICULTY = 'difficulty'
+    COOKING_TIME = 'cooking_time'
+    INGREDIENT = 'ingredient'
+    WORD = 'word'
+    TOTAL = 'total'
+    KIND_CHOICES = (
+        (DIFFICULTY, 'Recipes per difficulty level'),
+        (COOKING_TIME, 'Recipes per cooking time bin'),
+        (INGREDIENT, 'Recipes per ingredient'),
+        (WORD, 'Recipes per word of their name and ingredients'),
+        (TOTAL, 'Catalog totals'),
+    )
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # Difficulty level, bin or ingredient name (as long as Ingredient.name)
+    key = models.CharField(max_length=400)
+    count = models.BigIntegerField(default=0)
+    # Last change to count, so in-process indexes can pick up the rows that changed (see fuzzy.py)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'key'], name='catalog_stat_kind_key_unique'),
+        ]
+        indexes = [
+            # Most common first, for "top ingredients"
+            models.Index(fields=['kind', '-count'], name='catalog_stat_kind_count_idx'),
+            # Rows of one kind changed since a given time
+            models.Index(fields=['kind', 'updated_at'], name='catalog_stat_kind_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.key}: {self.count}'
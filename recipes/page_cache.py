@@ -0,0 +1,168 @@
+# Cache of rendered recipe pages for RecipeListView and RecipeDetailView, so a warm read runs
+# no SQL at all.
+#
+# Fragments are keyed by recipe and version (updated_at in microseconds), so a save only makes
+# that recipe's fragments unreachable; nothing has to be found and deleted. Two small pointers
+# tie requests to the current versions:
+#   recipe-version:<pk>   current version of one recipe, dropped when it is saved or deleted
+#   page-cache:catalog    bumped on every change; list pages and "similar recipes" panels
+#                         depend on other recipes too, so they are keyed by it
+# Pointers are dropped again once the transaction commits, so a request that read the old row
+# in between cannot leave a stale pointer behind.
+# The pointers live in the default cache, which every worker shares, so a change made by one
+# worker is seen by all of them on their next request. Fragments never change once stored, so
+# they can live in the 'pages' cache, which is per process unless Redis is configured.
+import hashlib
+import time
+from datetime import datetime, timezone
+from django.core.cache import cache, caches
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from .models import Recipe
+from .pagination import keyset_paginate, PAGE_SIZE
+from .similarity import get_similar_recipes
+
+# Cache alias used for rendered fragments (see CACHES in settings.py)
+PAGE_CACHE_ALIAS = 'pages'
+
+CATALOG_VERSION_KEY = 'page-cache:catalog'
+
+# Fragments are unreachable once their recipe changes, so the timeout only bounds memory
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Fields used by the recipe cards (everything else is left out of the SELECT)
+CARD_FIELDS = ('id', 'name', 'pic', 'has_pic_derivatives', 'updated_at')
+
+
+class ListPage:
+    def __init__(self, cards, next_cursor):
+        self.cards = cards
+        self.next_cursor = next_cursor
+
+
+class DetailPage:
+    def __init__(self, recipe_card, similar_cards):
+        self.recipe_card = recipe_card
+        self.similar_cards = similar_cards
+
+
+def get_page_cache():
+    return caches[PAGE_CACHE_ALIAS]
+
+# A recipe's version: its updated_at in microseconds
+def get_version(recipe):
+    return to_version(recipe.updated_at)
+
+def to_version(updated_at):
+    return round(updated_at.timestamp() * 1_000_000)
+
+# Nanosecond timestamp of the last change to any recipe, created on first use
+def get_catalog_version():
+    return cache.get_or_set(CATALOG_VERSION_KEY, time.time_ns, timeout=None)
+
+# Last change to any recipe, for Last-Modified headers
+def get_catalog_modified():
+    return datetime.fromtimestamp(get_catalog_version() / 1e9, tz=timezone.utc)
+
+# Current version of one recipe, or None if it doesn't exist
+def get_recipe_version(pk):
+    key = f'recipe-version:{pk}'
+    version = cache.get(key)
+    if version is None:
+        updated_at = Recipe.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            return None
+        version = to_version(updated_at)
+        # add() rather than set(), so an invalidation that raced with this read wins
+        cache.add(key, version, timeout=PAGE_CACHE_TIMEOUT)
+    return version
+
+# Move the catalog version on, which also has every worker read the change feeds of its
+# in-process indexes (see catalog_index.py)
+def bump_catalog_version():
+    cache.set(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+
+def forget_recipes(pks):
+    cache.delete_many([f'recipe-version:{pk}' for pk in pks])
+    bump_catalog_version()
+
+# Called when recipes are saved, deleted or updated in bulk
+def invalidate_recipes(pks):
+    pks = list(pks)
+    forget_recipes(pks)
+    transaction.on_commit(lambda: forget_recipes(pks))
+
+
+def card_key(pk, version):
+    return f'recipe-card:{pk}:{version}'
+
+# Card HTML of loaded recipes, {pk: html}, rendering (and storing) only the missing ones
+def get_recipe_cards(recipes):
+    pages = get_page_cache()
+    keys = {recipe.pk: card_key(recipe.pk, get_version(recipe)) for recipe in recipes}
+    cached = pages.get_many(keys.values())
+    cards = {pk: cached[key] for pk, key in keys.items() if key in cached}
+    rendered = {
+        recipe.pk: render_to_string('recipes/recipe_card.html', {'recipe': recipe})
+        for recipe in recipes if recipe.pk not in cards
+    }
+    pages.set_many({keys[pk]: html for pk, html in rendered.items()}, timeout=PAGE_CACHE_TIMEOUT)
+    cards.update(rendered)
+    return cards
+
+# Card HTML for (pk, version) pairs, loading only the recipes whose cards aren't cached
+def get_cards(entries):
+    keys = {pk: card_key(pk, version) for pk, version in entries}
+    cached = get_page_cache().get_many(keys.values())
+    cards = {pk: cached[key] for pk, key in keys.items() if key in cached}
+    missing = [pk for pk in keys if pk not in cards]
+    if missing:
+        cards.update(get_recipe_cards(Recipe.objects.only(*CARD_FIELDS).filter(pk__in=missing)))
+    # Recipes deleted since the entries were stored are left out
+    return [mark_safe(cards[pk]) for pk, version in entries if pk in cards]
+
+# One keyset page of recipe cards (see pagination.py). The page's (pk, version) pairs are
+# cached per catalog version; the cards themselves survive changes to other recipes
+def get_list_page(cursor=None, page_size=PAGE_SIZE):
+    digest = hashlib.sha256((cursor or '').encode('utf-8')).hexdigest()[:32]
+    key = f'recipe-list:{get_catalog_version()}:{page_size}:{digest}'
+    pages = get_page_cache()
+    page = pages.get(key)
+    if page is not None:
+        entries, next_cursor = page
+        return ListPage(get_cards(entries), next_cursor)
+
+    keyset = keyset_paginate(Recipe.objects.only(*CARD_FIELDS), cursor, page_size)
+    cards = get_recipe_cards(keyset.items)
+    pages.set(key, ([(recipe.pk, get_version(recipe)) for recipe in keyset.items], keyset.next_cursor), timeout=PAGE_CACHE_TIMEOUT)
+    return ListPage([mark_safe(cards[recipe.pk]) for recipe in keyset.items], keyset.next_cursor)
+
+# The recipe's own card, cached per recipe version, and its "similar recipes" panel, cached
+# per catalog version. Raises Recipe.DoesNotExist
+def get_detail_page(pk):
+    version = get_recipe_version(pk)
+    if version is None:
+        raise Recipe.DoesNotExist
+    recipe = None
+    pages = get_page_cache()
+
+    detail_key = f'recipe-detail:{pk}:{version}'
+    recipe_card = pages.get(detail_key)
+    if recipe_card is None:
+        recipe = Recipe.objects.get(pk=pk)
+        recipe_card = render_to_string('recipes/recipe_detail_card.html', {'recipe': recipe})
+        pages.set(f'recipe-detail:{pk}:{get_version(recipe)}', recipe_card, timeout=PAGE_CACHE_TIMEOUT)
+
+    similar_key = f'recipe-similar:{pk}:{get_catalog_version()}'
+    similar = pages.get(similar_key)
+    if similar is None:
+        recipe = recipe or Recipe.objects.get(pk=pk)
+        similar_recipes = get_similar_recipes(recipe, fields=CARD_FIELDS)
+        cards = get_recipe_cards(similar_recipes)
+        pages.set(similar_key, [(similar.pk, get_version(similar)) for similar in similar_recipes], timeout=PAGE_CACHE_TIMEOUT)
+        similar_cards = [mark_safe(cards[similar.pk]) for similar in similar_recipes]
+    else:
+        similar_cards = get_cards(similar)
+
+    return DetailPage(mark_safe(recipe_card), similar_cards)
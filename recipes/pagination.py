@@ -0,0 +1,90 @@
+# Keyset (cursor) pagination: each page continues after the last (name, id) of the previous
+# one, so any page is an index seek on (name, id) with no OFFSET scan and no COUNT(*).
+import base64
+import binascii
+import json
+from django.db.models import Q
+
+# Number of recipe cards per page
+PAGE_SIZE = 24
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+# Opaque, URL-safe cursor for the position after a recipe
+def encode_cursor(recipe):
+    position = json.dumps([recipe.name, recipe.pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+# Returns (name, pk), or None if the cursor is missing or malformed
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        name, pk = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError, binascii.Error, UnicodeError):
+        return None
+    if not isinstance(name, str) or not isinstance(pk, int):
+        return None
+    return name, pk
+
+# The queryset ordered by (name, id) after cursor, with one extra row to find out whether
+# there is a next page
+def keyset_queryset(queryset, cursor, page_size):
+    queryset = queryset.order_by('name', 'id')
+    position = decode_cursor(cursor)
+    if position:
+        name, pk = position
+        queryset = queryset.filter(Q(name__gt=name) | Q(name=name, id__gt=pk))
+    return queryset[:page_size + 1]
+
+def keyset_page(items, page_size):
+    next_cursor = encode_cursor(items[page_size - 1]) if len(items) > page_size else None
+    return KeysetPage(items[:page_size], next_cursor)
+
+# One page of the queryset ordered by (name, id), starting after cursor
+def keyset_paginate(queryset, cursor=None, page_size=PAGE_SIZE):
+    return keyset_page(list(keyset_queryset(queryset, cursor, page_size)), page_size)
+
+# Same, for async views
+async def akeyset_paginate(queryset, cursor=None, page_size=PAGE_SIZE):
+    return keyset_page([item async for item in keyset_queryset(queryset, cursor, page_size)], page_size)
+
+# Ids on the page of a ranked result and whether more follow (see ranked_paginate)
+def ranked_page_ids(ordered_ids, cursor, page_size):
+    start = 0
+    position = decode_cursor(cursor)
+    if position and position[1] in ordered_ids:
+        start = ordered_ids.index(position[1]) + 1
+    return ordered_ids[start:start + page_size], start + page_size < len(ordered_ids)
+
+def ranked_page(rows, page_ids, has_next):
+    items = [rows[pk] for pk in page_ids if pk in rows]
+    return KeysetPage(items, encode_cursor(items[-1]) if has_next and items else None)
+
+# One page of a relevance-ranked result: ranked_ids is the (bounded) list of matching ids, best
+# first, and the cursor is the last recipe shown. Only the rows on the page are loaded.
+def ranked_paginate(queryset, ranked_ids, cursor=None, page_size=PAGE_SIZE):
+    # Drop ranked ids removed by the queryset's other filters, keeping the ranking order
+    allowed = set(queryset.filter(id__in=ranked_ids).values_list('id', flat=True))
+    ordered_ids = [pk for pk in ranked_ids if pk in allowed]
+
+    page_ids, has_next = ranked_page_ids(ordered_ids, cursor, page_size)
+    rows = {recipe.pk: recipe for recipe in queryset.filter(id__in=page_ids)}
+    return ranked_page(rows, page_ids, has_next)
+
+# Same, for async views
+async def aranked_paginate(queryset, ranked_ids, cursor=None, page_size=PAGE_SIZE):
+    allowed = {pk async for pk in queryset.filter(id__in=ranked_ids).values_list('id', flat=True)}
+    ordered_ids = [pk for pk in ranked_ids if pk in allowed]
+
+    page_ids, has_next = ranked_page_ids(ordered_ids, cursor, page_size)
+    rows = {recipe.pk: recipe async for recipe in queryset.filter(id__in=page_ids)}
+    return ranked_page(rows, page_ids, has_next)
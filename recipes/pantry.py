@@ -0,0 +1,183 @@
+# "Cook with what I have": which recipes can be made from a pantry, ranked by how few
+# ingredients are missing. Each recipe is a bitset with one bit per vocabulary ingredient,
+# packed eight to a byte in a NumPy matrix. A query ANDs every recipe with the pantry's bits and
+# counts the matches, so the whole catalog is scored in one vectorized pass.
+# The matrix is stored column-major (one row per byte of bits, one column per recipe), so a query
+# only reads the few contiguous rows that hold pantry bits.
+# The index follows other workers' changes through catalog_index.py: recipes by updated_at, and
+# deleted recipes from the DeletedRecipe rows written when they are deleted. Those rows expire,
+# so an index that has fallen further behind than they are kept is rebuilt.
+import threading
+from .catalog_index import CatalogIndex
+from .models import DELETED_RECIPE_RETENTION, DeletedRecipe, Recipe, parse_ingredients
+
+# Room for recipes and ingredient bytes grows by doubling, so the matrix is rarely reallocated
+INITIAL_RECIPES = 1024
+INITIAL_BYTES = 16
+
+
+class PantryIndex:
+
+    def __init__(self):
+        import numpy as np
+
+        # Bit number of each ingredient name
+        self.ingredient_bits = {}
+        # Matrix column of each recipe id; columns of deleted recipes are cleared and reused
+        self.recipe_columns = {}
+        self.free_columns = []
+        self.column_count = 0
+        self.recipe_ids = np.zeros(INITIAL_RECIPES, dtype=np.int64)
+        # Number of ingredients in each recipe, so only the pantry's bits need counting
+        self.totals = np.zeros(INITIAL_RECIPES, dtype=np.uint16)
+        self.matrix = np.zeros((INITIAL_BYTES, INITIAL_RECIPES), dtype=np.uint8)
+        # Set bits in every byte value 0-255
+        self.popcount = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.recipe_columns)
+
+    # Bit numbers for ingredient names, assigning new bits (and widening the matrix) as needed
+    def get_bits(self, ingredients, create=False):
+        bits = []
+        for name in ingredients:
+            bit = self.ingredient_bits.get(name)
+            if bit is None and create:
+                bit = len(self.ingredient_bits)
+                self.ingredient_bits[name] = bit
+            if bit is not None:
+                bits.append(bit)
+        return bits
+
+    # Grow the matrix (doubling) to hold `recipes` recipes and every assigned ingredient bit
+    def ensure_capacity(self, recipes):
+        import numpy as np
+
+        byte_count, capacity = self.matrix.shape
+        needed_bytes = (len(self.ingredient_bits) + 7) // 8
+        if recipes <= capacity and needed_bytes <= byte_count:
+            return
+        if recipes > capacity:
+            capacity = max(recipes, capacity * 2)
+        if needed_bytes > byte_count:
+            byte_count = max(needed_bytes, byte_count * 2)
+
+        matrix = np.zeros((byte_count, capacity), dtype=np.uint8)
+        matrix[:self.matrix.shape[0], :self.matrix.shape[1]] = self.matrix
+        recipe_ids = np.zeros(capacity, dtype=np.int64)
+        recipe_ids[:len(self.recipe_ids)] = self.recipe_ids
+        totals = np.zeros(capacity, dtype=np.uint16)
+        totals[:len(self.totals)] = self.totals
+        self.matrix, self.recipe_ids, self.totals = matrix, recipe_ids, totals
+
+    # Add many recipes at once from (id, ingredient names) pairs, setting all bits in one call
+    def add_recipes(self, recipes):
+        import numpy as np
+
+        with self.lock:
+            columns, bits = [], []
+            for recipe_id, ingredients in recipes:
+                column = self.get_column(recipe_id)
+                recipe_bits = self.get_bits(ingredients, create=True)
+                self.matrix[:, column] = 0
+                self.totals[column] = len(recipe_bits)
+                columns.extend([column] * len(recipe_bits))
+                bits.extend(recipe_bits)
+            self.ensure_capacity(self.column_count)
+
+            columns = np.array(columns, dtype=np.intp)
+            bits = np.array(bits, dtype=np.intp)
+            np.bitwise_or.at(self.matrix, (bits >> 3, columns), (1 << (bits & 7)).astype(np.uint8))
+
+    # Add or replace one recipe
+    def set_recipe(self, recipe_id, ingredients):
+        self.add_recipes([(recipe_id, ingredients)])
+
+    def remove_recipe(self, recipe_id):
+        with self.lock:
+            column = self.recipe_columns.pop(recipe_id, None)
+            if column is None:
+                return
+            self.matrix[:, column] = 0
+            self.totals[column] = 0
+            self.recipe_ids[column] = 0
+            self.free_columns.append(column)
+
+    # Column for a recipe id, allocating one if it is new (call with the lock held)
+    def get_column(self, recipe_id):
+        column = self.recipe_columns.get(recipe_id)
+        if column is not None:
+            return column
+        if self.free_columns:
+            column = self.free_columns.pop()
+        else:
+            column = self.column_count
+            self.column_count += 1
+            self.ensure_capacity(self.column_count)
+        self.recipe_columns[recipe_id] = column
+        self.recipe_ids[column] = recipe_id
+        return column
+
+    # (recipe id, number of missing ingredients) for recipes missing at most max_missing of
+    # their ingredients, fewest missing first, then those using more of the pantry.
+    # max_missing=0 gives the recipes whose ingredients are a subset of the pantry
+    def match(self, pantry, max_missing=0, limit=None):
+        import numpy as np
+
+        with self.lock:
+            bits = np.array(self.get_bits(pantry), dtype=np.intp)
+            mask = np.zeros(self.matrix.shape[0], dtype=np.uint8)
+            np.bitwise_or.at(mask, bits >> 3, (1 << (bits & 7)).astype(np.uint8))
+
+            # Missing = all of a recipe's ingredients minus those in the pantry, so only the
+            # bytes holding pantry bits have to be read
+            count = self.column_count
+            used = np.zeros(count, dtype=np.uint16)
+            for byte in np.flatnonzero(mask):
+                used += self.popcount[self.matrix[byte, :count] & mask[byte]]
+            totals = self.totals[:count].copy()
+            recipe_ids = self.recipe_ids[:count].copy()
+        missing = totals - used
+
+        # Skip free columns (recipe id 0) and recipes with nothing from the pantry at all
+        candidates = np.flatnonzero((recipe_ids > 0) & (missing <= max_missing) & (used > 0))
+        order = np.lexsort((recipe_ids[candidates], -used[candidates].astype(np.int32), missing[candidates]))
+        candidates = candidates[order[:limit]]
+        return [(int(recipe_ids[column]), int(missing[column])) for column in candidates]
+
+
+# Index every recipe from the ingredients column, streamed in chunks
+def build_index():
+    index = PantryIndex()
+    recipes = Recipe.objects.values_list('id', 'ingredients').iterator(chunk_size=2000)
+    index.add_recipes((recipe_id, parse_ingredients(ingredients)) for recipe_id, ingredients in recipes)
+    return index
+
+# Apply the recipes saved and deleted since `since`
+def apply_changes(index, since):
+    recipes = list(Recipe.objects.filter(updated_at__gte=since).values_list('id', 'ingredients', 'updated_at'))
+    deletions = list(DeletedRecipe.objects.filter(deleted_at__gte=since).values_list('recipe_id', 'deleted_at'))
+    if recipes:
+        index.add_recipes((recipe_id, parse_ingredients(ingredients)) for recipe_id, ingredients, updated_at in recipes)
+    for recipe_id, deleted_at in deletions:
+        index.remove_recipe(recipe_id)
+    return max([row[-1] for row in recipes + deletions], default=None)
+
+pantry_index = CatalogIndex(build_index, apply_changes, max_age=DELETED_RECIPE_RETENTION)
+
+
+# This process's index (see catalog_index.py)
+def get_pantry_index():
+    return pantry_index.get()
+
+# Apply recipes saved, bulk created or deleted in this process straight away, if it has built an index
+def update_recipes(recipes):
+    index = pantry_index.index
+    if index is not None:
+        index.add_recipes((recipe.pk, parse_ingredients(recipe.ingredients)) for recipe in recipes if recipe.pk)
+
+def remove_recipe(recipe):
+    index = pantry_index.index
+    if index is not None:
+        index.remove_recipe(recipe.pk)
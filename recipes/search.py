@@ -0,0 +1,58 @@
+# Ranked full-text search over recipe name and ingredients.
+# SQLite uses the FTS5 table recipes_recipe_fts and PostgreSQL a GIN index on a tsvector
+# expression; both are created (and, for SQLite, kept current by triggers) in migration 0008.
+# Other databases return None so callers can fall back to a substring filter.
+import re
+from django.db import connections, router
+from .models import Recipe
+
+# Upper bound on the number of ranked matches returned for one query
+SEARCH_LIMIT = 1000
+
+# Name matches count for more than ingredient matches
+NAME_WEIGHT = 10.0
+INGREDIENTS_WEIGHT = 1.0
+
+# Must match the indexed expression in migration 0008 exactly, or PostgreSQL won't use the index
+POSTGRES_DOCUMENT = "to_tsvector('english', coalesce(name, '') || ' ' || coalesce(ingredients, ''))"
+
+
+# Words in the user's query, lowercased, without FTS syntax characters
+def get_search_terms(text):
+    return re.findall(r'\w+', text.lower())
+
+# Every term must match, as a word prefix ("past" finds "pasta")
+def get_sqlite_query(terms):
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def get_postgres_query(terms):
+    return ' & '.join(f'{term}:*' for term in terms)
+
+# Ids of recipes matching text, best match first; None if the database has no full-text index
+def search_recipe_ids(text, limit=SEARCH_LIMIT):
+    terms = get_search_terms(text)
+    if not terms:
+        return []
+
+    # The database recipes are read from (a replica inside read_from_replica())
+    connection = connections[router.db_for_read(Recipe)]
+    if connection.vendor == 'sqlite':
+        sql = (
+            'SELECT rowid FROM recipes_recipe_fts WHERE recipes_recipe_fts MATCH %s '
+            f'ORDER BY bm25(recipes_recipe_fts, {NAME_WEIGHT}, {INGREDIENTS_WEIGHT}) LIMIT %s'
+        )
+        params = [get_sqlite_query(terms), limit]
+    elif connection.vendor == 'postgresql':
+        sql = (
+            f"SELECT id FROM recipes_recipe WHERE {POSTGRES_DOCUMENT} @@ to_tsquery('english', %s) "
+            f"ORDER BY ts_rank(setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+            f"to_tsvector('english', coalesce(ingredients, '')), to_tsquery('english', %s)) DESC, id LIMIT %s"
+        )
+        query = get_postgres_query(terms)
+        params = [query, query, limit]
+    else:
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,159 @@
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import DeletedRecipe, Recipe, parse_ingredients, prune_deleted_recipes, recipes_bulk_created, recipes_bulk_updated
+from .chart_cache import invalidate_charts
+from .images import generate_derivatives
+from .fuzzy import add_recipe_terms
+from . import pantry
+from .similarity import update_buckets
+from .page_cache import invalidate_recipes
+from .auth import forget_user
+from .catalog_stats import update_stats
+
+
+# Drop cached charts whenever a recipe is added, edited or deleted
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(recipes_bulk_created, sender=Recipe)
+@receiver(recipes_bulk_updated, sender=Recipe)
+def invalidate_recipe_charts(sender, **kwargs):
+    invalidate_charts()
+
+# Remember the ingredients, picture, name and cooking time a recipe had before this save, so
+# post_save receivers can work out what changed
+@receiver(pre_save, sender=Recipe)
+def remember_previous_values(sender, instance, **kwargs):
+    previous = None
+    if instance.pk is not None:
+        previous = Recipe.objects.filter(pk=instance.pk).values_list('ingredients', 'pic', 'name', 'cooking_time').first()
+    previous_ingredients, previous_pic, previous_name, previous_cooking_time = previous or ('', None, None, None)
+    instance._previous_ingredients = parse_ingredients(previous_ingredients)
+    instance._previous_pic = previous_pic
+    # (name, cooking_time, ingredients) as counted in the catalog stats, None for a new recipe
+    instance._previous_stat_row = (previous_name, previous_cooking_time, previous_ingredients) if previous else None
+
+# Make new words from recipe names and ingredients available to the typo-tolerant matcher
+@receiver(post_save, sender=Recipe)
+def update_trigram_index(sender, instance, **kwargs):
+    add_recipe_terms(instance)
+
+@receiver(recipes_bulk_created, sender=Recipe)
+def update_trigram_index_on_bulk_create(sender, recipes, **kwargs):
+    for recipe in recipes:
+        add_recipe_terms(recipe)
+
+@receiver(recipes_bulk_updated, sender=Recipe)
+def update_trigram_index_on_bulk_update(sender, recipes, fields, **kwargs):
+    if {'name', 'ingredients'} & set(fields):
+        for recipe in recipes:
+            add_recipe_terms(recipe)
+
+# Keep the "cook with what I have" bitsets current (recipes from AddRecipeForm, the admin and
+# bulk imports included)
+@receiver(post_save, sender=Recipe)
+def update_pantry_index(sender, instance, **kwargs):
+    pantry.update_recipes([instance])
+
+@receiver(recipes_bulk_created, sender=Recipe)
+def update_pantry_index_on_bulk_create(sender, recipes, **kwargs):
+    pantry.update_recipes(recipes)
+
+@receiver(recipes_bulk_updated, sender=Recipe)
+def update_pantry_index_on_bulk_update(sender, recipes, fields, **kwargs):
+    if 'ingredients' in fields:
+        pantry.update_recipes(recipes)
+
+# Recompute the "similar recipes" buckets when the ingredients change (deletes cascade)
+@receiver(post_save, sender=Recipe)
+def update_similarity_buckets(sender, instance, created, **kwargs):
+    previous = set(getattr(instance, '_previous_ingredients', []))
+    if created or previous != set(parse_ingredients(instance.ingredients)):
+        update_buckets([instance], created=created)
+
+@receiver(recipes_bulk_created, sender=Recipe)
+def update_similarity_buckets_on_bulk_create(sender, recipes, **kwargs):
+    update_buckets(recipes, created=True)
+
+@receiver(recipes_bulk_updated, sender=Recipe)
+def update_similarity_buckets_on_bulk_update(sender, recipes, fields, **kwargs):
+    if 'ingredients' in fields:
+        update_buckets(recipes)
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_pantry_index(sender, instance, **kwargs):
+    pantry.remove_recipe(instance)
+    # Other workers' indexes find the deletion through this row, and the expired rows go, so
+    # the table only ever holds the retention period's deletions
+    DeletedRecipe.objects.create(recipe_id=instance.pk)
+    prune_deleted_recipes()
+
+# Keep the catalog statistics current (see catalog_stats.py)
+@receiver(post_save, sender=Recipe)
+def update_catalog_stats_on_save(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_stat_row', None)
+    update_stats(added=[(instance.name, instance.cooking_time, instance.ingredients)], removed=[previous] if previous else [])
+
+@receiver(post_delete, sender=Recipe)
+def update_catalog_stats_on_delete(sender, instance, **kwargs):
+    update_stats(removed=[(instance.name, instance.cooking_time, instance.ingredients)])
+
+@receiver(recipes_bulk_created, sender=Recipe)
+def update_catalog_stats_on_bulk_create(sender, recipes, **kwargs):
+    update_stats(added=[(recipe.name, recipe.cooking_time, recipe.ingredients) for recipe in recipes])
+
+# Generate the resized WebP card images whenever a recipe gets a new picture (this covers
+# AddRecipeForm, the admin and any other save)
+@receiver(post_save, sender=Recipe)
+def generate_pic_derivatives(sender, instance, **kwargs):
+    pic_changed = instance.pic.name != getattr(instance, '_previous_pic', None)
+    if not pic_changed and instance.has_pic_derivatives:
+        return
+
+    # Derivative names follow the picture name, and content-addressed names never get new
+    # content, so any derivatives that already exist are up to date
+    has_derivatives = generate_derivatives(instance.pic.name, instance.pic.storage)
+    if has_derivatives != instance.has_pic_derivatives:
+        # update() rather than save(), so this doesn't trigger the signals again (the page cache
+        # is invalidated by the last receiver below)
+        instance.updated_at = timezone.now()
+        Recipe.objects.filter(pk=instance.pk).update(has_pic_derivatives=has_derivatives, updated_at=instance.updated_at)
+        instance.has_pic_derivatives = has_derivatives
+
+# Reference counts for content-addressed pictures: the file is deleted once no recipe uses it
+@receiver(post_save, sender=Recipe)
+def count_pic_references(sender, instance, created, **kwargs):
+    previous_pic = getattr(instance, '_previous_pic', None)
+    if instance.pic.name == previous_pic:
+        return
+    instance.pic.storage.acquire(instance.pic.name)
+    if previous_pic:
+        instance.pic.storage.release(previous_pic)
+
+@receiver(post_delete, sender=Recipe)
+def release_pic_reference(sender, instance, **kwargs):
+    instance.pic.storage.release(instance.pic.name)
+
+# Drop the cached list and detail pages of changed recipes (see page_cache.py). Connected last,
+# so it also covers changes made by the receivers above
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe_pages(sender, instance, **kwargs):
+    invalidate_recipes([instance.pk])
+
+@receiver(recipes_bulk_created, sender=Recipe)
+def invalidate_recipe_pages_on_bulk_create(sender, recipes, **kwargs):
+    invalidate_recipes([recipe.pk for recipe in recipes])
+
+# Drop cached users (see auth.py) when they change, are deleted or log out
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def forget_cached_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
+
+@receiver(user_logged_out)
+def forget_cached_user_on_logout(sender, user, **kwargs):
+    if user is not None:
+        forget_user(user.pk)
@@ -0,0 +1,101 @@
+# Content-addressed storage for recipe pictures: every upload is hashed while it is streamed to
+# disk and stored as <upload_to>/<first two hex digits>/<sha256><ext>. Uploading the same picture
+# again reuses the existing file, and since a URL's content never changes it can be cached forever.
+import hashlib
+import os
+import re
+import tempfile
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+# Names written by this storage, e.g. recipes/3f/3f9a...e1.png
+CONTENT_ADDRESSED_NAME = re.compile(r'^(?P<directory>.+/)?(?P<prefix>[0-9a-f]{2})/(?P<digest>[0-9a-f]{64})(?P<ext>\.\w+)?$')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    # Storage name for content with this digest, next to where Django would have put `name`
+    def get_content_name(self, name, digest):
+        directory = os.path.dirname(name)
+        ext = os.path.splitext(name)[1].lower()
+        content_name = f'{digest[:2]}/{digest}{ext}'
+        return f'{directory}/{content_name}' if directory else content_name
+
+    # The final name depends on the content, so the requested name is never changed up front
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        # Hash while copying to a temporary file in MEDIA_ROOT, so the final move is atomic
+        os.makedirs(self.location, exist_ok=True)
+        hasher = hashlib.sha256()
+        descriptor, temp_path = tempfile.mkstemp(dir=self.location, prefix='.upload-')
+        try:
+            with os.fdopen(descriptor, 'wb') as temp_file:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    hasher.update(chunk)
+                    temp_file.write(chunk)
+
+            content_name = self.get_content_name(name, hasher.hexdigest())
+            full_path = self.path(content_name)
+            if os.path.exists(full_path):
+                # Already stored: keep the existing copy
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                os.replace(temp_path, full_path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(full_path, self.file_permissions_mode)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return content_name
+
+    # Record one more recipe using the file `name`
+    def acquire(self, name):
+        from .models import ImageBlob
+
+        match = CONTENT_ADDRESSED_NAME.match(name or '')
+        if not match:
+            return
+        with transaction.atomic():
+            blob, created = ImageBlob.objects.get_or_create(
+                digest=match['digest'], defaults={'name': name, 'ref_count': 1},
+            )
+            if not created:
+                ImageBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+
+    # Record one fewer recipe using `name`; the file (and its derivatives) is deleted at zero
+    def release(self, name):
+        from .models import ImageBlob
+        from .images import delete_derivatives
+
+        match = CONTENT_ADDRESSED_NAME.match(name or '')
+        if not match:
+            return
+        with transaction.atomic():
+            blob = ImageBlob.objects.select_for_update().filter(digest=match['digest']).first()
+            if blob is None:
+                return
+            if blob.ref_count > 1:
+                ImageBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+                return
+            blob.delete()
+
+        # Only remove the files once the row is gone for good
+        def delete_files():
+            self.delete(name)
+            delete_derivatives(name)
+        transaction.on_commit(delete_files)
+
+
+# Storage for Recipe.pic. No location is passed, so it follows MEDIA_ROOT/MEDIA_URL (including
+# override_settings in tests)
+recipe_storage = ContentAddressedStorage()
+
+def get_recipe_storage():
+    return recipe_storage
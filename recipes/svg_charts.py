@@ -0,0 +1,139 @@
+# Lightweight SVG versions of the search charts (#1 bar, #2 pie, #3 line, #4 histogram).
+# They are built as plain strings from the plotted columns, so drawing one takes well under a
+# millisecond, needs no matplotlib import, and stays sharp at any size.
+import math
+from collections import Counter
+from html import escape
+
+# Canvas size in pixels (the same 6x3 inch, 100 dpi area as the matplotlib charts)
+WIDTH = 600
+HEIGHT = 300
+
+# Plot area margins: left, right, top, bottom
+MARGINS = (60, 20, 30, 70)
+
+# Most category labels drawn on the x-axis; longer series only label every few points
+MAX_LABELS = 25
+
+# matplotlib's default color cycle, so both engines look alike
+COLORS = ('#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf')
+
+
+# Format a number without trailing zeros (5.0 -> '5', 2.5 -> '2.5')
+def fmt(value):
+    return f'{value:.2f}'.rstrip('0').rstrip('.')
+
+# Evenly spaced, round tick values from 0 up to at least max_value
+def get_ticks(max_value, count=5):
+    if max_value <= 0:
+        return [0, 1]
+    raw_step = max_value / count
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    step = next(multiple * magnitude for multiple in (1, 2, 5, 10) if multiple * magnitude >= raw_step)
+    return [step * i for i in range(math.ceil(max_value / step) + 1)]
+
+def text(x, y, content, size=12, anchor='middle', extra=''):
+    return f'<text x="{fmt(x)}" y="{fmt(y)}" font-size="{size}" text-anchor="{anchor}"{extra}>{escape(str(content))}</text>'
+
+def svg_document(body, title):
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {WIDTH} {HEIGHT}" width="{WIDTH}" height="{HEIGHT}" '
+        f'font-family="sans-serif"><rect width="100%" height="100%" fill="#fff"/>'
+        + text(WIDTH / 2, 20, title, size=14)
+        + ''.join(body)
+        + '</svg>'
+    )
+
+# Axes, y ticks and rotated category labels shared by the bar and line charts.
+# Returns the SVG parts plus functions that map a category index / value to pixel positions.
+def get_axes(names, values, x_label='Recipe Name', y_label='Cooking Time (minutes)'):
+    left, right, top, bottom = MARGINS
+    plot_width = WIDTH - left - right
+    plot_height = HEIGHT - top - bottom
+    ticks = get_ticks(max(values, default=0))
+    slot = plot_width / max(len(names), 1)
+
+    x_for = lambda index: left + slot * (index + 0.5)
+    y_for = lambda value: top + plot_height - value / ticks[-1] * plot_height
+
+    parts = [f'<g stroke="#000" stroke-width="1"><line x1="{left}" y1="{top}" x2="{left}" y2="{top + plot_height}"/>'
+             f'<line x1="{left}" y1="{top + plot_height}" x2="{left + plot_width}" y2="{top + plot_height}"/></g>']
+    for tick in ticks:
+        parts.append(text(left - 6, y_for(tick) + 4, fmt(tick), size=10, anchor='end'))
+    step = math.ceil(len(names) / MAX_LABELS) or 1
+    for index in range(0, len(names), step):
+        name = names[index]
+        x = x_for(index)
+        y = top + plot_height + 12
+        parts.append(text(x, y, name, size=10, anchor='end', extra=f' transform="rotate(-45 {fmt(x)} {fmt(y)})"'))
+
+    parts.append(text(left + plot_width / 2, HEIGHT - 4, x_label))
+    parts.append(text(14, top + plot_height / 2, y_label, extra=f' transform="rotate(-90 14 {fmt(top + plot_height / 2)})"'))
+    return parts, x_for, y_for, slot
+
+def bar_chart(names, values, title='Cooking Time by Recipe', **labels):
+    parts, x_for, y_for, slot = get_axes(names, values, **labels)
+    bar_width = slot * 0.8
+    base = y_for(0)
+    for index, value in enumerate(values):
+        y = y_for(value)
+        parts.append(f'<rect x="{fmt(x_for(index) - bar_width / 2)}" y="{fmt(y)}" width="{fmt(bar_width)}" '
+                     f'height="{fmt(base - y)}" fill="{COLORS[0]}"/>')
+    return svg_document(parts, title)
+
+def line_chart(names, values):
+    parts, x_for, y_for, slot = get_axes(names, values)
+    points = ' '.join(f'{fmt(x_for(index))},{fmt(y_for(value))}' for index, value in enumerate(values))
+    parts.append(f'<polyline points="{points}" fill="none" stroke="{COLORS[0]}" stroke-width="1.5"/>')
+    return svg_document(parts, 'Cooking Time by Recipe')
+
+def pie_chart(difficulty_counts):
+    total = sum(difficulty_counts.values())
+    cx, cy, radius = WIDTH / 2, HEIGHT / 2 + 10, 100
+    parts = []
+
+    # Start at 12 o'clock and go counter-clockwise, like matplotlib's startangle=90
+    angle = math.pi / 2
+    for index, (level, count) in enumerate(difficulty_counts.items()):
+        share = count / total
+        color = COLORS[index % len(COLORS)]
+        end = angle + share * 2 * math.pi
+
+        if share >= 1:
+            parts.append(f'<circle cx="{fmt(cx)}" cy="{fmt(cy)}" r="{radius}" fill="{color}"/>')
+        elif share > 0:
+            x1, y1 = cx + radius * math.cos(angle), cy - radius * math.sin(angle)
+            x2, y2 = cx + radius * math.cos(end), cy - radius * math.sin(end)
+            large_arc = 1 if share > 0.5 else 0
+            parts.append(f'<path d="M{fmt(cx)},{fmt(cy)} L{fmt(x1)},{fmt(y1)} A{radius},{radius} 0 {large_arc} 0 '
+                         f'{fmt(x2)},{fmt(y2)} Z" fill="{color}"/>')
+
+        # Percentage inside the slice and the level name outside it
+        middle = (angle + end) / 2
+        parts.append(text(cx + radius * 0.6 * math.cos(middle), cy - radius * 0.6 * math.sin(middle) + 4, f'{share * 100:.1f}%', size=11))
+        label_x = cx + radius * 1.15 * math.cos(middle)
+        anchor = 'start' if math.cos(middle) >= 0 else 'end'
+        parts.append(text(label_x, cy - radius * 1.15 * math.sin(middle) + 4, f'{level}: {share * 100:.1f}%', anchor=anchor))
+        angle = end
+    return svg_document(parts, 'Recipe Difficulty Breakdown')
+
+#chart_type: user input o type of chart,
+#data: pandas dataframe (or dict of column lists)
+#difficulty_counts (optional): dict of difficulty level -> number of recipes, for the pie chart
+#returns the chart as UTF-8 encoded SVG
+def get_svg_chart(chart_type, data, **kwargs):
+    if chart_type == '#1':
+        svg = bar_chart([str(name) for name in data['name']], [float(value) for value in data['cooking_time']])
+    elif chart_type == '#2':
+        difficulty_counts = kwargs.get('difficulty_counts')
+        if difficulty_counts is None:
+            difficulty_counts = Counter(data['difficulty'])
+        svg = pie_chart(difficulty_counts)
+    elif chart_type == '#3':
+        svg = line_chart([str(name) for name in data['name']], [float(value) for value in data['cooking_time']])
+    elif chart_type == '#4':
+        svg = bar_chart([str(label) for label in data['bin']], [float(value) for value in data['recipes']],
+                        title='Recipes by Cooking Time', x_label='Cooking Time', y_label='Recipes')
+    else:
+        raise ValueError(f'Unknown chart type: {chart_type}')
+    return svg.encode('utf-8')
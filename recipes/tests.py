@@ -1,8 +1,55 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from xml.etree import ElementTree
+from PIL import Image
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.db import connection, router
+from django.utils import timezone
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.template.loader import render_to_string
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.urls import reverse
 from django.contrib.auth.models import User
-from .models import Recipe    #to access Recipe model
-from .forms import AddRecipeForm
+from django.contrib.sessions.models import Session
+from .models import Recipe, Ingredient, ImageBlob, SimilarityBucket, CatalogStat, DeletedRecipe, DELETED_RECIPE_RETENTION    #to access Recipe model
+from .forms import AddRecipeForm, RecipeSearchForm
+from .chart_cache import get_cached_chart, get_chart_digest, store_chart_spec
+from . import chart_pool
+from .svg_charts import get_svg_chart
+from .chart_data import bin_values, downsample_min_max, get_chart_data, top_n
+from .vocabulary import get_vocabulary, vocabulary_index
+from .pagination import keyset_paginate
+from .images import DERIVATIVE_WIDTHS, get_derivative_name
+from .media import IMMUTABLE_CACHE_CONTROL
+from .page_cache import bump_catalog_version, forget_recipes
+from .views import RecipeListView, RecipeDetailView, RecipeSearchView, chart_image_view
+from .search import search_recipe_ids
+from . import fuzzy
+from .fuzzy import TrigramIndex
+from . import pantry
+from .pantry import PantryIndex
+from .similarity import get_buckets, get_signature, get_similar_recipes
+from .database import PRIMARY_PIN_COOKIE, read_from_replica
+from .auth import get_user_key
+from .catalog_stats import get_cooking_time_histogram, get_difficulty_counts, get_summary, get_top_ingredients, rebuild_stats, update_stats
+from . import metrics
+
+# Names on the recipe cards of a list or detail page, in order
+def get_card_names(response):
+    return re.findall(r'<h2><a href = "[^"]*">([^<]*)</a></h2>', response.content.decode())
 
 # Create your tests here.
 class RecipeModelTest(TestCase):
@@ -70,6 +117,12 @@ class RecipeModelTest(TestCase):
         # get_absolute_url() should take you to the detail page of recipe #1 and load the URL recipes/list/1
         self.assertEqual(recipe.get_absolute_url(), '/recipes/1')
 
+    # Test that one ingredient as long as the whole ingredients field is a valid Ingredient
+    def test_long_single_ingredient_fits(self):
+        name = 'x' * Recipe._meta.get_field('ingredients').max_length
+        recipe = Recipe.objects.create(name='Long', cooking_time=5, ingredients=name)
+        recipe.ingredient_items.get().full_clean()
+
 class RecipeFormTests(TestCase):
 
     def setUp(self):
@@ -123,6 +176,1203 @@ class RecipeFormTests(TestCase):
         self.assertEqual(response.status_code, 200)  # Page should still load
         self.assertIsNone(response.context.get('chart'))  # No chart should be generated with invalid data
 
+class RecipeSearchFormTests(TestCase):
+
+    def setUp(self):
+        # The vocabulary lives in this process, which isn't rolled back between tests
+        cache.clear()
+        vocabulary_index.reset()
+
+    def test_ingredient_choices_resolved_per_form(self):
+        """Test that ingredients added after import show up in a new search form"""
+        Recipe.objects.create(name="Toast", cooking_time=3, ingredients="Bread, Butter")
+        form = RecipeSearchForm()
+        self.assertEqual(list(form.fields['Ingredients'].choices), [('bread', 'bread'), ('butter', 'butter')])
+
+    def test_vocabulary_follows_catalog_stats(self):
+        """Test that saves and deletes are patched into the counts, which are never read in full again"""
+        toast = Recipe.objects.create(name="Toast", cooking_time=3, ingredients="Bread, Butter")
+        self.assertEqual(get_vocabulary(), {'bread': 1, 'butter': 1})
+
+        with mock.patch('recipes.vocabulary.build_vocabulary') as build_vocabulary:
+            Recipe.objects.create(name="Jam Toast", cooking_time=3, ingredients="Bread, Jam")
+            self.assertEqual(get_vocabulary(), {'bread': 2, 'butter': 1, 'jam': 1})
+            toast.ingredients = "Bread, Margarine"
+            toast.save()
+            self.assertEqual(get_vocabulary(), {'bread': 2, 'margarine': 1, 'jam': 1})
+            toast.delete()
+            self.assertEqual(get_vocabulary(), {'bread': 1, 'jam': 1})
+            self.assertEqual(RecipeSearchForm().fields['Ingredients'].choices, [('bread', 'bread'), ('jam', 'jam')])
+        build_vocabulary.assert_not_called()
+
+    def test_other_workers_see_new_version(self):
+        """Test that changes made by another worker are read from the stats once the catalog version moves on"""
+        Recipe.objects.create(name="Toast", cooking_time=3, ingredients="Bread, Butter")
+        get_vocabulary()
+
+        # Simulate another worker adding an ingredient: it updates the stats and bumps the version
+        update_stats(added=[('Honey', 5, 'Honey')])
+        bump_catalog_version()
+        self.assertIn(('honey', 'honey'), RecipeSearchForm().fields['Ingredients'].choices)
+
+class IngredientSearchTests(TestCase):
+
+    def setUp(self):
+        Recipe.objects.create(name="Pretzels", cooking_time=20, ingredients="Flour, Salt, Water")
+        Recipe.objects.create(name="Shortbread", cooking_time=25, ingredients="Flour, Sugar, Unsalted Butter")
+
+    def test_ingredients_synced_on_save(self):
+        """Test that saving a recipe links it to normalized Ingredient rows"""
+        recipe = Recipe.objects.get(name="Pretzels")
+        self.assertEqual(sorted(recipe.ingredient_items.values_list('name', flat=True)), ['flour', 'salt', 'water'])
+
+        # Editing the ingredients string re-links the recipe
+        recipe.ingredients = "Flour, Water, Yeast"
+        recipe.save()
+        self.assertEqual(sorted(recipe.ingredient_items.values_list('name', flat=True)), ['flour', 'water', 'yeast'])
+        self.assertEqual(Ingredient.objects.filter(name='flour').count(), 1)
+
+    def test_bulk_update_relinks_ingredients(self):
+        """Test that bulk_update() re-links ingredients and updates the vocabulary, indexes and buckets"""
+        cache.clear()
+        fuzzy.trigram_index.reset()
+        pantry.pantry_index.reset()
+        vocabulary_index.reset()
+        pretzels = Recipe.objects.get(name="Pretzels")
+        index, words = pantry.get_pantry_index(), fuzzy.get_trigram_index()
+        buckets = set(pretzels.similarity_buckets.values_list('bucket', flat=True))
+
+        pretzels.ingredients = "Flour, Water, Yeast"
+        Recipe.objects.bulk_update([pretzels], ['ingredients'])
+        self.assertEqual([recipe.name for recipe in Recipe.objects.with_all_ingredients(['Yeast'])], ['Pretzels'])
+        self.assertFalse(Recipe.objects.with_all_ingredients(['Salt']).exists())
+        self.assertNotIn('salt', get_vocabulary())
+        self.assertEqual(index.match(['flour', 'water', 'yeast']), [(pretzels.pk, 0)])
+        self.assertIn('yeast', words)
+        self.assertNotEqual(set(pretzels.similarity_buckets.values_list('bucket', flat=True)), buckets)
+
+    def test_ingredient_search_has_no_substring_matches(self):
+        """Test that searching for salt does not match unsalted butter"""
+        recipes = Recipe.objects.with_all_ingredients(['Salt'])
+        self.assertEqual([recipe.name for recipe in recipes], ['Pretzels'])
+
+    def test_ingredient_search_matches_all_selected(self):
+        """Test that selecting several ingredients only returns recipes containing all of them"""
+        recipes = Recipe.objects.with_all_ingredients(['Flour', 'Sugar'])
+        self.assertEqual([recipe.name for recipe in recipes], ['Shortbread'])
+
+class DifficultyColumnTests(TestCase):
+
+    def setUp(self):
+        Recipe.objects.create(name="Tea", cooking_time=5, ingredients="Tea Leaves, Water")
+        Recipe.objects.create(name="Stew", cooking_time=90, ingredients="Beef, Carrot, Potato, Onion")
+
+    def test_difficulty_stored_on_save(self):
+        """Test that difficulty and ingredient_count are stored when a recipe is saved"""
+        recipe = Recipe.objects.get(name="Stew")
+        self.assertEqual(recipe.ingredient_count, 4)
+        self.assertEqual(recipe.difficulty, 'Hard')
+
+        recipe.cooking_time = 5
+        recipe.save(update_fields=['cooking_time'])
+        self.assertEqual(Recipe.objects.get(name="Stew").difficulty, 'Medium')
+
+    def test_bulk_create_sets_difficulty(self):
+        """Test that bulk_create fills in the derived columns and ingredient links"""
+        Recipe.objects.bulk_create([Recipe(name="Toast", cooking_time=3, ingredients="Bread, Butter")])
+        recipe = Recipe.objects.get(name="Toast")
+        self.assertEqual(recipe.difficulty, 'Easy')
+        self.assertEqual(sorted(recipe.ingredient_items.values_list('name', flat=True)), ['bread', 'butter'])
+
+    def test_difficulty_counts(self):
+        """Test that difficulty counts are grouped in the database"""
+        self.assertEqual(Recipe.objects.difficulty_counts(), {'Easy': 1, 'Hard': 1})
+        self.assertEqual(Recipe.objects.with_all_ingredients(['beef']).difficulty_counts(), {'Hard': 1})
+
+    def test_backfill_command(self):
+        """Test that the backfill command recomputes stale columns"""
+        Recipe.objects.filter(name="Tea").update(difficulty='', ingredient_count=0)
+        updated_at = Recipe.objects.get(name="Tea").updated_at
+        call_command('backfill_difficulty', batch_size=1, stdout=StringIO())
+        recipe = Recipe.objects.get(name="Tea")
+        self.assertEqual((recipe.difficulty, recipe.ingredient_count), ('Easy', 2))
+        # Only derived columns changed, so the recipe keeps its version (and its cached pages)
+        self.assertEqual(recipe.updated_at, updated_at)
+
+# In-memory caches so chart tests don't share state with other runs
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'pages': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'page-tests'},
+    'charts': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'chart-tests'},
+}
+
+@override_settings(CACHES=TEST_CACHES)
+class ChartCacheTests(TestCase):
+
+    def setUp(self):
+        self.data = {'name': ['Tea', 'Stew'], 'cooking_time': [5.0, 90.0], 'difficulty': ['Easy', 'Hard']}
+
+    def test_cache_hit_skips_rendering(self):
+        """Test that the same chart and data are only rendered once"""
+        with mock.patch('recipes.chart_cache.render_chart', return_value=b'chart') as render_chart:
+            self.assertEqual(get_cached_chart('#1', self.data), b'chart')
+            self.assertEqual(get_cached_chart('#1', dict(self.data)), b'chart')
+        self.assertEqual(render_chart.call_count, 1)
+
+    def test_digest_depends_on_chart_type_and_data(self):
+        """Test that the cache key changes with the chart type and the plotted data"""
+        digest = get_chart_digest('#1', self.data)
+        self.assertNotEqual(digest, get_chart_digest('#3', self.data))
+        self.assertNotEqual(digest, get_chart_digest('#1', {**self.data, 'cooking_time': [5.0, 91.0]}))
+
+    def test_recipe_change_invalidates_charts(self):
+        """Test that saving a recipe forces charts to be rendered again"""
+        with mock.patch('recipes.chart_cache.render_chart', return_value=b'chart') as render_chart:
+            get_cached_chart('#2', self.data)
+            Recipe.objects.create(name="Toast", cooking_time=3, ingredients="Bread, Butter")
+            get_cached_chart('#2', self.data)
+        self.assertEqual(render_chart.call_count, 2)
+
+@override_settings(CACHES=TEST_CACHES)
+class ChartViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        Recipe.objects.create(name="Pasta", cooking_time=30, ingredients="Tomato, Pasta")
+        self.client.login(username='testuser', password='testpass')
+
+    @override_settings(CHART_ENGINE='matplotlib')
+    def test_search_links_to_chart_image(self):
+        """Test that the search page references the chart by URL instead of inlining it"""
+        response = self.client.post(reverse('recipes:recipe_search'), {'Recipe_Name': 'Pasta', 'chart_type': '#1'})
+        self.assertTrue(response.context['chart'].startswith('/charts/'))
+        self.assertNotContains(response, 'data:image/png;base64')
+
+        # The chart URL serves a cacheable PNG
+        image = self.client.get(response.context['chart'])
+        self.assertEqual(image.status_code, 200)
+        self.assertEqual(image['Content-Type'], 'image/png')
+        self.assertTrue(image.content.startswith(b'\x89PNG'))
+        self.assertIn('immutable', image['Cache-Control'])
+
+        # A browser revalidating with the ETag gets a 304 without the chart being rendered again
+        with mock.patch('recipes.views.get_chart_image') as get_chart_image:
+            cached = self.client.get(response.context['chart'], HTTP_IF_NONE_MATCH=image['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        get_chart_image.assert_not_called()
+
+    def test_unknown_chart_returns_404(self):
+        """Test that an expired or unknown chart digest returns a 404"""
+        response = self.client.get(reverse('recipes:chart', kwargs={'digest': '0' * 64, 'image_format': 'svg'}))
+        self.assertEqual(response.status_code, 404)
+
+@override_settings(CHART_RENDER_WORKERS=1, CHART_RENDER_QUEUE_SIZE=1)
+class ChartPoolTests(TestCase):
+
+    def setUp(self):
+        chart_pool.shutdown_pool()
+        self.addCleanup(chart_pool.shutdown_pool)
+        self.data = {'name': ['Tea', 'Stew'], 'cooking_time': [5.0, 90.0], 'difficulty': ['Easy', 'Hard']}
+
+    def test_renders_in_worker_process(self):
+        """Test that charts rendered by the pool come back as PNG bytes"""
+        chart = chart_pool.render_chart('#2', self.data, difficulty_counts={'Easy': 1, 'Hard': 1})
+        self.assertTrue(chart.startswith(b'\x89PNG'))
+
+    def test_get_chart_leaves_no_pyplot_figures(self):
+        """Test that rendering a chart doesn't register figures with pyplot"""
+        import matplotlib.pyplot as plt
+        from .utils import get_chart
+        open_figures = len(plt.get_fignums())
+        for chart_type in ('#1', '#2', '#3'):
+            get_chart(chart_type, self.data)
+        self.assertEqual(len(plt.get_fignums()), open_figures)
+
+    @override_settings(CHART_RENDER_MAX_RSS_MB=1)
+    def test_renderer_recycled_above_memory_limit(self):
+        """Test that the renderer processes are replaced once they cross the RSS limit"""
+        pool = chart_pool.get_pool()
+        chart_pool.render_chart('#1', self.data)
+        self.assertIsNot(chart_pool.get_pool(), pool)
+
+    def test_full_queue_is_refused(self):
+        """Test that new jobs are refused while the queue is full"""
+        chart_pool.get_pool()
+        chart_pool._slots.acquire()  # Occupy the only slot
+        with self.assertRaises(chart_pool.ChartQueueFull):
+            chart_pool.render_chart('#1', self.data)
+        chart_pool._slots.release()
+
+    @override_settings(CACHES=TEST_CACHES)
+    def test_busy_renderer_returns_503(self):
+        """Test that the chart view asks the browser to retry when the renderer is busy"""
+        User.objects.create_user(username='testuser', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+        digest = store_chart_spec('#1', self.data)
+        with mock.patch('recipes.chart_cache.render_chart', side_effect=chart_pool.ChartQueueFull('busy')):
+            response = self.client.get(reverse('recipes:chart', kwargs={'digest': digest, 'image_format': 'png'}))
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+
+class SvgChartTests(TestCase):
+
+    def setUp(self):
+        self.data = {'name': ['Tea', 'Stew & Dumplings'], 'cooking_time': [5.0, 90.0], 'difficulty': ['Easy', 'Hard']}
+
+    def test_svg_charts_are_valid_xml(self):
+        """Test that each chart type produces a well-formed SVG document"""
+        for chart_type in ('#1', '#2', '#3'):
+            root = ElementTree.fromstring(get_svg_chart(chart_type, self.data))
+            self.assertEqual(root.tag, '{http://www.w3.org/2000/svg}svg')
+
+    def test_svg_chart_content(self):
+        """Test that the charts contain one bar per recipe and one slice per difficulty"""
+        bar = get_svg_chart('#1', self.data).decode()
+        self.assertEqual(bar.count('<rect x='), 2)
+        self.assertIn('Stew &amp; Dumplings', bar)
+        pie = get_svg_chart('#2', self.data, difficulty_counts={'Easy': 3, 'Hard': 1}).decode()
+        self.assertEqual(pie.count('<path'), 2)
+        self.assertIn('Easy: 75.0%', pie)
+
+    @override_settings(CACHES=TEST_CACHES, CHART_ENGINE='svg')
+    def test_search_serves_svg_chart(self):
+        """Test that the search page links to an SVG chart when the SVG engine is selected"""
+        User.objects.create_user(username='testuser', password='testpass')
+        Recipe.objects.create(name="Pasta", cooking_time=30, ingredients="Tomato, Pasta")
+        self.client.login(username='testuser', password='testpass')
+        response = self.client.post(reverse('recipes:recipe_search'), {'Recipe_Name': 'Pasta', 'chart_type': '#3'})
+        self.assertTrue(response.context['chart'].endswith('.svg'))
+        image = self.client.get(response.context['chart'])
+        self.assertEqual(image['Content-Type'], 'image/svg+xml')
+
+class ChartDataTests(TestCase):
+
+    def setUp(self):
+        import numpy as np
+        self.names = np.array([f'Recipe {number:04}' for number in range(1000)], dtype=object)
+        self.cooking_times = np.array([(number * 37) % 500 + 1.0 for number in range(1000)])
+
+    def test_top_n_keeps_slowest_and_averages_the_rest(self):
+        """Test that the bar chart keeps the slowest recipes plus one "Other" bar"""
+        names, values = top_n(self.names, self.cooking_times, 5)
+        self.assertEqual(values[:4], [500.0, 500.0, 499.0, 499.0])
+        self.assertEqual(names[4], 'Other (996 recipes, average)')
+        self.assertAlmostEqual(values[4], (self.cooking_times.sum() - 1998) / 996)
+        self.assertEqual(top_n(self.names[:3], self.cooking_times[:3], 5)[1], [1.0, 38.0, 75.0])
+
+    def test_bin_values(self):
+        """Test that cooking times are counted per bin, the last bin open-ended"""
+        import numpy as np
+        labels, counts = bin_values(np.array([0.5, 9.9, 10.0, 45.0, 600.0]))
+        self.assertEqual(labels[0], '0-10 min')
+        self.assertEqual(dict(zip(labels, counts)), {**dict.fromkeys(labels, 0), '0-10 min': 2, '10-20 min': 1, '45-60 min': 1, '240+ min': 1})
+
+    def test_downsample_keeps_extremes_in_order(self):
+        """Test that downsampling bounds the points and keeps every stretch's minimum and maximum"""
+        names, values = downsample_min_max(self.names, self.cooking_times, 100)
+        self.assertLessEqual(len(values), 100)
+        self.assertEqual(names, sorted(names))
+        self.assertEqual((min(values), max(values)), (1.0, 500.0))
+        first_stretch = self.cooking_times[:20]
+        self.assertIn(first_stretch.max(), values[:2])
+        self.assertIn(first_stretch.min(), values[:2])
+
+    def test_charts_drawn_from_aggregated_data(self):
+        """Test that the bar chart has a bounded number of bars and the histogram draws in both engines"""
+        from .utils import get_chart
+        rows = list(zip(self.names, self.cooking_times))
+        bar = get_svg_chart('#1', get_chart_data('#1', rows)).decode()
+        self.assertEqual(bar.count('<rect x='), 25)
+        histogram = get_chart_data('#4', rows)
+        self.assertEqual(sum(histogram['recipes']), 1000)
+        ElementTree.fromstring(get_svg_chart('#4', histogram))
+        self.assertTrue(get_chart('#4', histogram).startswith(b'\x89PNG'))
+
+    @override_settings(CACHES=TEST_CACHES, CHART_ENGINE='svg')
+    def test_search_chart_over_many_recipes(self):
+        """Test that a search matching many recipes draws a line chart with a bounded number of points"""
+        User.objects.create_user(username='testuser', password='testpass')
+        Recipe.objects.bulk_create([Recipe(name=f"Pasta {number}", cooking_time=number % 90 + 1, ingredients="Pasta, Water") for number in range(400)])
+        self.client.login(username='testuser', password='testpass')
+        response = self.client.post(reverse('recipes:recipe_search'), {'Ingredients': ['pasta'], 'chart_type': '#3'})
+        points = re.search(r'points="([^"]*)"', self.client.get(response.context['chart']).content.decode())[1].split()
+        self.assertLessEqual(len(points), 200)
+
+class ImportTimeTests(SimpleTestCase):
+
+    # Upper bound for importing the project's own modules at worker boot, in microseconds
+    IMPORT_TIME_BUDGET_US = 300000
+
+    # Heavy libraries that must only be loaded when a search or chart actually needs them
+    LAZY_MODULES = ('pandas', 'matplotlib', 'numpy')
+
+    def get_import_times(self):
+        """Import the URLconf in a fresh interpreter with -X importtime and parse the report"""
+        code = 'import django; django.setup(); import recipe_project.urls'
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'recipe_project.settings'}
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        )
+        times = []
+        for line in result.stderr.splitlines():
+            if line.startswith('import time:') and '|' in line and 'cumulative' not in line:
+                self_us, cumulative_us, module = line[len('import time:'):].split('|')
+                times.append((module.rstrip(), int(cumulative_us)))
+        return times
+
+    def test_worker_boot_skips_heavy_imports(self):
+        """Test that loading the URLconf imports neither pandas nor matplotlib and stays within budget"""
+        times = self.get_import_times()
+        modules = {module.strip() for module, _ in times}
+        for lazy_module in self.LAZY_MODULES:
+            self.assertNotIn(lazy_module, modules)
+
+        # Only count top-level project imports (nested ones are already in their parent's total)
+        project_us = sum(us for module, us in times if module.startswith('recipe'))
+        self.assertLess(project_us, self.IMPORT_TIME_BUDGET_US)
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        for name in ['Cake', 'Apple Pie', 'Bread', 'Apple Pie', 'Dumplings']:
+            Recipe.objects.create(name=name, cooking_time=30, ingredients="Flour, Water")
+
+    def test_pages_follow_name_and_id(self):
+        """Test that walking the cursors visits every recipe once, in (name, id) order"""
+        seen = []
+        cursor = None
+        while True:
+            page = keyset_paginate(Recipe.objects.all(), cursor, page_size=2)
+            seen += [(recipe.name, recipe.pk) for recipe in page.items]
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, list(Recipe.objects.order_by('name', 'id').values_list('name', 'id')))
+
+    def test_invalid_cursor_starts_from_first_page(self):
+        """Test that a garbled cursor is ignored rather than raising an error"""
+        page = keyset_paginate(Recipe.objects.all(), 'not-a-cursor', page_size=2)
+        self.assertEqual(page.items[0].name, 'Apple Pie')
+
+    @mock.patch.object(RecipeListView, 'page_size', 3)
+    def test_list_view_is_paginated(self):
+        """Test that the list view shows one page with a link to the next one"""
+        self.client.login(username='testuser', password='testpass')
+        response = self.client.get(reverse('recipes:list'))
+        self.assertEqual(get_card_names(response), ['Apple Pie', 'Apple Pie', 'Bread'])
+        self.assertContains(response, 'Next page')
+
+        response = self.client.get(reverse('recipes:list'), {'after': response.context['next_cursor']})
+        self.assertEqual(get_card_names(response), ['Cake', 'Dumplings'])
+        self.assertIsNone(response.context['next_cursor'])
+
+    @mock.patch.object(RecipeSearchView, 'page_size', 2)
+    def test_search_results_are_paginated(self):
+        """Test that search results continue on the next page from the posted cursor"""
+        self.client.login(username='testuser', password='testpass')
+        response = self.client.post(reverse('recipes:recipe_search'), {'Difficulty': 'Intermediate'})
+        self.assertEqual([recipe.name for recipe in response.context['recipes']], ['Apple Pie', 'Apple Pie'])
+
+        response = self.client.post(reverse('recipes:recipe_search'), {'Difficulty': 'Intermediate', 'after': response.context['next_cursor']})
+        self.assertEqual([recipe.name for recipe in response.context['recipes']], ['Bread', 'Cake'])
+
+# A small PNG upload for picture tests
+def make_png_upload(name='dish.png', size=(800, 400), color=(200, 80, 40)):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+class ImageDerivativeTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.settings_override = override_settings(MEDIA_ROOT=media_root)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.media_root = media_root
+
+    def test_derivatives_generated_on_save(self):
+        """Test that saving a recipe with a picture writes WebP copies at each width"""
+        recipe = Recipe.objects.create(name="Chili", cooking_time=60, ingredients="Beans, Beef", pic=make_png_upload())
+        self.assertTrue(Recipe.objects.get(pk=recipe.pk).has_pic_derivatives)
+        for width in DERIVATIVE_WIDTHS:
+            with Image.open(os.path.join(self.media_root, get_derivative_name(recipe.pic.name, width))) as derivative:
+                self.assertEqual(derivative.format, 'WEBP')
+                self.assertEqual(derivative.width, width)
+        self.assertIn('150w', recipe.pic_srcset)
+
+    def test_default_picture_has_no_srcset(self):
+        """Test that recipes without an uploaded picture don't get a srcset"""
+        recipe = Recipe.objects.create(name="Chili", cooking_time=60, ingredients="Beans, Beef")
+        self.assertFalse(recipe.has_pic_derivatives)
+        self.assertEqual(recipe.pic_srcset, '')
+
+    def test_regenerate_command(self):
+        """Test that the command builds derivatives for pictures already in media/recipes"""
+        os.makedirs(os.path.join(self.media_root, 'recipes'))
+        upload = make_png_upload()
+        with open(os.path.join(self.media_root, 'recipes', 'old.png'), 'wb') as picture:
+            picture.write(upload.read())
+        Recipe.objects.bulk_create([Recipe(name="Old", cooking_time=5, ingredients="Tea", pic='recipes/old.png')])
+
+        call_command('regenerate_derivatives', workers=2, stdout=StringIO(), stderr=StringIO())
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, get_derivative_name('recipes/old.png', 300))))
+        self.assertTrue(Recipe.objects.get(name="Old").has_pic_derivatives)
+
+class ContentAddressedStorageTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.settings_override = override_settings(MEDIA_ROOT=media_root)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.media_root = media_root
+
+    def test_identical_uploads_stored_once(self):
+        """Test that the same picture uploaded twice is stored once and reference-counted"""
+        with self.captureOnCommitCallbacks(execute=True):
+            first = Recipe.objects.create(name="Chili", cooking_time=60, ingredients="Beans", pic=make_png_upload('chili.png'))
+            second = Recipe.objects.create(name="Chili 2", cooking_time=60, ingredients="Beans", pic=make_png_upload('copy.png'))
+        self.assertEqual(first.pic.name, second.pic.name)
+        self.assertRegex(first.pic.name, r'^recipes/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertEqual(ImageBlob.objects.get(name=first.pic.name).ref_count, 2)
+
+        # The file stays until the last recipe using it is gone
+        path = os.path.join(self.media_root, first.pic.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(path))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_dedupe_command(self):
+        """Test that the dedupe command reports in dry-run mode and merges copies with --apply"""
+        os.makedirs(os.path.join(self.media_root, 'recipes'))
+        content = make_png_upload().read()
+        for filename in ('toast.png', 'toast_JflrzfT.png'):
+            with open(os.path.join(self.media_root, 'recipes', filename), 'wb') as picture:
+                picture.write(content)
+        Recipe.objects.bulk_create([
+            Recipe(name="Toast", cooking_time=3, ingredients="Bread", pic='recipes/toast.png'),
+            Recipe(name="More Toast", cooking_time=3, ingredients="Bread", pic='recipes/toast_JflrzfT.png'),
+        ])
+
+        call_command('dedupe_media', stdout=StringIO())
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'recipes'))), 2)
+
+        call_command('dedupe_media', apply=True, stdout=StringIO())
+        names = set(Recipe.objects.values_list('pic', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'recipes', 'toast.png')))
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 2)
+
+    def test_content_addressed_pictures_served_immutable(self):
+        """Test that content-addressed pictures are served by the media middleware with immutable cache headers"""
+        recipe = Recipe.objects.create(name="Chili", cooking_time=60, ingredients="Beans", pic=make_png_upload())
+        # Served before sessions, auth or any view run
+        with self.assertNumQueries(0), mock.patch('django.core.handlers.base.BaseHandler.resolve_request') as resolve_request:
+            response = self.client.get(recipe.pic.url)
+        resolve_request.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+
+        # The srcset derivatives are named after the picture's digest, so they never change either
+        urls = re.findall(r'(\S+) \d+w', Recipe.objects.get(pk=recipe.pk).pic_srcset)
+        self.assertEqual(len(urls), len(DERIVATIVE_WIDTHS))
+        for url in urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+
+class FullTextSearchTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.soup = Recipe.objects.create(name="Tomato Soup", cooking_time=30, ingredients="Tomato, Onion, Stock")
+        self.pasta = Recipe.objects.create(name="Pasta", cooking_time=20, ingredients="Pasta, Tomato")
+        self.salad = Recipe.objects.create(name="Green Salad", cooking_time=5, ingredients="Lettuce, Cucumber")
+
+    def test_results_ranked_by_relevance(self):
+        """Test that a match in the name ranks above a match in the ingredients"""
+        self.assertEqual(search_recipe_ids('tomato'), [self.soup.pk, self.pasta.pk])
+
+    def test_prefix_and_multiple_terms(self):
+        """Test that terms match word prefixes and every term has to match"""
+        self.assertEqual(search_recipe_ids('tom'), [self.soup.pk, self.pasta.pk])
+        self.assertEqual(search_recipe_ids('tomato onion'), [self.soup.pk])
+        self.assertEqual(search_recipe_ids('"); DROP'), [])
+
+    def test_index_follows_changes(self):
+        """Test that edits and deletes are reflected in the search index"""
+        self.salad.ingredients = "Lettuce, Tomato"
+        self.salad.save()
+        self.assertIn(self.salad.pk, search_recipe_ids('tomato'))
+
+        self.soup.delete()
+        self.assertEqual(search_recipe_ids('soup'), [])
+
+    @mock.patch.object(RecipeSearchView, 'page_size', 1)
+    def test_search_view_pages_by_relevance(self):
+        """Test that the search view pages through results in order of relevance"""
+        self.client.login(username='testuser', password='testpass')
+        response = self.client.post(reverse('recipes:recipe_search'), {'Recipe_Name': 'tomato'})
+        self.assertEqual(response.context['recipes'], [self.soup])
+
+        response = self.client.post(reverse('recipes:recipe_search'), {'Recipe_Name': 'tomato', 'after': response.context['next_cursor']})
+        self.assertEqual(response.context['recipes'], [self.pasta])
+        self.assertIsNone(response.context['next_cursor'])
+
+class TrigramIndexTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        fuzzy.trigram_index.reset()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.soup = Recipe.objects.create(name="Chicken Soup", cooking_time=30, ingredients="Chicken, Onion, Stock")
+        Recipe.objects.create(name="Tomato Salad", cooking_time=5, ingredients="Tomato, Lettuce")
+
+    def test_suggest_closest_terms(self):
+        """Test that misspellings are matched to the most similar terms"""
+        index = TrigramIndex(['tomato', 'potato', 'chicken', 'onion'])
+        self.assertEqual(index.suggest('tomatoe')[0][0], 'tomato')
+        self.assertEqual(index.suggest('chiken', limit=1)[0][0], 'chicken')
+        self.assertEqual(index.suggest('xyz'), [])
+
+        index.remove('tomato')
+        self.assertNotIn('tomato', [term for term, similarity in index.suggest('tomatoe')])
+
+    def test_correct_uses_recipe_names_and_vocabulary(self):
+        """Test that unknown words are corrected and known words left alone"""
+        index = fuzzy.get_trigram_index()
+        self.assertEqual(index.correct('Chiken soup'), 'chicken soup')
+        self.assertEqual(index.correct('letuce'), 'lettuce')
+
+    def test_index_updated_on_save(self):
+        """Test that saved recipes add their words to an existing index"""
+        index = fuzzy.get_trigram_index()
+        Recipe.objects.create(name="Lasagne", cooking_time=60, ingredients="Pasta, Ricotta")
+        self.assertIn('lasagne', index)
+        self.assertIn('ricotta', index)
+
+    def test_unused_words_removed(self):
+        """Test that words no recipe uses any more stop being suggested"""
+        index = fuzzy.get_trigram_index()
+        self.soup.delete()
+        self.assertIs(fuzzy.get_trigram_index(), index)
+        self.assertNotIn('chicken', index)
+        self.assertNotIn('onion', index)
+        self.assertEqual(index.correct('tomatos'), 'tomato')
+
+        # A word that comes back is suggested again
+        Recipe.objects.create(name="Onion Tart", cooking_time=40, ingredients="Onion, Pastry")
+        self.assertIn('onion', fuzzy.get_trigram_index())
+
+    def test_changes_from_other_workers(self):
+        """Test that changes made elsewhere are read from the feed, without rebuilding the index"""
+        index = fuzzy.get_trigram_index()
+        with mock.patch('recipes.fuzzy.build_index') as build_index:
+            # Another worker's changes only reach this one through the stats and the catalog version
+            update_stats(added=[('Quiche', 40, 'Egg, Cream')], removed=[('Tomato Salad', 5, 'Tomato, Lettuce')])
+            forget_recipes([])
+            self.assertIn('quiche', fuzzy.get_trigram_index())
+            self.assertNotIn('lettuce', index)
+        build_index.assert_not_called()
+
+    def test_search_view_autocorrects(self):
+        """Test that a search with no results is retried with corrected spelling"""
+        self.client.login(username='testuser', password='testpass')
+        response = self.client.post(reverse('recipes:recipe_search'), {'Recipe_Name': 'chiken'})
+        self.assertEqual(response.context['recipes'], [self.soup])
+        self.assertEqual(response.context['corrected_query'], 'chicken')
+        self.assertContains(response, 'Showing results for')
+
+        response = self.client.post(reverse('recipes:recipe_search'), {'Recipe_Name': 'chicken'})
+        self.assertIsNone(response.context['corrected_query'])
+
+class PantryTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        pantry.pantry_index.reset()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.toast = Recipe.objects.create(name="Toast", cooking_time=5, ingredients="Bread, Butter")
+        self.omelette = Recipe.objects.create(name="Omelette", cooking_time=10, ingredients="Egg, Butter, Cheese")
+        self.cake = Recipe.objects.create(name="Cake", cooking_time=60, ingredients="Flour, Egg, Sugar, Butter")
+
+    def test_match_ranks_by_missing_ingredients(self):
+        """Test subset matches come first, then recipes missing the fewest ingredients"""
+        index = pantry.get_pantry_index()
+        have = ['bread', 'butter', 'egg', 'cheese']
+        # Ties are broken by how much of the pantry a recipe uses
+        self.assertEqual(index.match(have), [(self.omelette.pk, 0), (self.toast.pk, 0)])
+        self.assertEqual(index.match(have, max_missing=2)[-1], (self.cake.pk, 2))
+        self.assertEqual(index.match(['saffron'], max_missing=5), [])
+
+    def test_index_grows_past_initial_capacity(self):
+        """Test that adding many recipes and ingredients widens the matrix without losing bits"""
+        index = PantryIndex()
+        index.add_recipes((recipe_id, [f'ingredient {recipe_id}', 'salt']) for recipe_id in range(1, 3001))
+        self.assertEqual(len(index), 3000)
+        self.assertEqual(index.match(['ingredient 2999', 'salt']), [(2999, 0)])
+        index.remove_recipe(2999)
+        self.assertEqual(index.match(['ingredient 2999', 'salt']), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        """Test that an existing index picks up new, edited and deleted recipes"""
+        index = pantry.get_pantry_index()
+        salad = Recipe.objects.create(name="Salad", cooking_time=5, ingredients="Lettuce")
+        self.assertEqual(index.match(['lettuce']), [(salad.pk, 0)])
+
+        self.toast.ingredients = "Bread, Jam"
+        self.toast.save()
+        self.assertEqual(index.match(['bread', 'jam']), [(self.toast.pk, 0)])
+
+        salad.delete()
+        self.assertEqual(index.match(['lettuce']), [])
+
+    def test_changes_from_other_workers(self):
+        """Test that recipes saved and deleted elsewhere are read from the feed, without rebuilding the index"""
+        index = pantry.get_pantry_index()
+        with mock.patch('recipes.pantry.build_index') as build_index:
+            # Another worker's changes only reach this one through the database and the catalog version
+            Recipe.objects.filter(pk=self.toast.pk).update(ingredients="Bread, Jam", updated_at=timezone.now())
+            DeletedRecipe.objects.create(recipe_id=self.cake.pk)
+            forget_recipes([])
+            self.assertIs(pantry.get_pantry_index(), index)
+        build_index.assert_not_called()
+        self.assertEqual(index.match(['bread', 'jam']), [(self.toast.pk, 0)])
+        self.assertEqual(index.match(['flour', 'egg', 'sugar', 'butter']), [])
+
+    def test_index_too_far_behind_is_rebuilt(self):
+        """Test that an index older than the kept deletions is rebuilt rather than read from the feed"""
+        index = pantry.get_pantry_index()
+        pantry.pantry_index.seen -= DELETED_RECIPE_RETENTION
+        # Another worker deleted the cake long enough ago that its row is gone
+        Recipe.objects.filter(pk=self.cake.pk).delete()
+        DeletedRecipe.objects.all().delete()
+        with mock.patch('recipes.pantry.apply_changes') as apply_changes:
+            forget_recipes([])
+            rebuilt = pantry.get_pantry_index()
+        apply_changes.assert_not_called()
+        self.assertIsNot(rebuilt, index)
+        self.assertEqual(rebuilt.match(['flour', 'egg', 'sugar', 'butter']), [])
+        self.assertGreater(pantry.pantry_index.seen, timezone.now() - timedelta(minutes=1))
+
+    def test_expired_deletions_pruned(self):
+        """Test that deleting a recipe drops the deletions older than the retention period"""
+        DeletedRecipe.objects.create(recipe_id=1000)
+        DeletedRecipe.objects.update(deleted_at=timezone.now() - DELETED_RECIPE_RETENTION - timedelta(minutes=1))
+        DeletedRecipe.objects.create(recipe_id=1001)
+        toast_pk = self.toast.pk
+        self.toast.delete()
+        self.assertEqual(sorted(DeletedRecipe.objects.values_list('recipe_id', flat=True)), sorted([1001, toast_pk]))
+
+    def test_pantry_view(self):
+        """Test that the view lists matching recipes with what is missing"""
+        self.client.login(username='testuser', password='testpass')
+        response = self.client.post(reverse('recipes:pantry'), {'Ingredients': ['egg', 'butter'], 'Max_Missing': 1})
+        self.assertEqual(response.context['recipes'], [self.omelette, self.toast])
+        self.assertEqual(response.context['recipes'][0].missing_ingredients, ['cheese'])
+        self.assertEqual(response.context['recipes'][1].missing_ingredients, ['bread'])
+        self.assertContains(response, 'Missing: cheese')
+
+class SimilarRecipesTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.pancakes = Recipe.objects.create(name="Pancakes", cooking_time=20, ingredients="Flour, Egg, Milk, Butter, Sugar")
+        self.crepes = Recipe.objects.create(name="Crepes", cooking_time=20, ingredients="Flour, Egg, Milk, Butter, Salt")
+        self.salad = Recipe.objects.create(name="Salad", cooking_time=5, ingredients="Lettuce, Tomato, Cucumber")
+
+    def test_migration_hashes_like_similarity(self):
+        """Test that the hashing frozen in migration 0009 still matches similarity.py (a change needs a rehash)"""
+        from importlib import import_module
+        migration = import_module('recipes.migrations.0009_similarity_bucket')
+        names = ['flour', 'egg', 'milk', 'butter', 'sugar']
+        self.assertEqual(migration.get_buckets(names), get_buckets(names))
+        self.assertEqual(migration.get_buckets([]), get_buckets([]))
+
+    def test_signature_estimates_jaccard(self):
+        """Test that MinHash signatures agree in about as many positions as the Jaccard similarity"""
+        first = [f'ingredient {i}' for i in range(40)]
+        second = [f'ingredient {i}' for i in range(20, 60)]
+        agreement = sum(a == b for a, b in zip(get_signature(first), get_signature(second))) / len(get_signature(first))
+        self.assertAlmostEqual(agreement, 1 / 3, delta=0.15)
+        self.assertEqual(get_buckets(['egg', 'milk']), get_buckets(['milk', 'egg']))
+        self.assertEqual(get_buckets([]), [])
+
+    def test_similar_recipes(self):
+        """Test that recipes sharing ingredients are found, best match first"""
+        similar = get_similar_recipes(self.pancakes)
+        self.assertEqual(similar, [self.crepes])
+        self.assertAlmostEqual(similar[0].similarity, 4 / 6)
+        self.assertEqual(get_similar_recipes(self.salad), [])
+
+    def test_buckets_follow_changes(self):
+        """Test that buckets are recomputed on save and removed with the recipe"""
+        self.salad.ingredients = "Flour, Egg, Milk, Butter, Sugar, Vanilla"
+        self.salad.save()
+        self.assertIn(self.salad, get_similar_recipes(self.pancakes))
+
+        self.salad.delete()
+        self.assertFalse(SimilarityBucket.objects.filter(recipe_id=self.salad.pk).exists())
+
+    def test_detail_view_shows_similar_recipes(self):
+        """Test the similar recipes panel on the detail page"""
+        self.client.login(username='testuser', password='testpass')
+        response = self.client.get(reverse('recipes:detail', kwargs={'pk': self.pancakes.pk}))
+        self.assertEqual(get_card_names(response), ['Crepes'])
+        self.assertContains(response, 'Similar Recipes')
+
+class ImportExportTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        vocabulary_index.reset()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as output:
+            output.write(content)
+        return path
+
+    def test_import_jsonl(self):
+        """Test that valid lines are imported in batches and invalid ones reported"""
+        path = self.write_file('recipes.jsonl', '\n'.join([
+            '{"name": "Toast", "cooking_time": 5, "ingredients": "Bread, Butter"}',
+            '{"name": "Stew", "cooking_time": 90, "ingredients": "Beef, Carrot, Onion, Potato"}',
+            '{"name": "Too Many", "cooking_time": 5, "ingredients": "a, b, c, d, e, f, g, h, i, j, k"}',
+            'not json',
+        ]))
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_recipes', path, batch_size=1, stdout=stdout, stderr=stderr)
+
+        self.assertIn('Imported 2 recipes', stdout.getvalue())
+        self.assertIn('skipped 2 invalid', stdout.getvalue())
+        self.assertIn('Line 3: ingredients: Please limit to 10 ingredients.', stderr.getvalue())
+        self.assertIn('Line 4:', stderr.getvalue())
+
+        # bulk_create fills in everything a normal save would
+        stew = Recipe.objects.get(name='Stew')
+        self.assertEqual(stew.difficulty, 'Hard')
+        self.assertEqual(set(stew.ingredient_items.values_list('name', flat=True)), {'beef', 'carrot', 'onion', 'potato'})
+        self.assertEqual(get_vocabulary()['bread'], 1)
+        self.assertTrue(SimilarityBucket.objects.filter(recipe=stew).exists())
+
+    def test_export_and_import_csv(self):
+        """Test that an exported CSV file can be imported again"""
+        Recipe.objects.create(name="Toast, Buttered", cooking_time=5, ingredients="Bread, Butter")
+        path = os.path.join(self.directory, 'recipes.csv')
+        call_command('export_recipes', path, chunk_size=1, stdout=StringIO())
+
+        Recipe.objects.all().delete()
+        call_command('import_recipes', path, stdout=StringIO(), stderr=StringIO())
+        recipe = Recipe.objects.get()
+        self.assertEqual((recipe.name, recipe.cooking_time, recipe.ingredients), ("Toast, Buttered", 5, "Bread, Butter"))
+
+    def test_export_jsonl_to_stdout(self):
+        """Test that JSON Lines go to stdout and progress to stderr"""
+        Recipe.objects.create(name="Toast", cooking_time=5, ingredients="Bread, Butter")
+        stdout, stderr = StringIO(), StringIO()
+        call_command('export_recipes', stdout=stdout, stderr=stderr)
+
+        records = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual([(record['name'], record['difficulty']) for record in records], [('Toast', 'Easy')])
+        self.assertIn('Exported 1 recipes', stderr.getvalue())
+
+@override_settings(CACHES=TEST_CACHES)
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        Recipe.objects.create(name="Toast", cooking_time=5, ingredients="Bread, Butter")
+
+    def test_histogram(self):
+        """Test that observations land in the right (cumulative) buckets"""
+        histogram = metrics.Histogram('test_seconds', 'Test.', ('name',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, 'a"b')
+        text = metrics.render_metrics({'recipe_timer_duration_seconds': {('x',): [1] + [0] * 11 + [0.0005, 1]}})
+        # 3 only falls in the implicit +Inf bucket
+        self.assertEqual(histogram.snapshot(), {('a"b',): [2, 1, 3.65, 4]})
+        self.assertIn('recipe_timer_duration_seconds_bucket{name="x",le="10.0"} 1', text)
+        self.assertIn('recipe_timer_duration_seconds_bucket{name="x",le="0.001"} 1', text)
+        self.assertIn('recipe_timer_duration_seconds_count{name="x"} 1', text)
+        self.assertEqual(metrics.format_labels(('name',), ('a"b',)), '{name="a\\"b"}')
+
+    def test_requests_are_recorded(self):
+        """Test that view latency, query counts and timers show up on /metrics"""
+        self.client.login(username='testuser', password='testpass')
+        self.client.post(reverse('recipes:recipe_search'), {'Recipe_Name': 'toast'})
+
+        response = self.client.get(reverse('recipes:metrics'))
+        self.assertEqual(response.status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('recipes:metrics'))
+        text = response.content.decode()
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('recipe_request_duration_seconds_count{view="recipes:recipe_search",method="POST",status="200"}', text)
+        self.assertIn('recipe_request_queries_bucket{view="recipes:recipe_search"', text)
+        self.assertIn('recipe_timer_duration_seconds_count{name="search"}', text)
+        self.assertIn('recipe_timer_duration_seconds_count{name="template"}', text)
+
+    def test_workers_publish_in_their_own_slots(self):
+        """Test that /metrics adds up the snapshots of every worker"""
+        row = [1] + [0] * 11 + [0.0005, 1]
+        for worker in ('a', 'b', 'c'):
+            with mock.patch('recipes.metrics._slot', None), \
+                    mock.patch('recipes.metrics.get_worker_id', return_value=worker), \
+                    mock.patch('recipes.metrics.snapshot', return_value={'recipe_timer_duration_seconds': {('x',): row}}):
+                metrics.publish()
+        self.assertEqual(metrics.collect()['recipe_timer_duration_seconds'][('x',)][-1], 3)
+
+        # A worker whose slot was taken over while it was idle claims another one
+        with mock.patch('recipes.metrics._slot', 0), mock.patch('recipes.metrics.get_worker_id', return_value='d'):
+            metrics.publish()
+            self.assertNotEqual(metrics._slot, 0)
+        self.assertEqual(cache.get(metrics.get_slot_key(0))[0], 'a')
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_bearer_token(self):
+        """Test that scrapers can authenticate with the metrics token"""
+        self.assertEqual(self.client.get(reverse('recipes:metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get(reverse('recipes:metrics'), HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    @override_settings(METRICS_SERVER_TIMING=True)
+    def test_server_timing_header(self):
+        """Test the optional Server-Timing header"""
+        self.client.login(username='testuser', password='testpass')
+        response = self.client.get(reverse('recipes:list'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", page_cache;dur=[\d.]+, template;dur=[\d.]+, total;dur=[\d.]+$')
+
+@override_settings(CACHES=TEST_CACHES)
+class PageCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.pancakes = Recipe.objects.create(name="Pancakes", cooking_time=20, ingredients="Flour, Egg, Milk, Butter, Sugar")
+        self.crepes = Recipe.objects.create(name="Crepes", cooking_time=20, ingredients="Flour, Egg, Milk, Butter, Salt")
+        self.factory = AsyncRequestFactory()
+
+    def get(self, view, path, **kwargs):
+        request = self.factory.get(path)
+        request.user = self.user
+        return async_to_sync(view)(request, **kwargs).render()
+
+    def test_warm_reads_run_no_queries(self):
+        """Test that cached list and detail pages are served without SQL"""
+        detail = reverse('recipes:detail', kwargs={'pk': self.pancakes.pk})
+        self.get(RecipeListView.as_view(), reverse('recipes:list'))
+        self.get(RecipeDetailView.as_view(), detail, pk=str(self.pancakes.pk))
+        with self.assertNumQueries(0):
+            response = self.get(RecipeListView.as_view(), reverse('recipes:list'))
+        self.assertEqual(get_card_names(response), ['Crepes', 'Pancakes'])
+        with self.assertNumQueries(0):
+            response = self.get(RecipeDetailView.as_view(), detail, pk=str(self.pancakes.pk))
+        self.assertEqual(get_card_names(response), ['Crepes'])
+
+    def test_conditional_get(self):
+        """Test that unchanged pages answer 304 and changed ones are rendered again"""
+        self.client.login(username='testuser', password='testpass')
+        detail = reverse('recipes:detail', kwargs={'pk': self.crepes.pk})
+        response = self.client.get(detail)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertTrue(response.has_header('Last-Modified'))
+        etag = response['ETag']
+        self.assertEqual(self.client.get(detail, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.crepes.ingredients = "Flour, Egg, Milk, Butter, Salt, Lemon"
+        self.crepes.save()
+        response = self.client.get(detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Lemon')
+        self.assertEqual(self.client.get(reverse('recipes:detail', kwargs={'pk': 999})).status_code, 404)
+
+    def test_partial_save_changes_the_page(self):
+        """Test that a save with update_fields moves the recipe on to a new version"""
+        self.client.login(username='testuser', password='testpass')
+        detail = reverse('recipes:detail', kwargs={'pk': self.crepes.pk})
+        etag = self.client.get(detail)['ETag']
+
+        self.crepes.name = "Thin Crepes"
+        self.crepes.save(update_fields=['name'])
+        response = self.client.get(detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Thin Crepes')
+
+    def test_invalidation_is_per_recipe(self):
+        """Test that a change renders only the changed recipe again"""
+        self.client.login(username='testuser', password='testpass')
+        self.client.get(reverse('recipes:list'))
+        self.pancakes.name = "Fluffy Pancakes"
+        self.pancakes.save()
+        with mock.patch('recipes.page_cache.render_to_string', wraps=render_to_string) as render:
+            response = self.client.get(reverse('recipes:list'))
+        self.assertEqual(get_card_names(response), ['Crepes', 'Fluffy Pancakes'])
+        self.assertEqual(render.call_count, 1)
+
+        # bulk_update() and deletes skip save(), but still invalidate
+        self.pancakes.name = "Thin Pancakes"
+        Recipe.objects.bulk_update([self.pancakes], ['name'])
+        self.assertEqual(get_card_names(self.client.get(reverse('recipes:list'))), ['Crepes', 'Thin Pancakes'])
+        self.crepes.delete()
+        self.assertEqual(get_card_names(self.client.get(reverse('recipes:list'))), ['Thin Pancakes'])
+
+@override_settings(CACHES=TEST_CACHES)
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        Recipe.objects.create(name="Pasta", cooking_time=30, ingredients="Tomato, Pasta")
+        Recipe.objects.create(name="Pasta Bake", cooking_time=50, ingredients="Tomato, Pasta, Cheese")
+
+    def test_views_are_async(self):
+        """Test that the list, detail, search and chart views run on the event loop"""
+        for view in (RecipeListView, RecipeDetailView, RecipeSearchView):
+            self.assertTrue(view.view_is_async, view)
+        self.assertTrue(asyncio.iscoroutinefunction(chart_image_view))
+
+    async def test_concurrent_searches_and_chart(self):
+        """Test searches and chart images through the ASGI handler"""
+        response = await self.async_client.get(reverse('recipes:recipe_search'))
+        self.assertEqual(response.status_code, 302)
+
+        await sync_to_async(self.async_client.force_login)(self.user)
+        search = reverse('recipes:recipe_search')
+        by_name, by_ingredient = await asyncio.gather(
+            self.async_client.post(search, {'Recipe_Name': 'Pasta', 'chart_type': '#1'}),
+            self.async_client.post(search, {'Ingredients': ['cheese']}),
+        )
+        self.assertEqual(get_card_names(by_ingredient), ['Pasta Bake'])
+        self.assertContains(by_name, 'Pasta Bake')
+        chart = by_name.context['chart']
+
+        image = await self.async_client.get(chart)
+        self.assertEqual(image.status_code, 200)
+        cached = await self.async_client.get(chart, headers={'If-None-Match': image['ETag']})
+        self.assertEqual(cached.status_code, 304)
+
+@override_settings(CACHES=TEST_CACHES)
+class BenchmarkTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_generate_catalog_is_reproducible(self):
+        """Test that the same seed gives the same valid catalog"""
+        call_command('generate_catalog', size=30, seed=7, batch_size=8, stdout=StringIO())
+        first = list(Recipe.objects.order_by('id').values_list('name', 'cooking_time', 'ingredients'))
+        Recipe.objects.all().delete()
+        call_command('generate_catalog', size=30, seed=7, stdout=StringIO())
+        self.assertEqual(list(Recipe.objects.order_by('id').values_list('name', 'cooking_time', 'ingredients')), first)
+
+        for name, cooking_time, ingredients in first:
+            form = AddRecipeForm(data={'name': name, 'cooking_time': cooking_time, 'ingredients': ingredients})
+            self.assertTrue(form.is_valid(), form.errors)
+
+    def test_benchmark_and_baseline(self):
+        """Test that results are written as JSON and regressions fail the command"""
+        call_command('generate_catalog', size=20, stdout=StringIO())
+        output = os.path.join(self.directory, 'results.json')
+        call_command('benchmark', repeat=1, output=output, stdout=StringIO())
+        with open(output) as source:
+            report = json.load(source)
+        self.assertEqual(report['catalog_size'], 20)
+        self.assertEqual(set(report['results']), {
+            'list_view', 'search_name', 'search_one_ingredient', 'search_many_ingredients',
+            'chart_bar', 'chart_pie', 'chart_line', 'chart_histogram', 'calculate_difficulty_1000', 'add_recipe_view', 'detail_view', 'catalog_stats_view',
+        })
+        self.assertEqual(Recipe.objects.count(), 20)
+
+        # A baseline where everything was 1000x faster
+        for result in report['results'].values():
+            result['median_ms'] /= 1000
+        baseline = os.path.join(self.directory, 'baseline.json')
+        with open(baseline, 'w') as target:
+            json.dump(report, target)
+        with self.assertRaisesMessage(CommandError, 'slower than the baseline'):
+            call_command('benchmark', repeat=1, baseline=baseline, stdout=StringIO())
+
+class DatabaseTests(TestCase):
+
+    def test_sqlite_pragmas(self):
+        """Test that SQLite connections are tuned when they open"""
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['cache_size'])
+        self.assertTrue(connection.settings_dict['CONN_HEALTH_CHECKS'])
+
+    @override_settings(READ_REPLICA='replica')
+    def test_replica_routing(self):
+        """Test that only reads inside read_from_replica() use the replica"""
+        self.assertEqual(Recipe.objects.all().db, 'default')
+        with read_from_replica():
+            self.assertEqual(Recipe.objects.all().db, 'replica')
+            self.assertEqual(router.db_for_write(Recipe), 'default')
+        recipe = Recipe(name='Tea', cooking_time=5, ingredients='tea, water')
+        recipe._state.db = 'replica'
+        self.assertEqual(router.db_for_write(Recipe, instance=recipe), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'recipes'))
+
+        # Right after a write, the user's reads stay on the primary
+        request = RequestFactory().get('/')
+        request.COOKIES[PRIMARY_PIN_COOKIE] = '1'
+        with read_from_replica(request):
+            self.assertEqual(Recipe.objects.all().db, 'default')
+
+    def test_add_recipe_pins_reads_to_primary(self):
+        """Test that adding a recipe sets the cookie that skips the replica"""
+        User.objects.create_user(username='testuser', password='testpass')
+        self.client.login(username='testuser', password='testpass')
+        response = self.client.post(reverse('recipes:add_recipe'), {'name': 'Tea', 'cooking_time': 5, 'ingredients': 'tea, water'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.cookies[PRIMARY_PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+
+# The test runner's file-based default cache stands in for Redis
+@override_settings(SHARED_CACHE=True, SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+class CachedAuthTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        Recipe.objects.create(name="Tea", cooking_time=5, ingredients="Tea, Water")
+        self.client.login(username='testuser', password='testpass')
+
+    def test_authenticated_warm_page_runs_no_queries(self):
+        """Test that the session, the user and the cached page all come from the cache"""
+        self.client.get(reverse('recipes:list'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('recipes:list'))
+        self.assertEqual(get_card_names(response), ['Tea'])
+
+    def test_password_change_ends_sessions(self):
+        """Test that a password change drops the cached user and logs out old sessions"""
+        self.client.get(reverse('recipes:list'))
+        self.assertIsNotNone(cache.get(get_user_key(self.user.pk)))
+        self.user.set_password('newpass')
+        self.user.save()
+        self.assertIsNone(cache.get(get_user_key(self.user.pk)))
+        self.assertEqual(self.client.get(reverse('recipes:list')).status_code, 302)
+
+    @override_settings(SHARED_CACHE=False, SESSION_ENGINE='django.contrib.sessions.backends.db')
+    def test_database_fallback_without_a_shared_cache(self):
+        """Test that without Redis every request reads the session and the user from the database"""
+        self.client.login(username='testuser', password='testpass')
+        self.client.get(reverse('recipes:list'))
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('recipes:list'))
+        self.assertEqual(get_card_names(response), ['Tea'])
+        self.assertIsNone(cache.get(get_user_key(self.user.pk)))
+
+        # Another machine's logout is seen straight away
+        Session.objects.all().delete()
+        self.assertEqual(self.client.get(reverse('recipes:list')).status_code, 302)
+
+    def test_logout_drops_cached_user(self):
+        """Test that logging out drops the cached user"""
+        self.client.get(reverse('recipes:list'))
+        self.client.get(reverse('logout'))
+        self.assertIsNone(cache.get(get_user_key(self.user.pk)))
+        self.assertEqual(self.client.get(reverse('recipes:list')).status_code, 302)
+
+class CatalogStatsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.tea = Recipe.objects.create(name="Tea", cooking_time=5, ingredients="Tea, Water")
+        self.stew = Recipe.objects.create(name="Stew", cooking_time=95, ingredients="Beef, Carrot, Onion, Water")
+
+    # Every non-zero stat, {(kind, key): count}
+    def get_stats(self):
+        return {(kind, key): count for kind, key, count in CatalogStat.objects.exclude(count=0).values_list('kind', 'key', 'count')}
+
+    def test_stats_follow_saves(self):
+        """Test that creating and editing recipes updates the counts"""
+        self.assertEqual(get_difficulty_counts(), {'Easy': 1, 'Hard': 1})
+        self.assertEqual(get_top_ingredients(1), [('water', 2)])
+
+        self.tea.cooking_time = 12
+        self.tea.ingredients = "Tea, Water, Milk, Sugar"
+        self.tea.save()
+        self.assertEqual(get_difficulty_counts(), {'Hard': 2})
+        self.assertEqual(dict(get_cooking_time_histogram())['10-20 min'], 1)
+        self.assertEqual(dict(get_top_ingredients(10))['milk'], 1)
+        self.assertEqual(get_summary(), {'recipes': 2, 'ingredients': 7, 'average_cooking_time': 53.5})
+
+    def test_long_ingredient_fits_a_stat_key(self):
+        """Test that a stat row can hold the longest ingredient name"""
+        name = 'x' * Recipe._meta.get_field('ingredients').max_length
+        Recipe.objects.create(name="Long", cooking_time=5, ingredients=name)
+        CatalogStat.objects.get(kind=CatalogStat.INGREDIENT, key=name).full_clean()
+
+    def test_migration_counts_like_catalog_stats(self):
+        """Test that the counting frozen in migrations 0011 and 0012 still matches catalog_stats.py (a change needs a rebuild)"""
+        from importlib import import_module
+        from .catalog_stats import count_recipes
+        stats = import_module('recipes.migrations.0011_catalog_stat')
+        words = import_module('recipes.migrations.0012_catalog_stat_words')
+        rows = [
+            ("Tea", 5, 'Tea, Water'), ("Alphabet Soup", 9.5, 'A, B, C, D'),
+            ("Beef Stew", 95, 'Beef, Carrot'), ("Slow Beef", 300, 'Beef, Onion, Salt, Water'),
+        ]
+        migrated = stats.count_recipes([(cooking_time, ingredients) for name, cooking_time, ingredients in rows])
+        migrated.update(words.count_words([(name, ingredients) for name, cooking_time, ingredients in rows]))
+        self.assertEqual(migrated, count_recipes(rows))
+
+    def test_stats_match_a_rebuild(self):
+        """Test that deletes, bulk creates and bulk updates leave the same totals as a rebuild"""
+        Recipe.objects.bulk_create([
+            Recipe(name="Toast", cooking_time=3, ingredients="Bread, Butter"),
+            Recipe(name="Soup", cooking_time=250, ingredients="Water, Leek, Potato, Salt"),
+        ])
+        soup = Recipe.objects.get(name="Soup")
+        soup.cooking_time = 40
+        Recipe.objects.bulk_update([soup], ['cooking_time'])
+        self.stew.delete()
+        Recipe.objects.filter(name="Toast").delete()
+
+        incremental = self.get_stats()
+        self.assertEqual(rebuild_stats(), 2)
+        self.assertEqual(incremental, self.get_stats())
+        self.assertEqual(get_difficulty_counts(), {'Easy': 1, 'Hard': 1})
+        self.assertNotIn(('ingredient', 'beef'), incremental)
+
+    def test_stats_page_reads_a_few_rows(self):
+        """Test that the Catalog Stats page costs the same queries at any catalog size"""
+        self.client.login(username='testuser', password='testpass')
+        url = reverse('recipes:catalog_stats')
+        self.client.get(url)
+        # The session and the user (from the database without Redis), then five stat reads
+        with self.assertNumQueries(7):
+            response = self.client.get(url)
+        Recipe.objects.bulk_create([Recipe(name=f"Dish {number}", cooking_time=number, ingredients="Rice, Water") for number in range(1, 50)])
+        with self.assertNumQueries(7):
+            response = self.client.get(url)
+        self.assertContains(response, '<tr><th>Recipes</th><td>51</td></tr>', html=True)
+        self.assertContains(response, '/charts/')
+
 class AddRecipeFormTests(TestCase):
 
     def test_valid_form(self):
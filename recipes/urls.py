@@ -1,5 +1,5 @@
-from django.urls import path
-from .views import home, RecipeListView, RecipeDetailView, RecipeSearchView, add_recipe_view, AboutMeView
+from django.urls import path, re_path
+from .views import home, RecipeListView, RecipeDetailView, RecipeSearchView, PantryView, CatalogStatsView, chart_image_view, metrics_view, add_recipe_view, AboutMeView
 
 app_name = 'recipes'
 
@@ -8,6 +8,10 @@ urlpatterns = [
     path('recipes/', RecipeListView.as_view(), name='list'),  # List view for recipes
     path('recipes/<pk>', RecipeDetailView.as_view(), name='detail'),  # Detail view
     path('search/', RecipeSearchView.as_view(), name='recipe_search'),  # Search view
+    path('pantry/', PantryView.as_view(), name='pantry'),  # Recipes from the ingredients on hand
+    path('stats/', CatalogStatsView.as_view(), name='catalog_stats'),  # Whole-catalog figures and charts
+    re_path(r'^charts/(?P<digest>[0-9a-f]{64})\.(?P<image_format>png|svg)$', chart_image_view, name='chart'),  # Chart images for search results
     path('add/', add_recipe_view, name='add_recipe'),  # Add recipe URL
     path('about/', AboutMeView.as_view(), name='about_me'),
+    path('metrics', metrics_view, name='metrics'),  # Prometheus metrics
 ]
\ No newline at end of file
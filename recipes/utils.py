@@ -1,79 +1,94 @@
-# Imports for charting functions
+# Imports for charting functions (matplotlib itself is imported on first use, inside the
+# functions below, so importing this module stays cheap)
+from collections import Counter
 from io import BytesIO
-import base64
-import matplotlib.pyplot as plt
 
 # Function to handle low-level image handling
-def get_graph():
+def get_graph(fig):
+   from matplotlib.backends.backend_agg import FigureCanvasAgg
+
    #create a BytesIO buffer for the image
    buffer = BytesIO()         
 
-   #create a plot with a bytesIO object as a file-like object. Set format to png
-   plt.savefig(buffer, format='png')
-
-   #set cursor to the beginning of the stream
-   buffer.seek(0)
+   #render the figure with the Agg canvas into the bytesIO object as a file-like object. Set format to png
+   FigureCanvasAgg(fig).print_png(buffer)
 
-   #retrieve the content of the file
+   #retrieve the content of the file (raw PNG bytes, served as image/png by the chart view)
    image_png=buffer.getvalue()
 
-   #encode the bytes-like object
-   graph=base64.b64encode(image_png)
-
-   #decode to get the string as output
-   graph=graph.decode('utf-8')
-
    #free up the memory of buffer
    buffer.close()
 
    #return the image/graph
-   return graph
+   return image_png
+
+# Most category labels drawn on the x-axis; longer series only label every few points
+MAX_LABELS = 25
 
 #chart_type: user input o type of chart,
-#data: pandas dataframe
+#data: pandas dataframe (or dict of column lists, see chart_data.py)
+#difficulty_counts (optional): dict of difficulty level -> number of recipes, for the pie chart
 def get_chart(chart_type, data, **kwargs):
-   #switch plot backend to AGG (Anti-Grain Geometry) - to write to file
-   #AGG is preferred solution to write PNG files
-   plt.switch_backend('AGG')
+   # Use matplotlib's object-oriented API: figures drawn on their own Agg canvas are never
+   # registered with pyplot, so they are freed as soon as the chart is returned
+   from matplotlib.figure import Figure
+   from matplotlib.ticker import MaxNLocator
 
-   #specify figure size
-   fig=plt.figure(figsize=(6,3))
+   #specify figure size (a standalone Figure, not plt.figure(), so nothing is left behind in pyplot)
+   fig=Figure(figsize=(6,3))
+   ax=fig.add_subplot()
 
    #select chart_type based on user input from the form
    if chart_type == '#1':
        #plot bar chart between name on x-axis and cooking time on y-axis
-       plt.bar(data['name'], data['cooking_time'])
-       plt.xlabel('Recipe Name')  # X-axis label
-       plt.ylabel('Cooking Time (minutes)')  # Y-axis label
-       plt.title('Cooking Time by Recipe')  # Chart title
+       ax.bar(data['name'], data['cooking_time'])
+       ax.set_xlabel('Recipe Name')  # X-axis label
+       ax.set_ylabel('Cooking Time (minutes)')  # Y-axis label
+       ax.set_title('Cooking Time by Recipe')  # Chart title
 
    elif chart_type == '#2':
-       # Group by difficulty level and calculate the count
-       difficulty_counts = data['difficulty'].value_counts()
+       # Use counts per difficulty level if the caller already grouped them, otherwise count here
+       difficulty_counts = kwargs.get('difficulty_counts')
+       if difficulty_counts is None:
+           difficulty_counts = Counter(data['difficulty'])
 
        # Calculate percentages for each difficulty level
-       percentages = difficulty_counts / difficulty_counts.sum() * 100
+       total = sum(difficulty_counts.values())
+       percentages = [count / total * 100 for count in difficulty_counts.values()]
 
        # Create labels with percentage values
-       labels = [f'{level}: {percentage:.1f}%' for level, percentage in zip(difficulty_counts.index, percentages)]
+       labels = [f'{level}: {percentage:.1f}%' for level, percentage in zip(difficulty_counts, percentages)]
 
        # Plot pie chart
-       plt.pie(percentages, labels=labels, autopct='%1.1f%%', startangle=90)
-       plt.title('Recipe Difficulty Breakdown')
+       ax.pie(percentages, labels=labels, autopct='%1.1f%%', startangle=90)
+       ax.set_title('Recipe Difficulty Breakdown')
 
    elif chart_type == '#3':
        #plot line chart based on recipe name on x-axis and cooking time on y-axis
-       plt.plot(data['name'], data['cooking_time'])
-       plt.xlabel('Recipe Name')  # X-axis label
-       plt.ylabel('Cooking Time (minutes)')  # Y-axis label
-       plt.title('Cooking Time by Recipe')  # Chart title
+       ax.plot(data['name'], data['cooking_time'])
+       ax.set_xlabel('Recipe Name')  # X-axis label
+       ax.set_ylabel('Cooking Time (minutes)')  # Y-axis label
+       ax.set_title('Cooking Time by Recipe')  # Chart title
+
+   elif chart_type == '#4':
+       #plot bar chart of the number of recipes in each cooking time bin
+       ax.bar(data['bin'], data['recipes'])
+       ax.set_xlabel('Cooking Time')  # X-axis label
+       ax.set_ylabel('Recipes')  # Y-axis label
+       ax.set_title('Recipes by Cooking Time')  # Chart title
 
    else:
        print ('unknown chart type')
 
+   #keep the category labels readable: at most MAX_LABELS of them, turned sideways
+   if chart_type in ('#1', '#3', '#4'):
+       if len(ax.get_xticks()) > MAX_LABELS:
+           ax.xaxis.set_major_locator(MaxNLocator(MAX_LABELS, integer=True))
+       ax.tick_params(axis='x', labelrotation=45, labelsize=7)
+
    #specify layout details
-   plt.tight_layout()
+   fig.tight_layout()
 
    #render the graph to file
-   chart =get_graph() 
-   return chart  
\ No newline at end of file
+   chart =get_graph(fig) 
+   return chart
\ No newline at end of file
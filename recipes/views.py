@@ -1,11 +1,26 @@
 from django.shortcuts import render, redirect
-from django.views.generic import ListView, DetailView, View, TemplateView   # To display list of recipes and their details
-from .models import Recipe                  # To access Recipe model
+from django.http import HttpResponse, Http404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date
+from asgiref.sync import sync_to_async
+from django.views.generic import View, TemplateView   # To display list of recipes and their details
+from .models import Recipe, parse_ingredients    # To access Recipe model
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
-from .forms import RecipeSearchForm, AddRecipeForm    # Import form from forms.py
-import pandas as pd
-from .utils import get_chart    # Import from utils.py
+from django.contrib.auth.views import redirect_to_login
+from .forms import RecipeSearchForm, PantryForm, AddRecipeForm    # Import form from forms.py
+from .chart_cache import store_chart_spec, get_chart_image, get_chart_format, CHART_CONTENT_TYPES    # Cached chart rendering
+from .chart_pool import ChartRenderError
+from .pagination import akeyset_paginate, aranked_paginate, PAGE_SIZE
+from .page_cache import get_list_page, get_detail_page, get_recipe_version, get_catalog_version, get_catalog_modified
+from .search import search_recipe_ids
+from .fuzzy import get_trigram_index, get_words
+from .pantry import get_pantry_index
+from .metrics import render_metrics, timer
+from .database import read_from_replica, pin_to_primary
+from .chart_data import get_chart_data
+from .catalog_stats import get_summary, get_difficulty_counts, get_cooking_time_histogram, get_top_ingredients
 
 # Create your views here.
 
@@ -13,78 +28,303 @@ from .utils import get_chart    # Import from utils.py
 def home(request):
     return render(request, 'recipes/recipes_home.html')
 
-# List view
-class RecipeListView(LoginRequiredMixin, ListView):                 # Class-based view
-    model = Recipe                               # Specify model
+# Full-text search on name and ingredients, best matches first (substring match on databases
+# without a full-text index). Returns the filtered queryset and the ranked ids (None if unranked)
+def filter_by_name(queryset, text):
+    ranked_ids = search_recipe_ids(text)
+    if ranked_ids is None:
+        return queryset.filter(name__icontains=text), None
+    return queryset.filter(id__in=ranked_ids), ranked_ids
+
+# Search names and ingredients; if nothing matches, retry once with misspelled words ("chiken")
+# replaced by the closest known word from the trigram index.
+# Returns (queryset, ranked ids, corrected query or None)
+def search_by_name(queryset, text):
+    name_queryset, ranked_ids = filter_by_name(queryset, text)
+    found = bool(ranked_ids) if ranked_ids is not None else name_queryset.exists()
+    if not found:
+        corrected = get_trigram_index().correct(text)
+        if corrected and corrected != ' '.join(get_words(text)):
+            name_queryset, ranked_ids = filter_by_name(queryset, corrected)
+            return name_queryset, ranked_ids, corrected
+    return name_queryset, ranked_ids, None
+
+# Fields used by the search result cards (everything else is left out of the SELECT)
+SEARCH_CARD_FIELDS = ('id', 'name', 'cooking_time', 'ingredients', 'pic', 'has_pic_derivatives', 'difficulty')
+
+# request.user loads the session and the user from the database on first use, which async
+# views have to do in a thread
+async def is_authenticated(request):
+    return await sync_to_async(lambda: request.user.is_authenticated)()
+
+# LoginRequiredMixin for async views
+class AsyncLoginRequiredMixin(LoginRequiredMixin):
+
+    async def dispatch(self, request, *args, **kwargs):
+        if not await is_authenticated(request):
+            return self.handle_no_permission()
+        # View.dispatch, skipping LoginRequiredMixin's synchronous check
+        return await super(LoginRequiredMixin, self).dispatch(request, *args, **kwargs)
+
+# Conditional GETs for pages served from the page cache (the condition() decorator only wraps
+# sync views). get_validators() returns (ETag, Last-Modified) or (None, None) for a 404
+class CachedPageMixin:
+
+    async def get(self, request, *args, **kwargs):
+        etag, last_modified = await sync_to_async(self.get_validators)(**kwargs)
+        if etag is None:
+            raise Http404('No recipe found matching the query')
+        etag = quote_etag(etag)
+        last_modified = int(last_modified.timestamp())
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            with timer('page_cache'):
+                context = await sync_to_async(self.get_page_context)(**kwargs)
+            response = self.render_to_response(context)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        # Browsers keep the page but check back every time, getting a 304 while nothing has changed
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+# List view, one keyset page at a time; ?after=<cursor> continues from the previous page.
+# Pages and cards come from the page cache (see page_cache.py)
+class RecipeListView(AsyncLoginRequiredMixin, CachedPageMixin, TemplateView):                 # Class-based view
     template_name = 'recipes/recipe_list.html'   # Specify template 
+    page_size = PAGE_SIZE
 
-# Detail View
-class RecipeDetailView(LoginRequiredMixin, DetailView):
-    model = Recipe
+    # Any change to the catalog can change a list page
+    def get_validators(self):
+        return f'list-{get_catalog_version()}', get_catalog_modified()
+
+    def get_page_context(self):
+        page = get_list_page(self.request.GET.get('after'), self.page_size)
+        return {'cards': page.cards, 'next_cursor': page.next_cursor}
+
+# Detail View, with a "Similar recipes" panel found through the recipe's MinHash buckets
+class RecipeDetailView(AsyncLoginRequiredMixin, CachedPageMixin, TemplateView):
     template_name = 'recipes/recipe_details.html'
 
-class RecipeSearchView(LoginRequiredMixin, View):
+    # The "similar recipes" panel can change with any other recipe, so the page is as new as
+    # the latest change to the catalog
+    def get_validators(self, pk):
+        version = get_recipe_version(pk)
+        if version is None:
+            return None, None
+        return f'{pk}-{version}-{get_catalog_version()}', get_catalog_modified()
+
+    def get_page_context(self, pk):
+        try:
+            page = get_detail_page(pk)
+        except Recipe.DoesNotExist:
+            raise Http404('No recipe found matching the query')
+        return {'recipe_card': page.recipe_card, 'similar_cards': page.similar_cards}
+
+# Table of the recipes on the page (runs in a worker thread: pandas is CPU-bound)
+def get_recipe_table(recipes):
+    # Imported on first search rather than at module load, so worker boot doesn't pay for pandas
+    import pandas as pd
+
+    with timer('dataframe'):
+        recipe_df = pd.DataFrame([
+            {'name': recipe.name, 'cooking_time': recipe.cooking_time, 'difficulty': recipe.difficulty}
+            for recipe in recipes
+        ])
+        return recipe_df.to_html() if not recipe_df.empty else None
+
+# Store a bar, line or histogram chart of (name, cooking_time) rows, aggregated down to a
+# bounded number of bars or points (runs in a worker thread: NumPy is CPU-bound)
+def store_rows_chart(chart_type, rows):
+    with timer('chart_aggregate'):
+        data = get_chart_data(chart_type, rows)
+    return store_chart_spec(chart_type, data)
+
+# Async, so a slow search only holds the event loop while it has work to do. Queries use the
+# async ORM; DataFrames, chart data and rendering (about 900 ingredient options) run in worker
+# threads. Everything that may load the ingredient vocabulary or search index runs through
+# sync_to_async
+class RecipeSearchView(AsyncLoginRequiredMixin, View):
     form_class = RecipeSearchForm  # Define form_class as a class attribute
     template_name = 'recipes/recipe_search.html'
+    page_size = PAGE_SIZE
 
-    def get(self, request, *args, **kwargs):
-        form = self.form_class()  # Now this will work because form_class is defined
-        return render(request, self.template_name, {'form': form})
+    async def get(self, request, *args, **kwargs):
+        form = await sync_to_async(self.form_class)()  # The ingredient choices may come from the database
+        return await sync_to_async(render, thread_sensitive=False)(request, self.template_name, {'form': form})
 
-    def post(self, request, *args, **kwargs):
-        form = self.form_class(request.POST)
+    async def post(self, request, *args, **kwargs):
+        form = await sync_to_async(self.form_class)(request.POST)
 
-        # Default queryset for recipes
-        queryset = Recipe.objects.all()
+        # Searches only read, so they can use the read replica (see database.py)
+        with read_from_replica(request):
+            # Default queryset for recipes
+            queryset = Recipe.objects.all()
 
-        # Initialize to None
-        chart_type = None
-        chart = None
+            # Initialize to None
+            chart_type = None
+            chart = None
+            ranked_ids = None
+            corrected_query = None
 
-        if form.is_valid():
-            recipe_name = form.cleaned_data.get("Recipe_Name")
-            ingredients = form.cleaned_data.get("Ingredients")
-            chart_type = form.cleaned_data.get("chart_type")
-
-            # Filter by recipe name
-            if recipe_name:
-                queryset = queryset.filter(name__icontains=recipe_name)
-
-            # Filter by ingredients
-            if ingredients:
-                for ingredient in ingredients:
-                    queryset = queryset.filter(ingredients__icontains=ingredient)
-
-        # Convert queryset to DataFrame with calculated difficulty
-        recipe_data = []
-        for recipe in queryset:
-            recipe_data.append({
-                'name': recipe.name,
-                'cooking_time': recipe.cooking_time,
-                'difficulty': recipe.calculate_difficulty(),  # Call calculate_difficulty method
-            })
+            if form.is_valid():
+                recipe_name = form.cleaned_data.get("Recipe_Name")
+                ingredients = form.cleaned_data.get("Ingredients")
+                difficulty = form.cleaned_data.get("Difficulty")
+                chart_type = form.cleaned_data.get("chart_type")
+
+                # Search names and ingredients, correcting typos if nothing matches
+                if recipe_name:
+                    with timer('search'):
+                        queryset, ranked_ids, corrected_query = await sync_to_async(search_by_name)(queryset, recipe_name)
+
+                # Filter by ingredients (recipes must contain all of the selected ingredients)
+                if ingredients:
+                    queryset = queryset.with_all_ingredients(ingredients)
 
-        recipe_df = pd.DataFrame(recipe_data)
+                # Filter by the stored difficulty column
+                if difficulty:
+                    queryset = queryset.filter(difficulty=difficulty)
 
-        # Generate chart if there are results and a valid chart type is provided
-        if not recipe_df.empty and chart_type:
-            if chart_type == "#1":  # Bar Chart
-                chart = get_chart('bar', recipe_df)
-            elif chart_type == "#2":  # Pie Chart
-                chart = get_chart('pie', recipe_df)
-            elif chart_type == "#3":  # Line Chart
-                chart = get_chart('line', recipe_df)
+            # Recipe cards (and the table) show one page at a time, continuing after the cursor
+            # sent by the "Next page" button; text searches are paged in order of relevance
+            card_queryset = queryset.only(*SEARCH_CARD_FIELDS)
+            if ranked_ids is None:
+                page = await akeyset_paginate(card_queryset, request.POST.get('after'), self.page_size)
             else:
-                chart = None  # If the chart type is invalid, set chart to None
+                page = await aranked_paginate(card_queryset, ranked_ids, request.POST.get('after'), self.page_size)
+
+            # Convert the page to a DataFrame using the stored difficulty column
+            recipe_table = await sync_to_async(get_recipe_table, thread_sensitive=False)(page.items)
+
+            # Store the chart data if there are results and a valid chart type is provided; the page
+            # links to the chart by URL and the browser fetches (and caches) the image separately.
+            # Charts cover every matching recipe, loading only the plotted columns
+            if page.items and chart_type:
+                with timer('chart_data'):
+                    if chart_type in ("#1", "#3", "#4"):  # Bar Chart, Line Chart or Histogram
+                        rows = [row async for row in queryset.order_by('name', 'id').values_list('name', 'cooking_time')]
+                        digest = await sync_to_async(store_rows_chart, thread_sensitive=False)(chart_type, rows)
+                    elif chart_type == "#2":  # Pie Chart, counted with a GROUP BY in the database
+                        difficulty_counts = await sync_to_async(queryset.difficulty_counts)()
+                        digest = await sync_to_async(store_chart_spec, thread_sensitive=False)(chart_type, {}, difficulty_counts=difficulty_counts)
+                    else:
+                        digest = None  # If the chart type is invalid, there is no chart
+                if digest:
+                    chart = reverse('recipes:chart', kwargs={'digest': digest, 'image_format': get_chart_format()})
 
         # Add form, DataFrame, chart, and queryset (for recipe cards) to context
         context = {
             'form': form,
-            'recipe_df': recipe_df.to_html() if not recipe_df.empty else None,
+            'recipe_df': recipe_table,
             'chart': chart if chart else None,
-            'recipes': queryset,  # Pass queryset for recipe cards
+            'recipes': page.items,  # Pass the current page for recipe cards
+            'next_cursor': page.next_cursor,
+            'corrected_query': corrected_query,
         }
-        return render(request, self.template_name, context)
+        with timer('template'):
+            return await sync_to_async(render, thread_sensitive=False)(request, self.template_name, context)
+
+# "Cook with what I have": recipes that can be made from the selected ingredients, fewest
+# missing ingredients first
+class PantryView(LoginRequiredMixin, View):
+    template_name = 'recipes/recipe_pantry.html'
+    form_class = PantryForm
+    result_limit = PAGE_SIZE
+
+    def get(self, request, *args, **kwargs):
+        return render(request, self.template_name, {'form': self.form_class(initial={'Max_Missing': 2})})
+
+    def post(self, request, *args, **kwargs):
+        form = self.form_class(request.POST)
+        recipes = []
+
+        if form.is_valid():
+            have = form.cleaned_data['Ingredients']
+            max_missing = form.cleaned_data.get('Max_Missing') or 0
+
+            # Score the whole catalog in memory, then load only the recipes on the page
+            with read_from_replica(request):
+                with timer('pantry'):
+                    matches = get_pantry_index().match(have, max_missing=max_missing, limit=self.result_limit)
+                cards = Recipe.objects.only(*SEARCH_CARD_FIELDS).in_bulk([recipe_id for recipe_id, missing in matches])
+            have = set(have)
+            for recipe_id, missing in matches:
+                recipe = cards.get(recipe_id)
+                if recipe is not None:
+                    recipe.missing_ingredients = [name for name in parse_ingredients(recipe.ingredients) if name not in have]
+                    recipes.append(recipe)
+
+        return render(request, self.template_name, {'form': form, 'recipes': recipes, 'searched': form.is_valid()})
+
+# Figures and charts for the whole catalog, read from the running totals in catalog_stats.py
+# (a few rows, however many recipes there are)
+class CatalogStatsView(LoginRequiredMixin, TemplateView):
+    template_name = 'recipes/catalog_stats.html'
+    top_ingredients = 10
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        with timer('catalog_stats'):
+            difficulty_counts = get_difficulty_counts()
+            cooking_times = get_cooking_time_histogram()
+            context.update({
+                'summary': get_summary(),
+                'cooking_times': cooking_times,
+                'top_ingredients': get_top_ingredients(self.top_ingredients),
+            })
+        if difficulty_counts:
+            digest = store_chart_spec('#2', {}, difficulty_counts=difficulty_counts)
+            context['chart'] = reverse('recipes:chart', kwargs={'digest': digest, 'image_format': get_chart_format()})
+
+            # The bins are already counted, so the histogram skips the aggregation in chart_data.py
+            digest = store_chart_spec('#4', {'bin': [label for label, count in cooking_times], 'recipes': [count for label, count in cooking_times]})
+            context['histogram_chart'] = reverse('recipes:chart', kwargs={'digest': digest, 'image_format': get_chart_format()})
+        return context
+
+# The digest covers the chart type and data, so together with the format it is a strong ETag.
+# Drawing is CPU-bound (or waits for the renderer pool), so it runs in a worker thread
+async def chart_image_view(request, digest, image_format):
+    if not await is_authenticated(request):
+        return redirect_to_login(request.get_full_path())
+    etag = quote_etag(f'{digest}.{image_format}')
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response['ETag'] = etag
+        return response
+
+    try:
+        chart = await sync_to_async(get_chart_image, thread_sensitive=False)(digest, image_format)
+    except ChartRenderError as error:
+        # The renderer pool is busy or the chart timed out; ask the browser to retry
+        response = HttpResponse(str(error), status=503, content_type='text/plain')
+        response['Retry-After'] = '5'
+        response['Cache-Control'] = 'no-store'
+        return response
+    if chart is None:
+        raise Http404('Chart has expired.')
+
+    response = HttpResponse(chart, content_type=CHART_CONTENT_TYPES[image_format])
+    response['ETag'] = etag
+    # The same URL always produces the same image, so browsers can keep it for a year
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+# Prometheus scrape endpoint: a bearer token (settings.METRICS_TOKEN) or a staff login
+def metrics_view(request):
+    from django.conf import settings
+    from django.utils.crypto import constant_time_compare
+
+    token = settings.METRICS_TOKEN
+    authorized = request.user.is_staff or (
+        token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    )
+    if not authorized:
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+
+    response = HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    response['Cache-Control'] = 'no-store'
+    return response
 
 @login_required
 def add_recipe_view(request):
@@ -92,7 +332,8 @@ def add_recipe_view(request):
         form = AddRecipeForm(request.POST, request.FILES)
         if form.is_valid():
             form.save()  # Save the form data to create a new Recipe
-            return redirect('recipes:list')  # Redirect to the recipe list page (adjust as needed)
+            # Redirect to the recipe list page; this user's next reads skip the replica
+            return pin_to_primary(redirect('recipes:list'))
     else:
         form = AddRecipeForm()
     
@@ -0,0 +1,54 @@
+# Shared ingredient vocabulary: how many recipes use each ingredient.
+# The counts are the catalog's ingredient statistics (catalog_stats.py), which saves, deletes and
+# bulk writes change with atomic "count = count + n" upserts in the database, so concurrent
+# workers never lose an update. Each worker keeps its own copy, read once and then patched with
+# just the ingredient rows changed since (see catalog_index.py), so every worker sees new
+# ingredients on its next request without rereading the whole vocabulary.
+from .catalog_index import CatalogIndex
+from .models import CatalogStat
+
+
+class Vocabulary:
+
+    def __init__(self, counts):
+        self.counts = counts
+        # Sorted (value, label) pairs for the search form's Ingredients field
+        self.choices = [(name, name) for name in sorted(counts)]
+
+
+# Recipes per ingredient name, from the ingredient stats
+def build_vocabulary():
+    rows = CatalogStat.objects.filter(kind=CatalogStat.INGREDIENT, count__gt=0).values_list('key', 'count')
+    return Vocabulary(dict(rows.iterator(chunk_size=2000)))
+
+# Patch in the ingredient counts changed since `since`. Requests may be reading the current
+# counts and choices, so changed copies replace them rather than being edited in place; the
+# choices are only sorted again when an ingredient appears or disappears.
+def apply_changes(vocabulary, since):
+    rows = list(CatalogStat.objects.filter(kind=CatalogStat.INGREDIENT, updated_at__gte=since).values_list('key', 'count', 'updated_at'))
+    if not rows:
+        return None
+
+    counts = dict(vocabulary.counts)
+    names_changed = False
+    for name, count, updated_at in rows:
+        if count > 0:
+            names_changed = names_changed or name not in counts
+            counts[name] = count
+        elif counts.pop(name, None) is not None:
+            names_changed = True
+    vocabulary.counts = counts
+    if names_changed:
+        vocabulary.choices = [(name, name) for name in sorted(counts)]
+    return max(updated_at for name, count, updated_at in rows)
+
+vocabulary_index = CatalogIndex(build_vocabulary, apply_changes)
+
+
+# Counts per ingredient name
+def get_vocabulary():
+    return vocabulary_index.get().counts
+
+# Sorted (value, label) pairs for the search form's Ingredients field
+def get_ingredient_choices():
+    return vocabulary_index.get().choices